@@ -295,7 +295,7 @@ class Analyser:
         # initialise empty map for final lists of instrumentation points
         instrumentation_point_tree = {}
         # get the atoms in the specification
-        atoms = self._specification.get_atoms()
+        atoms = self._specification.compile().get_atoms()
         logging.info(f"atoms = {atoms}")
         # iterate through the atomic constraints
         for (atomic_constraint_index, atomic_constraint) in enumerate(atoms):
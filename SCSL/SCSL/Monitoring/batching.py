@@ -0,0 +1,144 @@
+"""
+Module holding the logic for handing events to the event processing thread in batches during online monitoring.
+
+Putting each event on a queue.Queue takes the queue's lock and notifies its condition variable, which dominates
+the cost of instrumentation for functions that are called often.  Instead, each thread of the program under
+scrutiny appends events to its own buffer, and once a buffer is full, the buffers of all threads are put on the queue
+together, as a single batch in which the events are in the order in which they were appended.  The event processing
+thread flushes buffers that are not yet full at regular intervals.
+"""
+import heapq
+import itertools
+import threading
+import typing
+
+# number of events held in a thread's buffer before the buffer is put on the queue as a batch
+DEFAULT_BATCH_SIZE = 256
+
+
+class _EventBuffer:
+    """
+    Class holding the events appended by a single thread that have not yet been put on the queue.
+    """
+
+    def __init__(self):
+        # the lock is only contended when the event processing thread flushes the buffer
+        self.lock = threading.Lock()
+        # (sequence number, event) pairs
+        self.events = []
+
+
+class EventBatcher:
+    """
+    Class that buffers the events generated by each thread separately, putting them on `event_queue` in batches
+    (lists of events).
+
+    Each event is given a sequence number (under the lock of its buffer) as it is appended.  Buffers are only ever
+    handed off all together, while the locks of all of them are held, so every event appended afterwards has a higher
+    sequence number than every event handed off.  Merging the buffers by sequence number therefore puts the events on
+    the queue in the order in which they were appended, whichever threads appended them, which preserves the order
+    of the events for each specification.
+    """
+
+    def __init__(self, event_queue, batch_size: int = DEFAULT_BATCH_SIZE):
+        self._event_queue = event_queue
+        self._batch_size = batch_size
+        # each thread finds its own buffer here
+        self._local = threading.local()
+        # every buffer created so far, so that buffers can be flushed by a thread other than their owner
+        # (the lock is also held while buffers are handed off, so that batches are put on the queue in order)
+        self._buffers = []
+        self._buffers_lock = threading.Lock()
+        # (taking the next number from a count is atomic)
+        self._sequence_numbers = itertools.count()
+
+    def append(self, event: dict) -> None:
+        """
+        Add `event` to the calling thread's buffer, putting every buffer on the queue if it is full.
+        """
+        try:
+            buffer = self._local.buffer
+        except AttributeError:
+            buffer = self._register_buffer()
+        with buffer.lock:
+            buffer.events.append((next(self._sequence_numbers), event))
+            full = len(buffer.events) >= self._batch_size
+        # (the buffer's lock is released first, since handing off takes the locks of all buffers)
+        if full:
+            self._hand_off()
+
+    def flush(self) -> bool:
+        """
+        Put the events in every buffer on the queue.
+
+        :return: True if any events were put on the queue, False otherwise
+        """
+        return self._hand_off()
+
+    def _register_buffer(self) -> _EventBuffer:
+        """
+        Create a buffer for the calling thread.
+        """
+        buffer = _EventBuffer()
+        with self._buffers_lock:
+            self._buffers.append(buffer)
+        self._local.buffer = buffer
+        return buffer
+
+    def _hand_off(self) -> bool:
+        """
+        Put the events in every buffer on the queue as a single batch, in the order in which they were appended, and
+        empty the buffers.
+
+        :return: True if any events were put on the queue, False otherwise
+        """
+        with self._buffers_lock:
+            # hold the locks of all buffers at once (always taken in the same order)
+            for buffer in self._buffers:
+                buffer.lock.acquire()
+            try:
+                event_lists = [buffer.events for buffer in self._buffers if buffer.events]
+                for buffer in self._buffers:
+                    buffer.events = []
+            finally:
+                for buffer in self._buffers:
+                    buffer.lock.release()
+            if not event_lists:
+                return False
+            # each buffer is in order already (sequence numbers are distinct, so events are never compared)
+            self._event_queue.put([event for _, event in heapq.merge(*event_lists)])
+            return True
+
+
+class SpecificationRouter:
+    """
+    Class that splits each batch by spec id, putting the events for each spec id on its own queue (in order).
+    Events without a spec id (such as signal events) are put on every queue.
+
+    An instance can be given to EventBatcher in place of a single queue, so that each specification can be monitored
+    by its own consumer.
+    """
+
+    def __init__(self, spec_ids_to_queues: dict):
+        self._spec_ids_to_queues = spec_ids_to_queues
+
+    def put(self, batch: list) -> None:
+        for spec_id, events in split_batch_by_spec_id(batch, self._spec_ids_to_queues).items():
+            self._spec_ids_to_queues[spec_id].put(events)
+
+
+def split_batch_by_spec_id(batch: list, spec_ids: typing.Iterable[int]) -> dict:
+    """
+    Split `batch` into a dict mapping each spec id to the list of its events, preserving their order.
+
+    Events without a spec id (such as signal events) are relevant to every specification, so they are put in the
+    list for each of `spec_ids`.
+    """
+    spec_id_to_events = {}
+    for event in batch:
+        if "spec_id" in event:
+            spec_id_to_events.setdefault(event["spec_id"], []).append(event)
+        else:
+            for spec_id in spec_ids:
+                spec_id_to_events.setdefault(spec_id, []).append(event)
+    return spec_id_to_events
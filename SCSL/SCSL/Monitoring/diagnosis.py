@@ -0,0 +1,140 @@
+"""
+Module holding the logic for finding, for each false atom, the function calls made while its constraint was being
+violated, and the point of no return (PNR) among them: the first call made once the time allowed by the constraint
+had been consumed.
+
+A monitor that diagnoses online (see Monitor) does this as soon as each atom is found to be False.  Otherwise, the
+function events of the trace are indexed in a single pass (by atom index, in order of time), so that the calls made
+during the window of each false atom, and the PNR, are found by binary search rather than by scanning the trace.
+
+Since the diagnosis of each false atom is independent of the others, the false atoms can also be diagnosed in
+parallel, by worker processes that are forked once the function events have been indexed, so they share the index
+rather than each reading the trace.
+"""
+import multiprocessing
+import typing
+
+from ..TraceChecker import FunctionCallHistory, ViolationDiagnosis, get_diagnosable_atoms, diagnose_false_atom
+
+# the index of function events and the false atoms to diagnose, set before worker processes are forked to diagnose
+# the false atoms in parallel, so that the workers inherit them rather than having them sent (atoms cannot always be
+# pickled) - they are only read by the workers
+_shared_function_call_index = None
+_shared_false_atoms = None
+
+
+class FunctionCallIndex:
+    """
+    Class holding the function events of a trace, indexed by their atom indices and ordered by time.
+    """
+
+    def __init__(self, trace: typing.Iterable[dict]):
+        """
+        Index the function events in `trace` (which is iterated over once, so can be a TraceFile).
+        """
+        self._atom_index_to_history = {}
+        for event in trace:
+            if event.get("type") == "function":
+                atom_index = event.get("atom_index")
+                if atom_index not in self._atom_index_to_history:
+                    self._atom_index_to_history[atom_index] = FunctionCallHistory()
+                self._atom_index_to_history[atom_index].add(event)
+
+    def get_history(self, atom_index: int) -> FunctionCallHistory:
+        if atom_index not in self._atom_index_to_history:
+            return FunctionCallHistory()
+        return self._atom_index_to_history[atom_index]
+
+
+def _get_diagnosis_key(atom, binding: dict) -> tuple:
+    return atom, tuple(sorted(binding.items()))
+
+
+def diagnose_false_atoms(specification, trace: typing.Iterable[dict], falsifying_atoms: list,
+                         processes: int = 1) -> list:
+    """
+    Diagnose each of `falsifying_atoms` (as given by get_false_atoms_per_false_bindings) whose atom can be diagnosed,
+    from the function events in `trace`.
+
+    If `processes` is more than 1, the false atoms are diagnosed in parallel by that many worker processes (which
+    requires the 'fork' start method, so is not available on Windows).  The diagnoses are in the same order either
+    way.
+    """
+    # map from the atomic constraints that can be diagnosed to their indices
+    atomic_constraint_indices = get_diagnosable_atoms(specification.compile())
+    function_call_index = FunctionCallIndex(trace)
+    # (atom, binding, values, atom index) for each false atom that can be diagnosed
+    false_atoms = [(atomic_constraint, binding, values, atomic_constraint_indices[atomic_constraint])
+                   for atomic_constraint, binding, values in falsifying_atoms
+                   if atomic_constraint in atomic_constraint_indices]
+    if processes > 1 and len(false_atoms) > 1:
+        violation_diagnoses = _diagnose_false_atoms_in_parallel(function_call_index, false_atoms, processes)
+    else:
+        violation_diagnoses = [diagnose_false_atom(atomic_constraint, binding, values,
+                                                   function_call_index.get_history(atom_index))
+                               for atomic_constraint, binding, values, atom_index in false_atoms]
+    return [violation_diagnosis for violation_diagnosis in violation_diagnoses if violation_diagnosis is not None]
+
+
+def _diagnose_false_atoms_in_parallel(function_call_index: FunctionCallIndex, false_atoms: list,
+                                      processes: int) -> list:
+    """
+    Diagnose `false_atoms` on a pool of `processes` worker processes, each of which diagnoses a contiguous range of
+    them, and return the diagnoses (or None, for atoms whose windows are not known) in the order of `false_atoms`.
+    """
+    global _shared_function_call_index, _shared_false_atoms
+    # a few ranges per process, so that a process that is given a range of long windows does not hold up the rest
+    number_of_ranges = min(len(false_atoms), processes * 4)
+    range_bounds = [len(false_atoms) * range_index // number_of_ranges for range_index in range(number_of_ranges + 1)]
+    _shared_function_call_index, _shared_false_atoms = function_call_index, false_atoms
+    try:
+        # each process is forked so that it inherits the index and the false atoms
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes) as pool:
+            range_results = pool.map(_diagnose_false_atoms_in_worker, zip(range_bounds, range_bounds[1:]))
+    finally:
+        _shared_function_call_index, _shared_false_atoms = None, None
+    # only the calls, the points of no return and the overruns are sent back, so put the diagnoses back together here
+    violation_diagnoses = []
+    for (start, end), results in zip(zip(range_bounds, range_bounds[1:]), range_results):
+        for (atomic_constraint, binding, _, _), result in zip(false_atoms[start:end], results):
+            violation_diagnoses.append(None if result is None else
+                                       ViolationDiagnosis(atomic_constraint, binding, *result))
+    return violation_diagnoses
+
+
+def _diagnose_false_atoms_in_worker(bounds: typing.Tuple[int, int]) -> list:
+    """
+    Diagnose the false atoms in the range `bounds` of those shared with this worker, returning the calls, the index
+    of the point of no return and the overrun for each (or None, if its window is not known).
+    """
+    start, end = bounds
+    results = []
+    for atomic_constraint, binding, values, atom_index in _shared_false_atoms[start:end]:
+        violation_diagnosis = diagnose_false_atom(atomic_constraint, binding, values,
+                                                  _shared_function_call_index.get_history(atom_index))
+        if violation_diagnosis is None:
+            results.append(None)
+        else:
+            results.append((violation_diagnosis.get_calls(), violation_diagnosis.get_point_of_no_return_index(),
+                            violation_diagnosis.get_overrun()))
+    return results
+
+
+def select_violation_diagnoses(monitor, falsifying_atoms: list) -> list:
+    """
+    Get the diagnoses made by `monitor` (which diagnoses online) of `falsifying_atoms`, in the same order.
+
+    The monitor diagnoses every atom that is found to be False, including those that turn out not to be why their
+    bindings are False, so these are left out.
+    """
+    key_to_violation_diagnosis = {}
+    for violation_diagnosis in monitor.get_violation_diagnoses():
+        key = _get_diagnosis_key(violation_diagnosis.get_atom(), violation_diagnosis.get_binding())
+        key_to_violation_diagnosis[key] = violation_diagnosis
+    violation_diagnoses = []
+    for atomic_constraint, binding, _ in falsifying_atoms:
+        key = _get_diagnosis_key(atomic_constraint, binding)
+        if key in key_to_violation_diagnosis:
+            violation_diagnoses.append(key_to_violation_diagnosis[key])
+    return violation_diagnoses
@@ -1,29 +1,69 @@
 import atexit
 import datetime
+import functools
 import json
 import logging
+import multiprocessing
+import os
 import pathlib
 import queue
 import sys
 import threading
+import time
 import typing
 
 from typing import List
 
 from SCSL.Specifications.constraints import TimeBetweenLessThanConstant,DurationOfTransitionLessThanNumber
-from ..TraceChecker import Monitor, MonitorTreeQuantifierNode,MonitorTreeConjunctionNode,MonitorTreeDisjunctionNode,MonitorTreeNegateNode,MonitorTreeNode
+from ..TraceChecker import Monitor, combine_verdicts, MonitorTreeQuantifierNode,MonitorTreeConjunctionNode,MonitorTreeDisjunctionNode,MonitorTreeNegateNode,MonitorTreeNode
+from ..TraceChecker import get_false_atoms, binding_creation_order_key, ViolationDiagnosis
+from .batching import EventBatcher, SpecificationRouter, split_batch_by_spec_id
+from .diagnosis import diagnose_false_atoms, select_violation_diagnoses
+from .ring_buffer import SharedMemoryRingBuffer
+from .spooling import TraceSpooler
 
 def default_json_format(obj):
     return str(obj)
 
 _monitor: Monitor = None
-# to use in offline monitoring
-_spec_id_to_event_list: dict = None
-# to use in online monitoring
+# to use in offline monitoring - writes each spec's events to its trace file during execution
+_trace_spooler: TraceSpooler = None
+# compression used for trace files written during offline monitoring (None, 'gzip' or 'lzma')
+_trace_compression: typing.Optional[str] = None
+# to use in online monitoring - holds batches (lists) of events
 _event_queue = None
-# maps spec ids to either _spec_id_to_event_list[spec_id].append (for offline monitoring) or _event_queue.put (for online monitoring)
-_spec_id_to_event_appender: dict = None
+# buffers the events generated by each thread, putting them on _event_queue in batches
+_event_batcher: EventBatcher = None
+# posted on _event_queue to tell the event processing thread that no more events will arrive
+_END_OF_STREAM = object()
+# maximum time (in seconds) an event waits in a thread's buffer before the event processing thread flushes it
+# (this is also how long the event processing thread blocks on _event_queue before checking the main thread is alive)
+_EVENT_FLUSH_INTERVAL = 0.1
+# whether _post_end_of_stream has been registered to run when the interpreter shuts down
+_shutdown_hook_registered: bool = False
+# to use in out-of-process online monitoring - each spec id has its own monitor process, which reads the batches of
+# events for that spec id from a ring buffer and sends back its results through a pipe (all three are mapped from
+# spec ids to by the dictionaries below)
+_out_of_process: bool = False
+_spec_ids_to_ring_buffers: dict = None
+_spec_ids_to_monitor_processes: dict = None
+_spec_ids_to_results_receivers: dict = None
+# flushes _event_batcher at regular intervals during out-of-process online monitoring, until _stop_event_flushing is set
+_event_flushing_thread: threading.Thread = None
+_stop_event_flushing: threading.Event = None
+# _event_batcher.append (for online monitoring)
 _event_appender = None
+# whether online monitors stop processing events once their verdicts can no longer change
+_fail_fast: bool = False
+# whether online monitors retire the subtrees of resolved bindings (see Monitor), so that memory use stays bounded
+_prune: bool = False
+# online monitors time every _event_timing_interval-th event (and no events if it is 0)
+_event_timing_interval: int = 1
+# in fail-fast mode, the spec ids whose verdicts are settled (process_event drops the events for these spec ids)
+_settled_spec_ids: set = set()
+# in fail-fast mode during out-of-process online monitoring, each monitor process sets its event once its verdict is
+# settled, and _flush_event_batches_periodically copies this to _settled_spec_ids
+_spec_ids_to_settled_events: dict = None
 _spec_ids_to_monitors: dict = None
 _monitoring_statistics = {}
 _online: bool = None
@@ -77,7 +117,7 @@ def end_monitoring() -> typing.Optional[dict]:
 
     :return: for online monitoring, dict with monitoring statistics; for offline, `None`
     """
-    global _spec_id_to_event_list, _online, _monitor, _monitoring_statistics,\
+    global _trace_spooler, _online, _monitor, _monitoring_statistics,\
         _start_time, _end_monitoring_called, _spec_ids_to_monitors, _monitoring_running
 
     if _end_monitoring_called:
@@ -91,63 +131,80 @@ def end_monitoring() -> typing.Optional[dict]:
         _monitoring_running = False
 
     if _online:
-        for spec_id in _spec_ids_to_monitors:
+        for spec_id in _monitoring_statistics:
             _monitoring_statistics[spec_id]["program_duration"] = time.time() - _start_time
 
     # In case this function is called explicitly, not necessarily at end of execution
     atexit.unregister(end_monitoring)
     if _online:
         _end_monitoring_called = True
-        _event_processing_thread.join()
-        # wrap up all monitors
-        for spec_id in _spec_ids_to_monitors:
-            print(f"Performing wrap up procedure for monitor for spec id {spec_id}")
-            monitor = _spec_ids_to_monitors[spec_id]
-            monitor.wrap_up()
-            verdict = monitor.get_verdict()
+        if _out_of_process:
+            spec_ids_to_results = _end_monitor_processes()
+        else:
+            # hand over the events still buffered, tell the event processing thread that there are no more events,
+            # then wait for it to process the rest
+            _event_batcher.flush()
+            _event_queue.put(_END_OF_STREAM)
+            _event_processing_thread.join()
+            # wrap up all monitors
+            spec_ids_to_results = {spec_id: _wrap_up_monitor(spec_id, monitor)
+                                   for spec_id, monitor in _spec_ids_to_monitors.items()}
+        for spec_id, results in spec_ids_to_results.items():
+            verdict = results['verdict']
 
             print(f"Final verdict for spec id {spec_id} was {verdict}")
 
-            # get measurements data from the monitor
-            measurement_data = monitor.get_measurements_for_db()
-
             _monitoring_statistics[spec_id]['verdict'] = verdict
-            _monitoring_statistics[spec_id]['measurement_data'] = measurement_data
-            _monitoring_statistics[spec_id]['verdict_explanation'] = monitor.get_verdict_explanation()
+            _monitoring_statistics[spec_id]['measurement_data'] = results['measurement_data']
+            _monitoring_statistics[spec_id]['verdict_explanation'] = results['verdict_explanation']
+            _monitoring_statistics[spec_id]['diagnosis'] = results['diagnosis']
             _monitoring_statistics[spec_id]["monitoring_duration"] = time.time() - _start_time
             _monitoring_statistics[spec_id]["lag"] = \
                 _monitoring_statistics[spec_id]["monitoring_duration"] - \
                 _monitoring_statistics[spec_id]["program_duration"]
             _monitoring_statistics[spec_id]["relative_lag"] = \
                 _monitoring_statistics[spec_id]["lag"] / _monitoring_statistics[spec_id]["program_duration"]
-            event_processing_times = monitor.get_event_processing_times()
-            _monitoring_statistics[spec_id]["event_processing_time"] = sum(event_processing_times)
+            _monitoring_statistics[spec_id]["event_processing_time"] = results['event_processing_time']
             _monitoring_statistics[spec_id]["relative_event_processing_time"] = \
                 _monitoring_statistics[spec_id]["event_processing_time"] / \
                 _monitoring_statistics[spec_id]["program_duration"]
-            _monitoring_statistics[spec_id]["number_of_events"] = monitor.get_number_of_events_observed()
-            _monitoring_statistics[spec_id]["memory_consumed"] = sys.getsizeof(monitor)
+            _monitoring_statistics[spec_id]["number_of_events"] = results['number_of_events']
+            _monitoring_statistics[spec_id]["memory_consumed"] = results['memory_consumed']
 
             print(
                 f'Lag={_monitoring_statistics[spec_id]["lag"]}s ({_monitoring_statistics[spec_id]["relative_lag"] * 100}% of execution time)')
 
             with _project_path.joinpath('monitoring-statistics.json').open('w') as out_file:
                 json.dump(_monitoring_statistics, out_file, default=default_json_format)
-            if _debug:
-                monitor.write_tree_to_file(str(_project_path.joinpath("final-tree.gv")))
+
+        if len(spec_ids_to_results) > 1:
+            combined_verdict = combine_verdicts([results['verdict'] for results in spec_ids_to_results.values()])
+            print(f"Combined verdict for all specifications was {combined_verdict}")
 
         return _monitoring_statistics
     else:  # offline monitoring
-        # write each trace to a file
-        for spec_id, specification in enumerate(_specifications):
-            with open(f'trace-{spec_id}.json', "w") as out_file:
-                # get event list
-                event_list = _spec_id_to_event_list[spec_id]
-                print(f'The trace ({len(event_list)} events) was written as trace-{spec_id}.json!')
-                out_file.write(json.dumps(event_list, cls=CustomJSONizer))
+        # write the events still buffered, followed by a footer, to each trace file
+        numbers_of_events_written = _trace_spooler.close()
+        for spec_id, path in _trace_spooler.get_paths().items():
+            print(f'The trace ({numbers_of_events_written[spec_id]} events) was written as {path}!')
 
 def start_monitoring(specifications, online: bool, auto_end: bool = False, debug: bool = False,
-                     project_path: typing.Union[str, pathlib.Path] = '') -> None:
+                     project_path: typing.Union[str, pathlib.Path] = '',
+                     trace_compression: typing.Optional[str] = None, out_of_process: bool = False,
+                     fail_fast: bool = False, prune: bool = False, event_timing_interval: int = 1) -> None:
+    """
+    Starts monitoring
+
+    For online monitoring, events are processed by monitors running on a background thread or, if `out_of_process` is
+    True, in a separate process (which requires the 'fork' start method, so is not available on Windows).
+    If `fail_fast` is True, the events for a specification are dropped (rather than monitored) once its verdict can no
+    longer change.  If `prune` is True, the subtree for each binding is retired once its value is final, keeping only
+    what is needed to report False bindings, so that memory use does not grow with the running time of the program.
+    Online monitors time every `event_timing_interval`th event (and no events if it is 0), and the event processing
+    time reported is estimated from these.  Online monitors diagnose each violation as soon as it is found (see Monitor),
+    and the diagnosis is reported along with the verdict.
+    For offline monitoring, events are written to trace files, compressed according to `trace_compression`.
+    """
     logging.info('start_monitoring called')
     global _monitoring_running
     with _monitoring_running_semaphore:
@@ -169,48 +226,93 @@ def start_monitoring(specifications, online: bool, auto_end: bool = False, debug
             raise RuntimeError(error_message)
 
     print('Starting monitoring!')
-    global _monitoring_statistics, _online, _start_time, _event_processing_thread, _spec_id_to_event_appender
-    global _event_queue, _spec_id_to_event_list, _project_path, _debug, _specifications, _signals_mentioned_in_specs
-    global _event_appender, _spec_ids_to_monitors, _end_monitoring_called
+    global _monitoring_statistics, _online, _start_time, _event_processing_thread, _trace_spooler
+    global _event_queue, _trace_compression, _project_path, _debug, _specifications, _signals_mentioned_in_specs
+    global _event_appender, _event_batcher, _spec_ids_to_monitors, _end_monitoring_called, _out_of_process
+    global _spec_ids_to_ring_buffers, _spec_ids_to_monitor_processes, _spec_ids_to_results_receivers
+    global _event_flushing_thread, _stop_event_flushing, _fail_fast, _settled_spec_ids, _spec_ids_to_settled_events
+    global _prune, _event_timing_interval
     # All global variables need to be reset in this function, in order to support multiple executions
     _monitoring_statistics.clear()
     _end_monitoring_called = False
     _online = online
     _debug = debug
+    _trace_compression = trace_compression
+    _out_of_process = out_of_process
+    _fail_fast = fail_fast
+    _prune = prune
+    _event_timing_interval = event_timing_interval
+    _settled_spec_ids = set()
+    _spec_ids_to_settled_events = {}
     _project_path = pathlib.Path(project_path).resolve()
     _specifications = specifications
     try:
         _signals_mentioned_in_specs = []
         for specification in _specifications:
-            _signals_mentioned_in_specs += [signal for signal in specification.get_all_signal_names()
+            _signals_mentioned_in_specs += [signal for signal in specification.compile().get_signal_names()
                                            if signal not in _signals_mentioned_in_specs]
     except AttributeError:
         logging.error(f'Could not check which signals are mentioned in the specification. '
                       f'All signals will be recorded.')
 
-    if _online:
+    if _online and _out_of_process:
+        # the monitor for each specification runs in its own process, which reads batches of events from a ring
+        # buffer in shared memory, so monitors for different specifications run in parallel
+        _event_queue = None
+        _spec_ids_to_monitors = {}
+        _spec_ids_to_ring_buffers = {}
+        _spec_ids_to_monitor_processes = {}
+        _spec_ids_to_results_receivers = {}
+        # each process is forked so that it inherits the specifications (which hold lambdas, so cannot be pickled)
+        # and the shared memory
+        context = multiprocessing.get_context('fork')
+        for spec_id in range(len(_specifications)):
+            ring_buffer = SharedMemoryRingBuffer()
+            results_receiver, results_sender = context.Pipe(duplex=False)
+            _spec_ids_to_settled_events[spec_id] = context.Event()
+            monitor_process = context.Process(target=_monitor_process_main,
+                                              args=(spec_id, ring_buffer, results_sender, os.getpid(),
+                                                    _spec_ids_to_settled_events[spec_id]),
+                                              name=f'scsl-monitor-{spec_id}', daemon=True)
+            monitor_process.start()
+            results_sender.close()
+            ring_buffer.set_consumer_alive_check(monitor_process.is_alive)
+            _spec_ids_to_ring_buffers[spec_id] = ring_buffer
+            _spec_ids_to_monitor_processes[spec_id] = monitor_process
+            _spec_ids_to_results_receivers[spec_id] = results_receiver
+        # each batch is split by spec id, and each part is written to the ring buffer for that spec id
+        _event_batcher = EventBatcher(SpecificationRouter(_spec_ids_to_ring_buffers))
+        _event_appender = _event_batcher.append
+        # batches that are not yet full are flushed at regular intervals by a separate thread
+        # (started after forking, since only the forking thread exists in a forked process)
+        _stop_event_flushing = threading.Event()
+        _event_flushing_thread = threading.Thread(target=_flush_event_batches_periodically,
+                                                  args=(_event_batcher, _stop_event_flushing),
+                                                  name='scsl-event-flushing', daemon=True)
+        _event_flushing_thread.start()
+    elif _online:
         # we initialise a single event queue and processing thread
-        # all events will go on the same queue, and will be consumed by the same thread
+        # all events will go on the same queue (in batches), and will be consumed by the same thread
         # the event processing thread will then route each event to the relevant monitor
         _event_queue = queue.Queue()
-        _event_appender = _event_queue.put
+        _event_batcher = EventBatcher(_event_queue)
+        _event_appender = _event_batcher.append
         # initialise empty dictionary mapping spec ids to monitor instances
         _spec_ids_to_monitors = {}
         # initialise monitor for each specification
         for spec_id, specification in enumerate(_specifications):
-            _spec_ids_to_monitors[spec_id] = Monitor(specification)
+            _spec_ids_to_monitors[spec_id] = Monitor(specification, fail_fast=_fail_fast, prune=_prune,
+                                                     event_timing_interval=_event_timing_interval,
+                                                     online_diagnosis=True)
         # set up and start event processing thread
         _event_processing_thread = threading.Thread(target=online_event_background_processing)
         _event_processing_thread.start()
+        _register_shutdown_hook()
     else:
-        # initialise empty dictionary mapping spec ids to event lists
-        _spec_id_to_event_list = {}
-        # initialise empty dictionary mapping spec ids to event appender functions
-        _spec_id_to_event_appender = {}
-        # initialise empty event list for each specification
-        for spec_id, specification in enumerate(_specifications):
-            _spec_id_to_event_list[spec_id] = []
-            _spec_id_to_event_appender[spec_id] = _spec_id_to_event_list[spec_id].append
+        # initialise a spooler that writes the events for each specification to its own trace file
+        _trace_spooler = TraceSpooler(range(len(_specifications)),
+                                      compression=_trace_compression,
+                                      json_encoder=CustomJSONizer)
 
     # initialise logging
     logging_path = pathlib.Path('./logs')
@@ -231,26 +333,28 @@ def start_monitoring(specifications, online: bool, auto_end: bool = False, debug
 
 
 def process_event(event):
-    global _n_events_observed, _event_appender, _allow_restart
+    global _n_events_observed, _allow_restart
     _n_events_observed += 1
     if not _monitoring_running:
         if _allow_restart and _specifications is not None:
             logging.info('Automatic restart of monitoring is enabled. Restarting monitoring!')
-            start_monitoring(_specifications, _online, False, _debug, _project_path)
+            start_monitoring(_specifications, _online, False, _debug, _project_path, _trace_compression,
+                             fail_fast=_fail_fast, prune=_prune, event_timing_interval=_event_timing_interval)
         else:
             logging.error('Error processing event – monitoring has not yet started! Event ignored.')
             return
 
     if _online:
-        # monitoring - each event is routed to the same event queue
+        if _settled_spec_ids and (event.get("spec_id") in _settled_spec_ids
+                                  or len(_settled_spec_ids) == len(_specifications)):
+            # fail-fast - the verdict for this event's specification (or, for signals, for every specification)
+            # can no longer change, so the event is not needed
+            return
+        # monitoring - each event is buffered, and then routed to the same event queue
         _event_appender(event)
     else:
         # trace checking - each event is routed to the relevant trace
-        # get the spec id
-        spec_id = event["spec_id"]
-        # get the event appender function
-        event_appender = _spec_id_to_event_appender[spec_id]
-        event_appender(event)
+        _trace_spooler.append(event["spec_id"], event)
 
 
 def process_signal_event(signal_name: str, value: float):
@@ -266,64 +370,216 @@ def process_signal_event(signal_name: str, value: float):
     })
 
 
+def _wrap_up_monitor(spec_id: int, monitor: Monitor) -> dict:
+    """
+    Wrap up `monitor` and gather the results that end_monitoring reports for it
+    """
+    print(f"Performing wrap up procedure for monitor for spec id {spec_id}")
+    monitor.wrap_up()
+    if _debug:
+        monitor.write_tree_to_file(str(_project_path.joinpath("final-tree.gv")))
+    return {
+        'verdict': monitor.get_verdict(),
+        # get measurements data from the monitor
+        'measurement_data': monitor.get_measurements_for_db(),
+        'verdict_explanation': monitor.get_verdict_explanation(),
+        # the violations were diagnosed as they were found
+        'diagnosis': [entry for entry in map(ViolationDiagnosis.to_entry,
+                                             select_violation_diagnoses(monitor,
+                                                                        get_false_atoms_per_false_bindings(monitor)))
+                      if entry is not None],
+        'event_processing_time': monitor.get_event_processing_time(),
+        'number_of_events': monitor.get_number_of_events_observed(),
+        'memory_consumed': sys.getsizeof(monitor)
+    }
+
+
+def _monitor_process_main(spec_id: int, ring_buffer: SharedMemoryRingBuffer, results_sender, parent_pid: int,
+                          settled_event):
+    """
+    Process batches of events for `spec_id` from `ring_buffer` in its monitor process, until the end of the stream is
+    reached, then send the results back to the program under scrutiny
+
+    In fail-fast mode, `settled_event` is set once the verdict is settled.  Batches are still read (and dropped) after
+    that, so that the program under scrutiny never waits for space in the ring buffer.
+    """
+    monitor = Monitor(_specifications[spec_id], fail_fast=_fail_fast, prune=_prune,
+                      event_timing_interval=_event_timing_interval, online_diagnosis=True)
+    events_processed = 0
+    while True:
+        try:
+            batch = ring_buffer.get(timeout=_EVENT_FLUSH_INTERVAL)
+        except queue.Empty:
+            # stop if the program under scrutiny was killed (so we were adopted by another process)
+            if os.getppid() != parent_pid:
+                logging.info('The program under scrutiny is no longer running')
+                return
+            continue
+        if batch is None:
+            break
+        monitor.process_events(batch)
+        events_processed += len(batch)
+        if _fail_fast and not settled_event.is_set() and monitor.is_verdict_settled():
+            logging.info(f'The verdict for spec id {spec_id} is settled')
+            settled_event.set()
+    logging.info(f'_monitor_process_main finished:\n\t{spec_id=}, {events_processed=}')
+    results_sender.send(_wrap_up_monitor(spec_id, monitor))
+    results_sender.close()
+
+
+def _flush_event_batches_periodically(event_batcher: EventBatcher, stop: threading.Event):
+    """
+    Flush the buffers of `event_batcher` every _EVENT_FLUSH_INTERVAL seconds until `stop` is set
+
+    In fail-fast mode, this is also when the spec ids whose monitor processes have settled their verdicts are found.
+    """
+    while not stop.wait(_EVENT_FLUSH_INTERVAL):
+        if _fail_fast:
+            _update_settled_spec_ids({spec_id for spec_id, settled_event in _spec_ids_to_settled_events.items()
+                                      if settled_event.is_set()})
+        event_batcher.flush()
+
+
+def _update_settled_spec_ids(settled_spec_ids: set):
+    """
+    Make process_event drop the events for the spec ids in `settled_spec_ids`, whose verdicts can no longer change
+    """
+    global _settled_spec_ids
+    if not settled_spec_ids.issubset(_settled_spec_ids):
+        # replace the set rather than adding to it, since process_event reads it without a lock
+        _settled_spec_ids = _settled_spec_ids | settled_spec_ids
+        logging.info(f'Events for spec ids {sorted(_settled_spec_ids)} are no longer monitored (fail-fast)')
+
+
+def _end_monitor_processes() -> dict:
+    """
+    Hand over the events still buffered, tell the monitor processes that there are no more events, then wait for
+    the results for each spec id
+    """
+    _stop_event_flushing.set()
+    _event_flushing_thread.join()
+    _event_batcher.flush()
+    # tell every process to finish before waiting for any of them, so that they wrap up in parallel
+    for ring_buffer in _spec_ids_to_ring_buffers.values():
+        ring_buffer.put_end_of_stream()
+    spec_ids_to_results = {}
+    for spec_id, results_receiver in _spec_ids_to_results_receivers.items():
+        try:
+            spec_ids_to_results[spec_id] = results_receiver.recv()
+        except EOFError:
+            logging.error(f'The monitor process for spec id {spec_id} stopped without sending its results.')
+            spec_ids_to_results[spec_id] = {'verdict': None,
+                                            'measurement_data': [],
+                                            'verdict_explanation': 'The monitor process stopped without a verdict.',
+                                            'diagnosis': [],
+                                            'event_processing_time': 0,
+                                            'number_of_events': 0,
+                                            'memory_consumed': 0}
+        _spec_ids_to_monitor_processes[spec_id].join()
+        _spec_ids_to_ring_buffers[spec_id].close()
+    return spec_ids_to_results
+
+
+def _post_end_of_stream():
+    """
+    Tell the event processing thread (if there is one) that the main thread has finished, so no more events will arrive
+    """
+    if _event_queue is not None:
+        _event_batcher.flush()
+        _event_queue.put(_END_OF_STREAM)
+
+
+def _register_shutdown_hook():
+    """
+    Arrange for _post_end_of_stream to be called when the main thread finishes
+
+    The event processing thread is not a daemon, so the interpreter waits for it before running functions registered
+    with atexit.  Hence, we use the hook that threading runs before waiting for non-daemon threads, when available.
+    Otherwise, the event processing thread falls back to checking whether the main thread is alive whenever it
+    has been waiting for an event for _EVENT_FLUSH_INTERVAL seconds.
+    """
+    global _shutdown_hook_registered
+    if _shutdown_hook_registered:
+        return
+    register_before_thread_joins = getattr(threading, '_register_atexit', None)
+    if register_before_thread_joins is None:
+        return
+    try:
+        register_before_thread_joins(_post_end_of_stream)
+        _shutdown_hook_registered = True
+    except RuntimeError:
+        # the interpreter is already shutting down
+        logging.warning('Could not register the end of stream hook, since the interpreter is shutting down.')
+
+
 def online_event_background_processing():
     """
     Process events in the background during online monitoring
+
+    The thread blocks on the event queue, so it uses almost no CPU time while the program under scrutiny generates no
+    events.  Every _EVENT_FLUSH_INTERVAL seconds, it flushes the buffers of events that have not yet been put on the
+    queue.  It finishes once it takes _END_OF_STREAM from the queue (posted by end_monitoring, or when the main thread
+    finishes), at which point every event put on the queue before it has been processed.
     """
+    # take references to the queue, the batcher and the monitors, in case monitoring is restarted with new ones
+    event_queue = _event_queue
+    event_batcher = _event_batcher
+    spec_ids_to_monitors = _spec_ids_to_monitors
     events_processed = 0
-    loop_iterations = 0
-    iterations_since_last_event = 0
+    batches_processed = 0
     main_thread_checks = 0
+    last_flush_time = time.monotonic()
 
     while True:
-        loop_iterations += 1
-        # if loop_iterations % 10000 == 0:
-        #     return
-        if _event_queue.empty():
-            iterations_since_last_event += 1
-            # Event queue is empty. This means that either:
-            #    1) monitoring was ended by calling end_monitoring(), or
-            #    2) all events generated so far have already been processed, and the program under scrutiny has not yet
-            #       generated any new events.
-            if _end_monitoring_called:
-                # End background processing
-                logging.info(
-                    f'online_event_background_processing finished:\n\t{events_processed=}, {loop_iterations=}, {main_thread_checks=}')
-                return
-            # elif loop_iterations % 1_000_000 == 0 and not threading.main_thread().is_alive():
-            elif iterations_since_last_event % 100 == 0:
-                main_thread_checks += 1
-                if not threading.main_thread().is_alive():
-                    logging.info('The main thread is no longer alive')
-                    logging.info(
-                        f'online_event_background_processing finished:\n\t{events_processed=}, {loop_iterations=}, {main_thread_checks=}')
-                    return
-            else:
-                # Return control to the program under scrutiny
-                time.sleep(0)
-        else:  # If the event queue is not empty
-            # Process an event
-            iterations_since_last_event = 0
-            # Process one event
-            # If we set block=True, we wouldn't be able to detect the main thread ending
-            latest_event = _event_queue.get(block=False)
-            # get the spec id for the monitor that it should go to
-            spec_id = latest_event["spec_id"]
-            # get the relevant monitor
-            monitor = _spec_ids_to_monitors[spec_id]
-            # process the event
-            monitor.process_event(latest_event)
-            _event_queue.task_done()
-            events_processed += 1
+        try:
+            batch = event_queue.get(timeout=_EVENT_FLUSH_INTERVAL)
+        except queue.Empty:
+            # No batch arrived before the timeout. This means that either:
+            #    1) events are waiting in buffers that are not yet full,
+            #    2) the main thread finished without the end of stream being posted, or
+            #    3) the program under scrutiny has not generated any new events.
+            last_flush_time = time.monotonic()
+            if event_batcher.flush():
+                continue
+            main_thread_checks += 1
+            if not threading.main_thread().is_alive():
+                logging.info('The main thread is no longer alive')
+                break
+            continue
+        if batch is _END_OF_STREAM:
+            event_queue.task_done()
+            break
+        _process_batch(batch, spec_ids_to_monitors)
+        event_queue.task_done()
+        if _fail_fast:
+            _update_settled_spec_ids({spec_id for spec_id, monitor in spec_ids_to_monitors.items()
+                                      if monitor.is_verdict_settled()})
+        events_processed += len(batch)
+        batches_processed += 1
+        # make sure that events do not wait in buffers for too long while other buffers keep the queue busy
+        if time.monotonic() - last_flush_time >= _EVENT_FLUSH_INTERVAL:
+            last_flush_time = time.monotonic()
+            event_batcher.flush()
+
+    logging.info(
+        f'online_event_background_processing finished:\n\t{events_processed=}, {batches_processed=}, '
+        f'{main_thread_checks=}')
+
+
+def _process_batch(batch: list, spec_ids_to_monitors: dict):
+    """
+    Route the events in `batch` to the relevant monitors, preserving the order of the events for each spec id
+    (events without a spec id, such as signal events, go to every monitor)
+    """
+    # split the batch by spec id, then process the events for each spec id with the relevant monitor
+    for spec_id, events in split_batch_by_spec_id(batch, spec_ids_to_monitors).items():
+        spec_ids_to_monitors[spec_id].process_events(events)
 
 
 ###################################################################################################
 #       The functions below are part of diagnosis      #
 ###################################################################################################
 # EVALUATION
-import functools
-import time
-
 def timer(get_diagnosis):
     @functools.wraps(get_diagnosis)
     def wrapper_timer(*args, **kwargs):
@@ -337,199 +593,63 @@ def timer(get_diagnosis):
 # end EVALUATION
 
 def get_false_atoms_per_false_bindings(monitor):
-    # Get monitoring tree and traverse it each branch depthwise. each branch from root represents a binding
-    # start at root of tree which is self._monitoring_tree
-    # once you find a node that is no longer a quantifier: if type(current_node) is MonitorTreeQuantifierNode:
-    # get next node, and get it value as it is gonna be the result of the boolean connectives
-    # get its value (boolean)
-    # if its false, then it represents the binding we want so use get binding
-    binding_nodes = []
+    # each child of a quantifier node that is not itself a quantifier node is the root of the subtree for a binding.
+    # the monitor keeps the roots of the bindings that are False as values are propagated, so only the subtrees of
+    # those bindings are walked, rather than the whole tree
     falsifying_atoms = []
-    # traverse the nodes in the monitoring tree
-    for node in monitor._all_nodes:
-        # if the node we observe is not a quantifier anymore
-        if not isinstance(node, MonitorTreeQuantifierNode):
-            # we get the parent of that node
-            parent= node.get_parent()
-            # if the parent is a quantifier
-            if isinstance(parent, MonitorTreeQuantifierNode):
-                # then the node we observed is a binding
-                binding_nodes.append(node)
-
-    # for each binding
-    for binding_node in binding_nodes:
-        # we get the false bindings
-        if binding_node.get_value() == False:
-            #for each false binding we find the falsifying atoms
-            get_false_atoms(falsifying_atoms, binding_node)
-
-    return falsifying_atoms
+    for binding_node in monitor.get_false_binding_nodes():
+        # for each false binding we find the falsifying atoms
+        get_false_atoms(falsifying_atoms, binding_node)
 
-def get_false_atoms(falsifying_atoms:list, child):
-    unwanted_types_node = [MonitorTreeConjunctionNode,MonitorTreeDisjunctionNode,MonitorTreeNegateNode]
-    #stop condition for the recursive algorithm
-    if type(child) not in unwanted_types_node:
-        # if the binding/child is in one of the unwanted types
-        #we check if the child is false
-        if child.get_value() == False:
-            #if is_normal_atom(child ) or is_mixed_atom(child) then
-            #parent is quantifier
-            for t in unwanted_types_node:
-                # if the parent is in one of the unwanted types
-                if isinstance(child.get_parent(), t):
-                    # then we check if child is already in falsifying_atoms
-                    if child.get_subformula() not in falsifying_atoms:
-                        atom_children=[]
-                        #get children of the current atom
-                        for atom_child in child.get_children():
-                            atom_children.append(atom_child.get_value())
-                        # we add the subformula of the child (which is an atom)
-                        falsifying_atoms.append(tuple((child.get_subformula(),child.get_binding(),atom_children)))
-
-                    return falsifying_atoms
-                elif isinstance(child,MonitorTreeNode) and isinstance(child.get_parent(),MonitorTreeQuantifierNode):
-                    # then we check if child is already in falsifying_atoms
-                    if child.get_subformula() not in falsifying_atoms:
-                        atom_children = []
-                        # get children of the current atom
-                        for atom_child in child.get_children():
-                            atom_children.append(atom_child.get_value())
-                        # we add the subformula of the child (which is an atom)
-                        falsifying_atoms.append(tuple((child.get_subformula(), child.get_binding(), atom_children)))
-                    return falsifying_atoms
-
-    # if binding is a disjunction then the only way it is false is only if both children are false
-    if isinstance(child,MonitorTreeDisjunctionNode) and child.get_value() == False:
-        if child.get_children()[0].get_value() == False and child.get_children()[1].get_value() == False:
-            get_false_atoms(falsifying_atoms, child.get_children()[0])
-            get_false_atoms(falsifying_atoms, child.get_children()[1])
-
-    # if binding is a conjuction then it is false if the children have the following truth values
-    elif isinstance(child,MonitorTreeConjunctionNode) and child.get_value() == False:
-        if child.get_children()[0].get_value() == False and child.get_children()[1].get_value() == False:
-            get_false_atoms(falsifying_atoms, child.get_children()[0])
-            get_false_atoms(falsifying_atoms, child.get_children()[1])
-        elif child.get_children()[0].get_value() == False and child.get_children()[1].get_value() != False:
-            get_false_atoms(falsifying_atoms, child.get_children()[0])
-        elif child.get_children()[0].get_value() != False and child.get_children()[1].get_value() == False:
-            get_false_atoms(falsifying_atoms, child.get_children()[1])
-
-    #then binding/child is a complex formula so lets look at it's children
-    elif not isinstance(child,MonitorTreeNegateNode):
-        children= child.get_children()
-        for child_node in children:
-            get_false_atoms(falsifying_atoms, child_node)
-
-    # elif isinstance(child.get_parent(),MonitorTreeQuantifierNode):
+    # add the falsifying atoms of the bindings whose subtrees were retired, then restore the order of the bindings
+    if monitor.get_binding_summaries():
+        for binding_summary in monitor.get_binding_summaries():
+            falsifying_atoms += binding_summary.get_falsifying_atoms()
+        falsifying_atoms.sort(key=lambda false_atom: binding_creation_order_key(false_atom[1]))
 
+    return falsifying_atoms
 
 # parse the json file to get the PNR
+# if `monitor` diagnoses online, `trace` is not read at all, and otherwise it is only iterated over (once, to index its
+# function events), so it can be a list of events or a TraceFile.  if `processes` is more than 1, the false atoms are
+# diagnosed in parallel (see diagnose_false_atoms)
 @timer
-def get_diagnosis(specification, trace:list, monitor):
+def get_diagnosis(specification, trace: typing.Iterable[dict], monitor, processes: int = 1):
     falsifying_atoms = get_false_atoms_per_false_bindings(monitor)
-    atomic_constraints = specification.get_atoms()
-    atomic_constraints_constants = []
-
-    for atom in atomic_constraints:
-        # get max time allowed by the timebetween atomic constraint
-        constant = atom.get_constant()
-        # save the constants of timebetween atomic constraints together with the atomic constaint id it got extracted from
-        atomic_constraints_constants.append(tuple((atom, constant)))
-
-    trace_functions = []
     diagnosis = []
-    for false_atom in falsifying_atoms:
-        # value = {i for i in false_atom[1] if false_atom[1][i] == false_atom[1][0]}
-        if "<=" in str(false_atom[0]):
-            case_symbol = 0
-        elif "<" in str(false_atom[0]):
-            case_symbol = 1
-
-        # get time restriction from specification
-        for atomic_constraint in atomic_constraints_constants:
-            print("false",false_atom[0])
-            if false_atom[0] == atomic_constraint[0]:
-                # get time constant for each atomic constraint
-                constant = atomic_constraint[1]
-                # # get atom index
-                # atom_index = int (atomic_constraint[0])
-
-                #add events to list if the function are in between lhs and rhs
-                add_event = False
-                for event in trace:
-                    if isinstance(atomic_constraint[0], TimeBetweenLessThanConstant):
-                        # extract all functions related to one atom
-                        if event.get("value") == false_atom[2][0]:
-                            #get the timestamp of the lhs of the atom
-                            lhs_value = event.get("time")
-                            trace_functions.append(event)
-                            add_event=True
-                        elif event.get("value") == false_atom[2][1]:
-                            #get the timestamp of the rhs of the atom
-                            rhs_value = event.get("time")
-                            #specification comparison its <=
-                            if case_symbol ==0:
-                                trace_functions.append(event)
-                                add_event=False
-                            #specification comparison its <
-                            elif case_symbol ==1:
-                                add_event=False
-
-
-                        if add_event and event.get("type")=="function":
-                            if event not in trace_functions:
-                                trace_functions.append(event)
-
-                    elif isinstance(atomic_constraint[0], DurationOfTransitionLessThanNumber):
-                        lhs_value = event.get("time")
-                        if event.get("type") == "function":
-                            if event not in trace_functions:
-                                trace_functions.append(event)
-
-
-                print("\nFor atom = ", false_atom[0],"at binding =",false_atom[1], "we recorded the following function calls:\n")
-
-
-                for trace_event in trace_functions:
-                    #Find PNR
-                    #condition: check if timestamp of an event happens after the allowed time
-                    if trace_event.get("type") == "function":
-                        if case_symbol == 0:
-                            if trace_event.get('time') >= lhs_value+constant:
-                                print("In atom =",trace_event.get('atom_index'),"we found the "+'\033[1m'+"point of no return:", trace_event.get('function_name'),'\033[0m',
-                                      ", that was called at time =",trace_event.get('time'), "in line number", trace_event.get('line_number'),
-                                      ". The call of", trace_event.get('function_name'), "happened after the time",constant,"was consumed.")
-                                diagnosis.append(tuple((str(false_atom[0]),(false_atom[1]),len(trace_functions),trace_event.get('function_name'),trace_event.get('line_number'))))
-
-                                # we select only the earliest concrete state that satisfies the condition
-                                break
-                            else:
-                                print("For each atomic constraint we say that something happened between these functions that led to the time being consumed")
-                                # print all the functions before the time was consumed
-                                print("In atom =", trace_event.get('atom_index'), "the function",  trace_event.get('function_name'),
-                                      "was called, at time =",  trace_event.get('time'), "in line number",  trace_event.get('line_number'))
-                        elif case_symbol == 1:
-                            if trace_event.get('time') > lhs_value+constant:
-                                print("In atom =",trace_event.get('atom_index'),"we found the "+'\033[1m'+"point of no return:", trace_event.get('function_name'),'\033[0m',
-                                      ", that was called at time =",trace_event.get('time'), "in line number", trace_event.get('line_number'),
-                                      ". The call of", trace_event.get('function_name'), "happened after the time",constant,"was consumed.")
-
-                                diagnosis.append(tuple((str(false_atom[0]),(false_atom[1]),len(trace_functions),trace_event.get('function_name'),trace_event.get('line_number'))))
-
-                                # we select only the earliest concrete state that satisfies the condition
-                                break
-
-                            else:
-                                print("For each atomic constraint we say that something happened between these functions that led to the time being consumed")
-                                # print all the functions before the time was consumed
-                                print("In atom =", trace_event.get('atom_index'), "the function",  trace_event.get('function_name'),
-                                      "was called, at time =",  trace_event.get('time'), "in line number",  trace_event.get('line_number'))
-
-                print("Diagnosis", diagnosis)
+    if not falsifying_atoms:
+        return diagnosis
+    if monitor.is_diagnosing_online():
+        # the atoms were diagnosed as soon as they were found to be False
+        violation_diagnoses = select_violation_diagnoses(monitor, falsifying_atoms)
+    else:
+        violation_diagnoses = diagnose_false_atoms(specification, trace, falsifying_atoms, processes)
 
+    for violation_diagnosis in violation_diagnoses:
+        print_violation_diagnosis(violation_diagnosis)
+        entry = violation_diagnosis.to_entry()
+        if entry is not None:
+            diagnosis.append(entry)
 
+    print("Diagnosis", diagnosis)
     return diagnosis
 
+
+def print_violation_diagnosis(violation_diagnosis):
+    print("\nFor atom = ", violation_diagnosis.get_atom(), "at binding =", violation_diagnosis.get_binding(),
+          "we recorded the following function calls:\n")
+    for trace_event in violation_diagnosis.get_calls_before_point_of_no_return():
+        print("For each atomic constraint we say that something happened between these functions that led to the time being consumed")
+        # print all the functions before the time was consumed
+        print("In atom =", trace_event.get('atom_index'), "the function", trace_event.get('function_name'),
+              "was called, at time =", trace_event.get('time'), "in line number", trace_event.get('line_number'))
+    trace_event = violation_diagnosis.get_point_of_no_return()
+    if trace_event is not None:
+        print("In atom =",trace_event.get('atom_index'),"we found the "+'\033[1m'+"point of no return:", trace_event.get('function_name'),'\033[0m',
+              ", that was called at time =",trace_event.get('time'), "in line number", trace_event.get('line_number'),
+              ". The call of", trace_event.get('function_name'), "happened after the time",
+              violation_diagnosis.get_atom().get_constant(), "was consumed.")
+
 ###################################################################################################
 #       The functions below should only be called by code inserted during instrumentation.        #
 ###################################################################################################
@@ -542,6 +662,9 @@ def _start_monitoring_instr(specifications, online: bool, debug: bool = False,
 def _wrap_function(function: typing.Callable, spec_id, atom_index, subatom_index, module_name, line_number, *args, **kwargs):
     logging.debug(f'_wrap_function({function=}, {spec_id=}, {atom_index=}, {subatom_index=}, {module_name=},'
                   f' {line_number=}, {args=}, {kwargs=})')
+    if _settled_spec_ids and spec_id in _settled_spec_ids:
+        # fail-fast - the verdict for this specification can no longer change, so there is no need to measure the call
+        return function(*args, **kwargs)
     timestamp_1 = time.time()
     return_value = function(*args, **kwargs)
     timestamp_2 = time.time()
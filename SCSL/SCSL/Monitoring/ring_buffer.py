@@ -0,0 +1,167 @@
+"""
+Module holding a ring buffer in shared memory, used to hand batches of events to a monitor process.
+
+The shared memory starts with a fixed header holding the capacity of the data region and the numbers of bytes written
+and read so far.  These positions only ever increase, and are taken modulo the capacity to index the data region.
+Each record in the data region has a fixed header (the length of its payload and its kind) followed by its payload,
+which may wrap around the end of the data region.
+
+The producer side may be used by many threads of one process, and the consumer side by a single thread of another.
+"""
+import logging
+import pickle
+import queue
+import struct
+import threading
+import time
+import typing
+
+from multiprocessing import shared_memory
+
+# capacity (in bytes) of the data region
+DEFAULT_CAPACITY = 1 << 24
+
+# layout of the header: capacity, write position, read position
+_HEADER = struct.Struct('<QQQ')
+_POSITION = struct.Struct('<Q')
+_WRITE_POSITION_OFFSET = 8
+_READ_POSITION_OFFSET = 16
+
+# layout of each record's header: payload length, record kind
+_RECORD_HEADER = struct.Struct('<IB')
+_BATCH_RECORD = 0
+_END_OF_STREAM_RECORD = 1
+
+# bounds on the time (in seconds) spent sleeping between checks while waiting for space or for records
+_MIN_WAIT = 0.0001
+_MAX_WAIT = 0.01
+
+
+class SharedMemoryRingBuffer:
+    """
+    Class representing a ring buffer of batches of events in shared memory.
+
+    The ring buffer must be created before the consumer process is forked, so that both processes map the same memory.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._shared_memory = shared_memory.SharedMemory(create=True, size=_HEADER.size + capacity)
+        self._buffer = self._shared_memory.buf
+        _HEADER.pack_into(self._buffer, 0, capacity, 0, 0)
+        self._capacity = capacity
+        # only one thread can write a record at a time
+        self._write_lock = threading.Lock()
+        # used by producers to stop waiting for space if the consumer has stopped
+        self._consumer_alive = None
+        self._consumer_stopped = False
+
+    def set_consumer_alive_check(self, consumer_alive: typing.Callable[[], bool]) -> None:
+        """
+        Set the function that producers call to check that the consumer is still alive while waiting for space.
+        """
+        self._consumer_alive = consumer_alive
+
+    def put(self, batch: list) -> None:
+        """
+        Write `batch` to the ring buffer, waiting for space if necessary.
+
+        If the consumer has stopped, the batch is dropped, since the program under scrutiny must not be blocked.
+        A batch too large for the ring buffer is written as several smaller batches (in order), and an event that is
+        too large by itself is dropped, since this is called by threads of the program under scrutiny, so must not
+        raise.
+        """
+        payload = pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL)
+        if _RECORD_HEADER.size + len(payload) <= self._capacity:
+            self._write_record(_BATCH_RECORD, payload)
+        elif len(batch) > 1:
+            middle = len(batch) // 2
+            self.put(batch[:middle])
+            self.put(batch[middle:])
+        else:
+            logging.error(f'An event of {len(payload)} bytes does not fit in a ring buffer of {self._capacity} bytes, '
+                          f'so it was dropped.')
+
+    def put_end_of_stream(self) -> None:
+        """
+        Tell the consumer that no more batches will be written.
+        """
+        self._write_record(_END_OF_STREAM_RECORD, b'')
+
+    def get(self, timeout: typing.Optional[float] = None) -> typing.Optional[list]:
+        """
+        Read the next batch from the ring buffer, waiting for one if necessary.
+
+        :return: the batch, or None if the end of the stream has been reached
+        :raises queue.Empty: if no batch was written within `timeout` seconds
+        """
+        read_position = self._get_position(_READ_POSITION_OFFSET)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        wait = _MIN_WAIT
+        while self._get_position(_WRITE_POSITION_OFFSET) == read_position:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise queue.Empty
+            time.sleep(wait)
+            wait = min(2 * wait, _MAX_WAIT)
+        # the whole record is in the ring buffer, since the write position is only updated after it has been copied
+        payload_length, kind = _RECORD_HEADER.unpack(self._copy_out(read_position, _RECORD_HEADER.size))
+        payload = self._copy_out(read_position + _RECORD_HEADER.size, payload_length)
+        self._set_position(_READ_POSITION_OFFSET, read_position + _RECORD_HEADER.size + payload_length)
+        if kind == _END_OF_STREAM_RECORD:
+            return None
+        return pickle.loads(payload)
+
+    def close(self) -> None:
+        """
+        Release the shared memory.  Should only be called once the consumer has stopped.
+        """
+        # drop our reference to the memory, since it cannot be closed while views of it exist
+        self._buffer = None
+        self._shared_memory.close()
+        self._shared_memory.unlink()
+
+    def _write_record(self, kind: int, payload: bytes) -> None:
+        """
+        Write a record with the given kind and payload, waiting until there is space for it.  Assumes that the record
+        fits in the ring buffer.
+        """
+        record = _RECORD_HEADER.pack(len(payload), kind) + payload
+        with self._write_lock:
+            if self._consumer_stopped:
+                return
+            write_position = self._get_position(_WRITE_POSITION_OFFSET)
+            wait = _MIN_WAIT
+            while len(record) > self._capacity - (write_position - self._get_position(_READ_POSITION_OFFSET)):
+                if self._consumer_alive is not None and not self._consumer_alive():
+                    logging.error('The consumer of the ring buffer has stopped. Further events will be dropped.')
+                    self._consumer_stopped = True
+                    return
+                time.sleep(wait)
+                wait = min(2 * wait, _MAX_WAIT)
+            self._copy_in(write_position, record)
+            # publish the record only once it has been copied in full
+            self._set_position(_WRITE_POSITION_OFFSET, write_position + len(record))
+
+    def _get_position(self, offset: int) -> int:
+        return _POSITION.unpack_from(self._buffer, offset)[0]
+
+    def _set_position(self, offset: int, position: int) -> None:
+        _POSITION.pack_into(self._buffer, offset, position)
+
+    def _copy_in(self, position: int, data: bytes) -> None:
+        """
+        Copy `data` into the data region, starting at `position` and wrapping around its end if necessary.
+        """
+        data = memoryview(data)
+        start = position % self._capacity
+        first_part_length = min(len(data), self._capacity - start)
+        self._buffer[_HEADER.size + start:_HEADER.size + start + first_part_length] = data[:first_part_length]
+        self._buffer[_HEADER.size:_HEADER.size + len(data) - first_part_length] = data[first_part_length:]
+
+    def _copy_out(self, position: int, length: int) -> bytes:
+        """
+        Copy `length` bytes out of the data region, starting at `position` and wrapping around its end if necessary.
+        """
+        start = position % self._capacity
+        first_part_length = min(length, self._capacity - start)
+        return bytes(self._buffer[_HEADER.size + start:_HEADER.size + start + first_part_length]) + \
+            bytes(self._buffer[_HEADER.size:_HEADER.size + length - first_part_length])
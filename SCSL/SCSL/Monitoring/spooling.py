@@ -0,0 +1,196 @@
+"""
+Module holding the logic for writing traces to disk during offline monitoring.
+
+Rather than holding every event in memory until monitoring ends, events are buffered in chunks
+and each chunk is written by a background thread as soon as it is full, or once it has been waiting
+for longer than the flush interval (even if no more events arrive).  Each chunk is written
+(and, if required, compressed) independently of the others, so a trace file remains readable up to
+the last chunk written, even if the program under scrutiny terminates abnormally.
+"""
+import gzip
+import json
+import logging
+import lzma
+import pathlib
+import queue
+import threading
+import time
+import typing
+
+from ..TraceChecker.trace_reader import TRACE_FOOTER_TYPE
+
+# number of events held in a chunk before it is handed to the writer thread
+DEFAULT_CHUNK_SIZE = 1000
+# maximum time (in seconds) an event waits in a chunk before the chunk is handed to the writer thread
+DEFAULT_FLUSH_INTERVAL = 1.0
+# maximum number of chunks waiting to be written before appending blocks
+DEFAULT_MAX_PENDING_CHUNKS = 16
+
+# map from compression names to (file suffix, function used to compress each chunk)
+_COMPRESSION_METHODS = {
+    None: ('.jsonl', lambda data: data),
+    'gzip': ('.jsonl.gz', gzip.compress),
+    'lzma': ('.jsonl.xz', lzma.compress)
+}
+
+
+class TraceSpooler:
+    """
+    Class that writes the events of each specification to its own newline-delimited JSON trace file.
+
+    At most `max_pending_chunks` chunks are held in memory waiting to be written, after which `append` blocks until
+    the writer thread catches up, so memory use does not grow with the length of the trace.
+    """
+
+    def __init__(self, spec_ids: typing.Iterable[int],
+                 compression: typing.Optional[str] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 max_pending_chunks: int = DEFAULT_MAX_PENDING_CHUNKS,
+                 json_encoder: typing.Optional[typing.Type[json.JSONEncoder]] = None,
+                 directory: typing.Union[str, pathlib.Path] = '.'):
+        if compression not in _COMPRESSION_METHODS:
+            raise ValueError(f'Unknown trace compression {compression!r}. '
+                             f'Supported values are {list(_COMPRESSION_METHODS)}.')
+        suffix, self._compress = _COMPRESSION_METHODS[compression]
+        self._chunk_size = chunk_size
+        self._flush_interval = flush_interval
+        self._json_encoder = json_encoder
+        # initialise per-spec state
+        self._paths = {}
+        self._files = {}
+        self._chunks = {}
+        self._last_hand_off_times = {}
+        self._numbers_of_chunks_handed_off = {}
+        self._numbers_of_chunks_written = {}
+        self._numbers_of_events_written = {}
+        for spec_id in spec_ids:
+            self._paths[spec_id] = pathlib.Path(directory).joinpath(f'trace-{spec_id}{suffix}')
+            self._files[spec_id] = self._paths[spec_id].open('wb')
+            self._chunks[spec_id] = []
+            self._last_hand_off_times[spec_id] = time.monotonic()
+            self._numbers_of_chunks_handed_off[spec_id] = 0
+            self._numbers_of_chunks_written[spec_id] = 0
+            self._numbers_of_events_written[spec_id] = 0
+        # the lock ensures that no event is added to a chunk once that chunk has been handed off
+        self._lock = threading.Lock()
+        # chunks waiting to be written, as (spec id, list of events) pairs
+        self._pending_chunks = queue.Queue(maxsize=max_pending_chunks)
+        # the writer thread is a daemon so that it never keeps the program under scrutiny alive
+        self._writer_thread = threading.Thread(target=self._write_chunks, name='scsl-trace-writer', daemon=True)
+        self._writer_thread.start()
+
+    def get_paths(self) -> dict:
+        return dict(self._paths)
+
+    def append(self, spec_id: int, event: dict) -> None:
+        """
+        Add `event` to the current chunk for `spec_id`, handing the chunk to the writer thread if it is full
+        or if it has been waiting for longer than the flush interval.
+        """
+        with self._lock:
+            chunk = self._chunks[spec_id]
+            chunk.append(event)
+            if (len(chunk) < self._chunk_size
+                    and time.monotonic() - self._last_hand_off_times[spec_id] < self._flush_interval):
+                return
+            chunk = self._take_chunk(spec_id)
+        # put the chunk outside of the lock, since this blocks if too many chunks are waiting to be written
+        self._pending_chunks.put((spec_id, chunk))
+
+    def flush(self) -> None:
+        """
+        Hand every non-empty chunk to the writer thread.
+        """
+        for spec_id in self._chunks:
+            with self._lock:
+                chunk = self._take_chunk(spec_id)
+            if chunk:
+                self._pending_chunks.put((spec_id, chunk))
+
+    def close(self) -> dict:
+        """
+        Write any buffered events, followed by a footer, to each trace file, then close the files.
+
+        :return: dict mapping spec ids to the number of events written
+        """
+        self.flush()
+        # tell the writer thread to finish, then wait for it
+        self._pending_chunks.put(None)
+        self._writer_thread.join()
+        for spec_id, out_file in self._files.items():
+            footer = {"type": TRACE_FOOTER_TYPE,
+                      "spec_id": spec_id,
+                      "number_of_events": self._numbers_of_events_written[spec_id]}
+            out_file.write(self._compress((json.dumps(footer) + '\n').encode()))
+            out_file.close()
+        return dict(self._numbers_of_events_written)
+
+    def _take_chunk(self, spec_id: int) -> list:
+        """
+        Replace the current chunk for `spec_id` with an empty one and return it.  Assumes the lock is held.
+        """
+        chunk = self._chunks[spec_id]
+        self._chunks[spec_id] = []
+        self._last_hand_off_times[spec_id] = time.monotonic()
+        if chunk:
+            self._numbers_of_chunks_handed_off[spec_id] += 1
+        return chunk
+
+    def _write_chunks(self) -> None:
+        """
+        Write chunks to their trace files until told to stop, also writing the chunks that have been waiting for
+        longer than the flush interval (which `append` only hands off when the next event arrives).
+        """
+        timeout = self._flush_interval
+        while True:
+            try:
+                item = self._pending_chunks.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                return
+            if item:
+                self._write_chunk(*item)
+            timeout = self._write_stale_chunks()
+
+    def _write_stale_chunks(self) -> float:
+        """
+        Write the chunks that have been waiting for longer than the flush interval.
+
+        A chunk is only taken if every chunk handed off before it for the same spec id has been written, since a chunk
+        taken by `append` may not yet have been put on the queue.
+
+        :return: the time (in seconds) until the next chunk will have been waiting for longer than the flush interval
+        """
+        timeout = self._flush_interval
+        for spec_id in self._chunks:
+            with self._lock:
+                if not self._chunks[spec_id]:
+                    continue
+                waiting_time = time.monotonic() - self._last_hand_off_times[spec_id]
+                if waiting_time < self._flush_interval:
+                    timeout = min(timeout, self._flush_interval - waiting_time)
+                    continue
+                if self._numbers_of_chunks_handed_off[spec_id] != self._numbers_of_chunks_written[spec_id]:
+                    # the chunk taken before this one is about to be put on the queue, which wakes this thread
+                    continue
+                chunk = self._take_chunk(spec_id)
+            self._write_chunk(spec_id, chunk)
+        return timeout
+
+    def _write_chunk(self, spec_id: int, chunk: list) -> None:
+        """
+        Write `chunk` to the trace file for `spec_id`.
+        """
+        try:
+            data = ''.join(json.dumps(event, cls=self._json_encoder) + '\n' for event in chunk)
+            out_file = self._files[spec_id]
+            out_file.write(self._compress(data.encode()))
+            out_file.flush()
+            self._numbers_of_events_written[spec_id] += len(chunk)
+        except (TypeError, ValueError, OSError) as e:
+            # keep consuming chunks, so that the program under scrutiny is never blocked
+            logging.error(f'Failed to write {len(chunk)} events to {self._paths[spec_id]}: {e}')
+        finally:
+            self._numbers_of_chunks_written[spec_id] += 1
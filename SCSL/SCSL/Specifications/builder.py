@@ -2,6 +2,7 @@
 Module containing functions for constructing an LHS specification.
 """
 import sys
+import types
 
 from ..Specifications.constraints import (dummy_variable_value_from_quantifier,
                                           is_normal_atom,
@@ -113,6 +114,9 @@ class Quantifier:
         # remember the id
         self._id = kwargs["id"]
 
+        # the compiled form of this quantifier is built on first use (see `compile`)
+        self._compiled_specification = None
+
     def __sizeof__(self):
         return sys.getsizeof(self._id) +\
                sys.getsizeof(self._binding) +\
@@ -137,113 +141,40 @@ class Quantifier:
         # set the subexpression value of this quantifier's predicate
         self._predicate.set_sub_expression_value(value, sub_expression_index)
 
-    def get_quantifiers(self):
+    def compile(self):
         """
-        Traverse the specification and construct a list of the quantifiers that it contains.
+        Get the `CompiledSpecification` instance for this quantifier, building it on first use.
         """
-        # initialise empty list of quantifiers
-        quantifiers = []
-        # recurse on the specification structure
-        self._get_quantifiers(self, quantifiers)
-        return quantifiers
+        if self._compiled_specification is None:
+            self._compiled_specification = CompiledSpecification(self)
+        return self._compiled_specification
 
-    def _get_quantifiers(self, subformula, quantifiers):
+    def get_quantifiers(self):
         """
-        Recursive case for traversing specifications to build up a list of quantifiers.
+        Get the list of the quantifiers that the specification contains.
         """
-        if is_normal_atom(subformula) or is_mixed_atom(subformula):
-            # base case (but we don't do anything since we haven't found a quantifier)
-            pass
-        elif type(subformula) in [conjunction, disjunction]:
-            # recurse on each subformula
-            for conjunction_subformula in subformula.get_subformulae():
-                self._get_quantifiers(conjunction_subformula, quantifiers)
-        elif type(subformula) is negate:
-            # recurse on the subformula
-            self._get_quantifiers(subformula.get_subformula(), quantifiers)
-        elif type(subformula) in [forall, exists]:
-            # add the quantifier to the list
-            quantifiers.append(subformula)
-            # construct argument dictionary
-            argument_dict = construct_cumulative_binding(subformula)
-            # get the subformula
-            quantifier_subformula = subformula.get_subformula()
-            # instantiate the subformula
-            instantiated_subformula = quantifier_subformula(argument_dict)
-            # recurse
-            self._get_quantifiers(instantiated_subformula, quantifiers)
+        return list(self.compile().get_quantifiers())
 
     def get_atoms(self):
         """
-        Traverse the specification and construct a list of the atoms that it contains.
+        Get the list of the atoms that the specification contains.
         """
-        # get atomic constraints used in subformula
-        # construct argument dictionary
-        argument_dict = construct_cumulative_binding(self)
-        # get the subformula
-        quantifier_subformula = self.get_subformula()
-        # instantiate the subformula
-        instantiated_subformula = quantifier_subformula(argument_dict)
-        atoms = instantiated_subformula.get_atoms()
-        return atoms
+        return list(self.compile().get_atoms())
 
     def get_expressions(self):
         """
-        Iterate through the list of atoms, extracting the list of expressions from each.
+        Get the list of expressions found in the atoms of the specification.
         """
-        # get the list of atoms
-        atoms = self.get_atoms()
-        # initialise empty list of expressions
-        expressions = []
-        # get the list of expressions for each atom
-        for atom in atoms:
-            # check for atomic constraints that are constants
-            if type(atom) is not BooleanConstant:
-                # get the subexpressions
-                # in some cases, there is only one, so both expressions are the same
-                expression_0 = atom.get_expression(0)
-                expression_1 = atom.get_expression(1)
-                if expression_0 not in expressions:
-                    expressions.append(expression_0)
-                if expression_1 not in expressions:
-                    expressions.append(expression_1)
-        return expressions
+        return list(self.compile().get_expressions())
 
     def get_all_signal_names(self):
-        # get expressions
-        expressions = self.get_expressions()
-        # initialise empty list of signal names
-        signal_names = []
-        # determine which expressions involve signals
-        for expression in expressions:
-            # check type of expression
-            if type(expression) is SignalAtTimestamp:
-                signal_name = expression.get_signal_name()
-                if signal_name not in signal_names:
-                    signal_names.append(signal_name)
-        return signal_names
+        return list(self.compile().get_signal_names())
 
     def get_function_names(self):
         """
         Get the list of names of functions found in predicates used in the specification.
         """
-        # get the predicate attached to the quantifier
-        predicate = self.get_predicate()
-        # get the function name it uses
-        predicate_function_names = predicate.get_function_names()
-        # get function names used in subformula
-        # construct argument dictionary
-        argument_dict = construct_cumulative_binding(self)
-        # get the subformula
-        quantifier_subformula = self.get_subformula()
-        # instantiate the subformula
-        instantiated_subformula = quantifier_subformula(argument_dict)
-        inner_function_names = instantiated_subformula.get_function_names()
-        # combine the lists of function names
-        final_function_names = predicate_function_names + inner_function_names
-        # remove duplicates
-        unique_function_names = list(set(final_function_names))
-        return unique_function_names
+        return list(self.compile().get_function_names())
 
     def get_predicate(self):
         return self._predicate
@@ -256,6 +187,8 @@ class Quantifier:
         Set the subformula to be checked for each value identified by this quantifier.
         """
         self._subformula = subformula
+        # the compiled form depends on the subformula, so it has to be rebuilt
+        self._compiled_specification = None
         return self
 
 
@@ -440,3 +373,135 @@ class negate:
 
     def __repr__(self):
         return f"negate({self._subformula})"
+
+
+class CompiledSpecification:
+    """
+    Immutable, precomputed form of a specification.
+
+    Instances are built once per quantifier (see `Quantifier.compile`) so that the atoms, quantifiers,
+    expressions, signal names and function names are derived by instantiating the quantifier lambdas
+    only once, rather than every time one of them is needed (for example, for every event processed by a monitor).
+    """
+
+    def __init__(self, specification):
+        """
+        Traverse `specification` and store everything that is derived from its structure.
+        """
+        self._specification = specification
+        # initialise empty list of quantifiers
+        quantifiers = []
+        # initialise map from quantifier ids to instantiated subformulae that contain no quantifiers
+        # (these are never modified during monitoring, so can be shared)
+        instantiated_subformulae = {}
+        # traverse the specification, starting from the root quantifier
+        root_subformula = self._compile_quantifier(specification, quantifiers, instantiated_subformulae)
+        self._quantifiers = tuple(quantifiers)
+        self._instantiated_subformulae = types.MappingProxyType(instantiated_subformulae)
+
+        # atoms, in the order in which they are indexed by instrumentation
+        self._atoms = tuple(root_subformula.get_atoms()) if root_subformula is not None else ()
+        # map from atoms to their indices
+        # if the same atom occurs more than once, it is mapped to its first index
+        atom_indices = {}
+        for (atom_index, atom) in enumerate(self._atoms):
+            atom_indices.setdefault(atom, atom_index)
+        self._atom_indices = types.MappingProxyType(atom_indices)
+
+        # expressions used by the atoms
+        expressions = []
+        for atom in self._atoms:
+            # check for atomic constraints that are constants
+            if type(atom) is not BooleanConstant:
+                # in some cases, there is only one subexpression, so both expressions are the same
+                for expression in [atom.get_expression(0), atom.get_expression(1)]:
+                    if expression not in expressions:
+                        expressions.append(expression)
+        self._expressions = tuple(expressions)
+
+        # names of signals used by the expressions
+        signal_names = []
+        for expression in self._expressions:
+            if type(expression) is SignalAtTimestamp and expression.get_signal_name() not in signal_names:
+                signal_names.append(expression.get_signal_name())
+        self._signal_names = tuple(signal_names)
+
+        # names of functions used in the predicate of the root quantifier and in its subformula
+        if root_subformula is not None:
+            function_names = specification.get_predicate().get_function_names() + \
+                             root_subformula.get_function_names()
+            self._function_names = tuple(set(function_names))
+        else:
+            self._function_names = ()
+
+    def _compile_quantifier(self, quantifier, quantifiers, instantiated_subformulae):
+        """
+        Add `quantifier` to `quantifiers`, instantiate its subformula and recurse on it.
+        """
+        if type(quantifier) in [forall, exists]:
+            quantifiers.append(quantifier)
+        if quantifier.get_subformula() is None:
+            return None
+        # instantiate the subformula with the placeholder binding
+        instantiated_subformula = quantifier.get_subformula()(construct_cumulative_binding(quantifier))
+        # recurse, remembering the instantiated subformula if no quantifiers are nested inside it
+        if not self._compile_subformula(instantiated_subformula, quantifiers, instantiated_subformulae):
+            instantiated_subformulae[quantifier.get_id()] = instantiated_subformula
+        return instantiated_subformula
+
+    def _compile_subformula(self, subformula, quantifiers, instantiated_subformulae):
+        """
+        Recursive case for traversing specifications.  Returns True if `subformula` contains a quantifier.
+        """
+        if type(subformula) in [conjunction, disjunction]:
+            contains_quantifier = False
+            for conjunction_subformula in subformula.get_subformulae():
+                if type(conjunction_subformula) is not dict:
+                    contains_quantifier = self._compile_subformula(conjunction_subformula,
+                                                                   quantifiers,
+                                                                   instantiated_subformulae) or contains_quantifier
+            return contains_quantifier
+        elif type(subformula) is negate:
+            return self._compile_subformula(subformula.get_subformula(), quantifiers, instantiated_subformulae)
+        elif type(subformula) in [forall, exists]:
+            self._compile_quantifier(subformula, quantifiers, instantiated_subformulae)
+            return True
+        else:
+            # base case (atoms)
+            return False
+
+    def get_specification(self):
+        return self._specification
+
+    def get_quantifiers(self):
+        return self._quantifiers
+
+    def get_atoms(self):
+        return self._atoms
+
+    def get_atom_index(self, atom):
+        """
+        Get the index of `atom` in O(1), rather than with `atoms.index(atom)`.
+        """
+        return self._atom_indices[atom]
+
+    def get_expressions(self):
+        return self._expressions
+
+    def get_signal_names(self):
+        return self._signal_names
+
+    def get_function_names(self):
+        return self._function_names
+
+    def instantiate_subformula(self, quantifier):
+        """
+        Get the subformula of `quantifier`, instantiated with the placeholder binding.
+
+        If the subformula contains no quantifiers, the instance built during compilation is reused.
+        Otherwise, a new instance is constructed, since the predicates of nested quantifiers
+        are updated during monitoring.
+        """
+        if quantifier.get_id() in self._instantiated_subformulae:
+            return self._instantiated_subformulae[quantifier.get_id()]
+        return quantifier.get_subformula()(construct_cumulative_binding(quantifier))
@@ -220,6 +220,9 @@ class TimestampExpressionWithAddition(TimestampExpression):
                 self._timestamp_expression == other._timestamp_expression and
                 self._number == other._number)
 
+    def __hash__(self):
+        return hash((type(self), self._timestamp_expression, self._number))
+
     def __repr__(self):
         return f"{self._timestamp_expression} + {self._number}"
 
@@ -305,6 +308,9 @@ class TimestampVariable(TimestampExpression):
         return (type(self) == type(other) and
                 self._variable_name == other._variable_name)
 
+    def __hash__(self):
+        return hash((type(self), self._variable_name))
+
     def get_base_variable(self):
         return self
     
@@ -338,6 +344,9 @@ class ConcreteStateVariable(ConcreteStateExpression):
         return (type(self) == type(other) and
                 self._variable_name == other._variable_name)
 
+    def __hash__(self):
+        return hash((type(self), self._variable_name))
+
     def is_signal_based(self):
         return False
 
@@ -371,6 +380,9 @@ class TransitionVariable(TransitionExpression):
         return (type(self) == type(other) and
                 self._variable_name == other._variable_name)
 
+    def __hash__(self):
+        return hash((type(self), self._variable_name))
+
     def is_signal_based(self):
         return False
 
@@ -409,6 +421,9 @@ class TimeOfConcreteState(TimestampExpression, Measurement):
         return (type(self) == type(other) and
                 self._concrete_state == other._concrete_state)
 
+    def __hash__(self):
+        return hash((type(self), self._concrete_state))
+
     def get_base_variable(self):
         return self._concrete_state.get_base_variable()
 
@@ -446,6 +461,9 @@ class TimeOfTransition(TimestampExpression, Measurement):
         return (type(self) == type(other) and
                 self._transition == other._transition)
 
+    def __hash__(self):
+        return hash((type(self), self._transition))
+
     def get_base_variable(self):
         return self._transition.get_base_variable()
 
@@ -496,6 +514,9 @@ class NextConcreteStateAfterTimestamp(ConcreteStateExpression):
                 self._timestamp == other._timestamp and
                 self._predicate == other._predicate)
 
+    def __hash__(self):
+        return hash((type(self), self._timestamp, self._predicate))
+
     def get_base_variable(self):
         return self._timestamp.get_base_variable()
 
@@ -535,6 +556,9 @@ class NextTransitionAfterTimestamp(TransitionExpression):
                 self._timestamp == other._timestamp and
                 self._predicate == other._predicate)
 
+    def __hash__(self):
+        return hash((type(self), self._timestamp, self._predicate))
+
     def get_base_variable(self):
         return self._timestamp.get_base_variable()
 
@@ -577,6 +601,9 @@ class NextConcreteStateAfterTransition(ConcreteStateExpression):
                 self._transition == other._transition and
                 self._predicate == other._predicate)
 
+    def __hash__(self):
+        return hash((type(self), self._transition, self._predicate))
+
     def get_base_variable(self):
         return self._transition.get_base_variable()
 
@@ -612,6 +639,9 @@ class NextTransitionAfterTransition(TransitionExpression):
                 self._transition == other._transition and
                 self._predicate == other._predicate)
 
+    def __hash__(self):
+        return hash((type(self), self._transition, self._predicate))
+
     def is_signal_based(self):
         return self._transition.is_signal_based()
 
@@ -650,6 +680,9 @@ class NextConcreteStateAfterConcreteState(ConcreteStateExpression):
                 self._concrete_state == other._concrete_state and
                 self._predicate == other._predicate)
 
+    def __hash__(self):
+        return hash((type(self), self._concrete_state, self._predicate))
+
     def get_base_variable(self):
         return self._concrete_state.get_base_variable()
 
@@ -691,6 +724,9 @@ class NextTransitionAfterConcreteState(TransitionExpression):
                 self._concrete_state == other._concrete_state and
                 self._predicate == other._predicate)
 
+    def __hash__(self):
+        return hash((type(self), self._concrete_state, self._predicate))
+
     def get_base_variable(self):
         return self._concrete_state.get_base_variable()
 
@@ -724,6 +760,9 @@ class ConcreteStateBeforeTransition(ConcreteStateExpression):
         return (type(self) == type(other) and
                 self._transition == other._transition)
 
+    def __hash__(self):
+        return hash((type(self), self._transition))
+
     def get_base_variable(self):
         return self._transition.get_base_variable()
     
@@ -757,6 +796,9 @@ class ConcreteStateAfterTransition(ConcreteStateExpression):
         return (type(self) == type(other) and
                 self._transition == other._transition)
 
+    def __hash__(self):
+        return hash((type(self), self._transition))
+
     def get_base_variable(self):
         return self._transition.get_base_variable()
     
@@ -797,6 +839,9 @@ class Signal():
     def __eq__(self, other):
         return (type(self) == type(other) and
                 self._signal_name == other._signal_name)
+
+    def __hash__(self):
+        return hash((type(self), self._signal_name))
     
     def __repr__(self):
         return f"signal({self._signal_name})"
@@ -851,6 +896,9 @@ class SignalAtTimestamp(Measurement):
         return (type(self) == type(other) and
                 self._signal_variable == other._signal_variable and
                 self._timestamp == other._timestamp)
+
+    def __hash__(self):
+        return hash((type(self), self._signal_variable, self._timestamp))
     
     def is_signal_based(self):
         return self._timestamp.is_signal_based()
@@ -905,6 +953,9 @@ class TimeBetween(Measurement):
         return (type(self) == type(other) and
                 self._lhs_expression == other._lhs_expression and
                 self._rhs_expression == other._rhs_expression)
+
+    def __hash__(self):
+        return hash((type(self), self._lhs_expression, self._rhs_expression))
     
     def get_lhs_expression(self):
         return self._lhs_expression
@@ -953,6 +1004,9 @@ class ValueInConcreteState(Measurement):
         return (type(self) == type(other) and
                 self._concrete_state == other._concrete_state and
                 self._program_variable == other._program_variable)
+
+    def __hash__(self):
+        return hash((type(self), self._concrete_state, self._program_variable))
     
     def get_concrete_state_expression(self):
         return self._concrete_state
@@ -1011,6 +1065,9 @@ class ValueInConcreteStateWithAddition(Measurement):
                 self._value_expression == other._value_expression and
                 self._number == other._number)
 
+    def __hash__(self):
+        return hash((type(self), self._value_expression, self._number))
+
     def __repr__(self):
         return f"{self._value_expression} + {self._number}"
 
@@ -1051,6 +1108,9 @@ class DurationOfTransition(Measurement):
     def __eq__(self, other):
         return (type(self) == type(other) and self._transition == other._transition)
 
+    def __hash__(self):
+        return hash((type(self), self._transition))
+
     def __repr__(self):
         return f"{self._transition}.duration()"
 
@@ -1104,6 +1164,9 @@ class SignalAtTimestampGreaterThanNumber(ConstraintBase, NormalAtom):
         return (type(self) == type(other) and
                 self._signal_timestamp_expression == other._signal_timestamp_expression and
                 self._constant == other._constant)
+
+    def __hash__(self):
+        return hash((type(self), self._signal_timestamp_expression, self._constant))
     
     def get_subatom_at_index(self, index):
         if index != 0:
@@ -1155,6 +1218,9 @@ class SignalAtTimestampLessThanNumber(ConstraintBase, NormalAtom):
                 self._signal_timestamp_expression == other._signal_timestamp_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._signal_timestamp_expression, self._constant))
+
     def get_constant(self):
         return self._constant
 
@@ -1208,6 +1274,9 @@ class SignalAtTimestampEqualsNumber(ConstraintBase, NormalAtom):
                 self._signal_timestamp_expression == other._signal_timestamp_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._signal_timestamp_expression, self._constant))
+
     def get_constant(self):
         return self._constant
 
@@ -1259,6 +1328,9 @@ class TimeBetweenLessThanConstant(ConstraintBase, MixedAtom):
                 self._time_between_expression == other._time_between_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._time_between_expression, self._constant))
+
     def get_constant(self):
         return self._constant
     
@@ -1314,6 +1386,9 @@ class ValueInConcreteStateLessThanConstant(ConstraintBase, NormalAtom):
                 self._value_expression == other._value_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._value_expression, self._constant))
+
     def get_constant(self):
         return self._constant
 
@@ -1361,6 +1436,9 @@ class ValueInConcreteStateNotEqualToConstant(ConstraintBase, NormalAtom):
                 self._value_expression == other._value_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._value_expression, self._constant))
+
     def get_constant(self):
         return self._constant
 
@@ -1408,6 +1486,9 @@ class ValueInConcreteStateLessThanEqualToConstant(ConstraintBase, NormalAtom):
                 self._value_expression == other._value_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._value_expression, self._constant))
+
     def get_constant(self):
         return self._constant
 
@@ -1455,6 +1536,9 @@ class ValueInConcreteStateGreaterThanEqualToConstant(ConstraintBase, NormalAtom)
                 self._value_expression == other._value_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._value_expression, self._constant))
+
     def get_constant(self):
         return self._constant
 
@@ -1502,6 +1586,9 @@ class ValueInConcreteStateGreaterThanConstant(ConstraintBase, NormalAtom):
                 self._value_expression == other._value_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._value_expression, self._constant))
+
     def get_constant(self):
         return self._constant
 
@@ -1549,6 +1636,9 @@ class ValueInConcreteStateEqualToConstant(ConstraintBase, NormalAtom):
                 self._value_expression == other._value_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._value_expression, self._constant))
+
     def get_constant(self):
         return self._constant
     
@@ -1594,8 +1684,11 @@ class ValueInConcreteStateWithAdditionEqualToValueInConcreteState(ConstraintBase
 
     def __eq__(self, other):
         return (type(self) == type(other) and
-                self._lhs_expression == other._rhs_expression and
-                self._lhs_expression == other._rhs_expression)
+                self._lhs_expression == other._lhs_expression and
+                self._rhs_expression == other._rhs_expression)
+
+    def __hash__(self):
+        return hash((type(self), self._lhs_expression, self._rhs_expression))
 
     def get_expression(self, index):
         # construct a list of the lhs and rhs
@@ -1643,6 +1736,9 @@ class DurationOfTransitionLessThanNumber(ConstraintBase, NormalAtom):
                 self._duration_expression == other._duration_expression and
                 self._constant == other._constant)
 
+    def __hash__(self):
+        return hash((type(self), self._duration_expression, self._constant))
+
     def get_constant(self):
         return self._constant
 
@@ -1688,6 +1784,9 @@ class BooleanConstant(ConstraintBase, NormalAtom):
     def __eq__(self, other):
         return type(self) == type(other) and self._value == other._value
 
+    def __hash__(self):
+        return hash((type(self), self._value))
+
     def get_value(self):
         return self._value
 
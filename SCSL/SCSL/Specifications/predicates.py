@@ -20,14 +20,20 @@ class inTimeInterval():
             raise Exception("Argument given to inTimeInterval must be a list or a tuple.")
 
         self._interval = interval
+        # the bounds are replaced by set_sub_expression_value, so the interval as given is kept for hashing
+        self._unsubstituted_interval = (type(interval), tuple(interval))
 
     def get_function_names(self):
         return []
 
     def __eq__(self, other):
         return (type(self) == type(other) and
+                self._unsubstituted_interval == other._unsubstituted_interval and
                 self._interval == other._interval)
 
+    def __hash__(self):
+        return hash((type(self), self._unsubstituted_interval))
+
     def set_sub_expression_value(self, value, sub_expression_index):
         # tuples are immutable, so we convert to a list
         # and then convert back to the original type once we've added the new value
@@ -63,6 +69,10 @@ class inTimeInterval():
         # print(type(self._interval[1]))
         return self._interval[1]
 
+    def includes_bounds(self):
+        # a list models a closed set and a tuple models an open set
+        return type(self._interval) is list
+
     def check_satisfaction(self, timestamp):
         # if one of the values in the interval is not yet a number, we can't evaluate it
         # so just return False
@@ -103,6 +113,10 @@ class changes():
                 self._program_variable == other._program_variable and
                 self._during_function == other._during_function and
                 self._after_timestamp == other._after_timestamp)
+
+    def __hash__(self):
+        # the timestamp is set during monitoring (by set_after_timestamp), so it is left out
+        return hash((type(self), self._program_variable, self._during_function))
     
     def get_program_variable(self):
         return self._program_variable
@@ -173,6 +187,10 @@ class calls():
                 self._program_function == other._program_function and
                 self._during_function == other._during_function and
                 self._after_timestamp == other._after_timestamp)
+
+    def __hash__(self):
+        # the timestamp is set during monitoring (by set_after_timestamp), so it is left out
+        return hash((type(self), self._program_function, self._during_function))
     
     def get_function_name(self):
         return self._program_function
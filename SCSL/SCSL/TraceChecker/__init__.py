@@ -1 +1,2 @@
-from .tracechecker import *
\ No newline at end of file
+from .tracechecker import *
+from .trace_reader import *
\ No newline at end of file
@@ -0,0 +1,287 @@
+"""
+Module holding the logic used by scsl-aggregate-diagnoses to summarise the diagnoses written by many runs of
+scsl-check-trace (the diagnosis-*.json files).
+
+Each entry in a diagnosis file is an (atom, binding, number of calls, function name, line number, overrun) tuple,
+where the function and line are those of the point of no return (PNR) and the overrun is the time by which the window
+of the atom exceeded the time allowed (entries written before overruns were recorded have no overrun).  A summary
+holds, for each function, the number of violations whose PNR it was and the distribution of their overruns, along
+with the number of violations whose PNR was at each line.  If the traces are given too, the number of calls of each
+function is counted, so that the number of PNRs per call of each function can be given too (this can be more than 1,
+since a single call can be the PNR of several violations whose windows overlap).
+
+Files are read in parallel, each by a worker process that streams it and summarises it on its own, and the summaries
+are merged in the order of the files.  A summary records the files it covers (with their sizes and modification
+times) and what each of them contributed, so new runs can be folded into an existing summary without reading the
+files it already covers again, and a file that has been written again by a later run replaces its old contribution.
+"""
+import multiprocessing
+import os
+import typing
+
+from SCSL.TraceChecker import LatencyHistogram, TraceFile, iterate_json_values
+
+
+def get_file_signature(path: str) -> list:
+    """
+    Get the size and modification time of the file at `path`, which change when the file is written by another run.
+    """
+    status = os.stat(path)
+    return [status.st_size, status.st_mtime_ns]
+
+
+class DiagnosisSummary:
+    """
+    Class holding the summary of the diagnoses in (and the function calls in the traces of) a number of runs.
+
+    The summary keeps what each file contributed to it, so that when a file it covers is written again (for example,
+    diagnosis-0.json by the next run in the same directory), the old contribution of the file is replaced rather than
+    counted again.
+    """
+
+    def __init__(self):
+        # maps from the paths of the diagnosis files and traces covered to their signatures and the summaries of
+        # what they hold (which cover no files themselves)
+        self._diagnosis_files = {}
+        self._trace_files = {}
+        self._number_of_violations = 0
+        # the overruns of all violations (that have them)
+        self._overruns = LatencyHistogram()
+        # map from function names to the number of violations whose PNR they were, the histogram of the overruns of
+        # those violations and the number of calls made to them (from the traces)
+        self._function_pnr_counts = {}
+        self._function_overruns = {}
+        self._function_call_counts = {}
+        # map from (function name, line number) pairs to the number of violations whose PNR was at that line
+        self._line_pnr_counts = {}
+
+    def covers(self, path: str, signature: list, is_trace: bool = False) -> bool:
+        """
+        Decide whether this summary already covers the file at `path`, as it was when it had `signature`.
+        """
+        files = self._trace_files if is_trace else self._diagnosis_files
+        return path in files and files[path][0] == signature
+
+    def get_number_of_violations(self) -> int:
+        return self._number_of_violations
+
+    def get_number_of_files(self) -> int:
+        return len(self._diagnosis_files)
+
+    def get_overruns(self) -> LatencyHistogram:
+        return self._overruns
+
+    def add_entry(self, entry: list) -> None:
+        """
+        Add an entry from a diagnosis file.
+        """
+        function_name, line_number = entry[3], entry[4]
+        overrun = entry[5] if len(entry) > 5 else None
+        self._number_of_violations += 1
+        self._function_pnr_counts[function_name] = self._function_pnr_counts.get(function_name, 0) + 1
+        if function_name not in self._function_overruns:
+            self._function_overruns[function_name] = LatencyHistogram()
+        if overrun is not None:
+            self._overruns.add(overrun)
+            self._function_overruns[function_name].add(overrun)
+        line = (function_name, line_number)
+        self._line_pnr_counts[line] = self._line_pnr_counts.get(line, 0) + 1
+
+    def add_function_call(self, function_name: str) -> None:
+        """
+        Add a call of the function `function_name` from a trace.
+        """
+        self._function_call_counts[function_name] = self._function_call_counts.get(function_name, 0) + 1
+
+    def add_file(self, path: str, signature: list, file_summary: 'DiagnosisSummary', is_trace: bool = False) -> None:
+        """
+        Add `file_summary`, the summary of what the file at `path` held when it had `signature`, to this summary.
+        If this summary already covers the file, what the file held before is replaced.
+        """
+        files = self._trace_files if is_trace else self._diagnosis_files
+        replaced = path in files
+        files[path] = (signature, file_summary)
+        if replaced:
+            # the counts cannot all be taken away (the largest overrun, for example), so count the files again
+            self._clear_counts()
+            for _, covered_file_summary in list(self._diagnosis_files.values()) + list(self._trace_files.values()):
+                self._add_counts(covered_file_summary)
+        else:
+            self._add_counts(file_summary)
+
+    def merge(self, other: 'DiagnosisSummary') -> None:
+        """
+        Add the files covered by the summary `other` to this summary (replacing what any of them held before).
+        """
+        for path, (signature, file_summary) in other._diagnosis_files.items():
+            self.add_file(path, signature, file_summary)
+        for path, (signature, file_summary) in other._trace_files.items():
+            self.add_file(path, signature, file_summary, is_trace=True)
+
+    def _clear_counts(self) -> None:
+        self._number_of_violations = 0
+        self._overruns = LatencyHistogram()
+        self._function_pnr_counts = {}
+        self._function_overruns = {}
+        self._function_call_counts = {}
+        self._line_pnr_counts = {}
+
+    def _add_counts(self, other: 'DiagnosisSummary') -> None:
+        """
+        Add the counts held by the summary `other` to the counts held by this summary.
+        """
+        self._number_of_violations += other._number_of_violations
+        self._overruns.merge(other._overruns)
+        for function_name, count in other._function_pnr_counts.items():
+            self._function_pnr_counts[function_name] = self._function_pnr_counts.get(function_name, 0) + count
+            if function_name not in self._function_overruns:
+                self._function_overruns[function_name] = LatencyHistogram()
+            self._function_overruns[function_name].merge(other._function_overruns[function_name])
+        for function_name, count in other._function_call_counts.items():
+            self._function_call_counts[function_name] = self._function_call_counts.get(function_name, 0) + count
+        for line, count in other._line_pnr_counts.items():
+            self._line_pnr_counts[line] = self._line_pnr_counts.get(line, 0) + count
+
+    def get_function_ranking(self) -> typing.List[dict]:
+        """
+        Get, for each function that was a PNR, the number and fraction of violations whose PNR it was, the number of
+        PNRs per call of the function (if the traces were given) and a summary of the overruns, with the functions
+        that were most often PNRs first.
+        """
+        ranking = []
+        for function_name, count in self._function_pnr_counts.items():
+            number_of_calls = self._function_call_counts.get(function_name)
+            ranking.append({
+                "function_name": function_name,
+                "pnr_count": count,
+                "pnr_frequency": count / self._number_of_violations,
+                "number_of_calls": number_of_calls,
+                "pnr_rate": count / number_of_calls if number_of_calls else None,
+                "overrun": self._function_overruns[function_name].summarise()
+            })
+        ranking.sort(key=lambda function: (-function["pnr_count"], str(function["function_name"])))
+        return ranking
+
+    def get_line_hotspots(self) -> typing.List[dict]:
+        """
+        Get, for each line at which a PNR was found, the number of violations whose PNR was there, with the lines
+        at which most were found first.
+        """
+        hotspots = [{"function_name": function_name, "line_number": line_number, "pnr_count": count}
+                    for (function_name, line_number), count in self._line_pnr_counts.items()]
+        hotspots.sort(key=lambda hotspot: (-hotspot["pnr_count"], str(hotspot["function_name"]),
+                                           str(hotspot["line_number"])))
+        return hotspots
+
+    def to_dict(self) -> dict:
+        """
+        Get a dictionary (that can be written as JSON) from which from_dict reconstructs this summary, along with
+        the rankings that it gives.
+        """
+        return {
+            "diagnosis_files": [{"path": path, "signature": signature, "summary": file_summary._counts_to_dict()}
+                                for path, (signature, file_summary) in self._diagnosis_files.items()],
+            "trace_files": [{"path": path, "signature": signature, "summary": file_summary._counts_to_dict()}
+                            for path, (signature, file_summary) in self._trace_files.items()],
+            "number_of_violations": self._number_of_violations,
+            "overrun": self._overruns.summarise(),
+            "function_ranking": self.get_function_ranking(),
+            "line_hotspots": self.get_line_hotspots()
+        }
+
+    @classmethod
+    def from_dict(cls, dictionary: dict) -> 'DiagnosisSummary':
+        summary = cls()
+        for file in dictionary["diagnosis_files"]:
+            summary.add_file(file["path"], file["signature"], cls._from_counts_dict(file["summary"]))
+        for file in dictionary["trace_files"]:
+            summary.add_file(file["path"], file["signature"], cls._from_counts_dict(file["summary"]), is_trace=True)
+        return summary
+
+    def _counts_to_dict(self) -> dict:
+        return {
+            "number_of_violations": self._number_of_violations,
+            "overruns": self._overruns.to_dict(),
+            "functions": [{"function_name": function_name,
+                           "pnr_count": count,
+                           "overruns": self._function_overruns[function_name].to_dict()}
+                          for function_name, count in self._function_pnr_counts.items()],
+            "function_call_counts": [[function_name, count]
+                                     for function_name, count in self._function_call_counts.items()],
+            "lines": [[function_name, line_number, count]
+                      for (function_name, line_number), count in self._line_pnr_counts.items()]
+        }
+
+    @classmethod
+    def _from_counts_dict(cls, dictionary: dict) -> 'DiagnosisSummary':
+        summary = cls()
+        summary._number_of_violations = dictionary["number_of_violations"]
+        summary._overruns = LatencyHistogram.from_dict(dictionary["overruns"])
+        for function in dictionary["functions"]:
+            summary._function_pnr_counts[function["function_name"]] = function["pnr_count"]
+            summary._function_overruns[function["function_name"]] = LatencyHistogram.from_dict(function["overruns"])
+        for function_name, count in dictionary["function_call_counts"]:
+            summary._function_call_counts[function_name] = count
+        for function_name, line_number, count in dictionary["lines"]:
+            summary._line_pnr_counts[(function_name, line_number)] = count
+        return summary
+
+
+def summarise_diagnosis_file(path: str) -> DiagnosisSummary:
+    """
+    Summarise the diagnosis file at `path`, reading one entry at a time.
+    """
+    file_summary = DiagnosisSummary()
+    signature = get_file_signature(path)
+    for entry in iterate_json_values(path):
+        file_summary.add_entry(entry)
+    summary = DiagnosisSummary()
+    summary.add_file(path, signature, file_summary)
+    return summary
+
+
+def summarise_trace_file(path: str) -> DiagnosisSummary:
+    """
+    Count the calls of each function in the trace at `path`, reading one event at a time.
+    """
+    file_summary = DiagnosisSummary()
+    signature = get_file_signature(path)
+    for event in TraceFile(path):
+        if event.get("type") == "function":
+            file_summary.add_function_call(event.get("function_name"))
+    summary = DiagnosisSummary()
+    summary.add_file(path, signature, file_summary, is_trace=True)
+    return summary
+
+
+def aggregate_diagnoses(diagnosis_paths: typing.Iterable[str],
+                        trace_paths: typing.Iterable[str] = (),
+                        summary: typing.Optional[DiagnosisSummary] = None,
+                        processes: typing.Optional[int] = None) -> DiagnosisSummary:
+    """
+    Fold the diagnosis files at `diagnosis_paths` (and the traces at `trace_paths`) into `summary` (or into a new
+    summary), on a pool of `processes` worker processes (by default, one per CPU).
+
+    Files that `summary` already covers, and that have not been written since, are not read again.  Those that have
+    been written since are read again, and replace what they held before.
+
+    :return: the summary
+    """
+    if summary is None:
+        summary = DiagnosisSummary()
+    files = [(str(path), False) for path in diagnosis_paths] + [(str(path), True) for path in trace_paths]
+    files = [(path, is_trace) for path, is_trace in files
+             if not summary.covers(path, get_file_signature(path), is_trace)]
+    if processes == 1 or len(files) <= 1:
+        for file_summary in map(_summarise_file, files):
+            summary.merge(file_summary)
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for file_summary in pool.imap(_summarise_file, files):
+                summary.merge(file_summary)
+    return summary
+
+
+def _summarise_file(file: typing.Tuple[str, bool]) -> DiagnosisSummary:
+    path, is_trace = file
+    return summarise_trace_file(path) if is_trace else summarise_diagnosis_file(path)
@@ -0,0 +1,285 @@
+"""
+Module holding the logic used by scsl-check-trace to check a trace with respect to specifications.
+
+A trace can either be checked with respect to a single specification in the current process, or many checks (of many
+traces, or of one trace with respect to many specifications) can be performed in parallel, using a pool of worker
+processes.  Each check is described by a (trace path, spec id) pair, where a spec id of None means that the
+specification is given by the first event of the trace.
+
+A single large trace can also be checked in parallel by dealing the bindings of the outermost quantifier out to
+several shards (see BindingShardTrace), each of which is monitored and diagnosed by its own worker process.  This is
+possible for specifications of the form forall q ... : phi(q), with q ranging over changes or calls, since the subtree
+for each binding of q then depends only on the events that follow the trigger for that binding.
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import pathlib
+import runpy
+import tracemalloc
+import typing
+
+from time import perf_counter
+
+from SCSL.Specifications.builder import forall
+from SCSL.Specifications.predicates import calls, changes
+from SCSL.TraceChecker import Monitor, TraceFile, SpecificationTrace, BindingShardTrace, combine_verdicts
+from SCSL.TraceChecker import binding_order_key, binding_creation_order_key
+from SCSL.Monitoring import get_diagnosis
+
+# specifications loaded by each worker process (specifications hold lambdas, so they cannot be sent to workers)
+_worker_specifications: list = None
+
+
+def load_specifications(compiled_spec_path: typing.Union[str, pathlib.Path]) -> list:
+    """
+    Load the specifications from the module generated by instrumentation.
+    """
+    return runpy.run_path(str(compiled_spec_path))['specifications']
+
+
+def check_trace(specification, trace: typing.Iterable[dict], tree_eval_strategy: str = 'up',
+                include_measurements: bool = False, fail_fast: bool = False, prune: bool = False,
+                max_true_binding_summaries: int = 0, diagnosis_processes: int = 1) -> dict:
+    """
+    Check `trace` with respect to `specification` and diagnose any violation, printing a report along the way.
+
+    Violations are diagnosed during monitoring, so `trace` is only read once, unless `diagnosis_processes` is more than
+    1, in which case the violations are diagnosed once monitoring has finished, by that many worker processes sharing
+    an index of the function events in `trace` (so `trace` must be iterable more than once, and this cannot be done
+    in a worker process of a pool).  If `fail_fast` is True, monitoring stops
+    as soon as the verdict can no longer change (the bindings falsified by then are still diagnosed).  If `prune` is
+    True, the subtrees of resolved bindings are retired during monitoring (see Monitor), so the measurements reported
+    are those of the False bindings and of up to `max_true_binding_summaries` True bindings.
+
+    :return: dict holding the verdict, statistics, diagnosis and the time and memory taken by diagnosis
+        (and, if `include_measurements` is True, the measurements held by the final monitoring tree)
+    """
+    monitoring_start_time = perf_counter()
+
+    # instantiate a monitor
+    monitor = Monitor(specification, tree_eval_strategy, fail_fast, prune, max_true_binding_summaries,
+                      online_diagnosis=diagnosis_processes <= 1)
+    monitor.process_events(trace)
+
+    # perform final tasks (such as tree resolution for inconclusive verdicts)
+    monitor.wrap_up()
+
+    monitoring_time = perf_counter() - monitoring_start_time
+
+    # print verdict
+    final_verdict = monitor.get_verdict()
+    print(f"SIMPLE VERDICT: {final_verdict}\n")
+
+    if fail_fast and monitor.is_verdict_settled():
+        print("The verdict was settled, so monitoring stopped early (fail-fast).\n")
+
+    print(monitor.get_verdict_explanation())
+
+    print("\nSTATISTICS:\n")
+
+    print(f"{monitor.get_number_of_events_observed()} events processed")
+
+    print(f"{monitor.get_tree_size()} monitoring tree nodes")
+
+    if prune:
+        print(f"{monitor.get_number_of_retired_bindings()} resolved bindings retired "
+              f"({len(monitor.get_binding_summaries())} summaries kept)")
+
+    # EVALUATION
+    tracemalloc.start()
+
+    # get diagnosis
+    diagnosis, time = get_diagnosis(specification, trace, monitor, diagnosis_processes)
+
+    print(f"Consumed memory: current {tracemalloc.get_traced_memory()[0] / (1024):0.4f} kB"
+          f" and the peak {tracemalloc.get_traced_memory()[1] / (1024):0.4f} kB")
+
+    memory = tracemalloc.get_traced_memory()[1] / (1024)
+    tracemalloc.stop()
+
+    results = {
+        "verdict": final_verdict,
+        "number_of_events": monitor.get_number_of_events_observed(),
+        "tree_size": monitor.get_tree_size(),
+        "monitoring_time": monitoring_time,
+        "diagnosis": diagnosis,
+        "time": time,
+        "memory": memory
+    }
+    if include_measurements:
+        results["measurements"] = monitor.get_measurements_for_db()
+    return results
+
+
+def check_traces(compiled_spec_path: typing.Union[str, pathlib.Path],
+                 checks: typing.Iterable[typing.Tuple[typing.Union[str, pathlib.Path], typing.Optional[int]]],
+                 processes: typing.Optional[int] = None,
+                 tree_eval_strategy: str = 'up',
+                 check_options: typing.Optional[dict] = None) -> typing.Iterator[typing.Optional[dict]]:
+    """
+    Perform each check in `checks` (a (trace path, spec id) pair) in parallel, yielding the results in order.
+
+    Each worker loads the specifications once, then reads each trace from disk itself, keeping only the events for
+    the relevant specification, so no events are sent between processes.  The report printed by each check is
+    captured, so reports are not interleaved.
+
+    `check_options` holds further keyword arguments for check_trace (fail_fast, prune and max_true_binding_summaries).
+
+    :return: iterator over the results of check_trace (with the report under "output", and the trace path and spec id
+        under "trace_path" and "spec_id"), or None for each check for which the trace holds no events
+    """
+    checks = [(str(trace_path), spec_id) for trace_path, spec_id in checks]
+    with multiprocessing.Pool(processes, initializer=_initialise_worker, initargs=(str(compiled_spec_path),)) as pool:
+        yield from pool.imap(_check_trace_in_worker, [(trace_path, spec_id, tree_eval_strategy, check_options or {})
+                                                      for trace_path, spec_id in checks])
+
+
+def check_trace_for_each_specification(compiled_spec_path: typing.Union[str, pathlib.Path],
+                                       trace_path: typing.Union[str, pathlib.Path],
+                                       spec_ids: typing.Iterable[int],
+                                       processes: typing.Optional[int] = None,
+                                       tree_eval_strategy: str = 'up',
+                                       check_options: typing.Optional[dict] = None) -> dict:
+    """
+    Check the trace at `trace_path` with respect to each specification with an id in `spec_ids`, in parallel.
+
+    :return: dict mapping each spec id to the results of check_trace (see check_traces),
+        or to None if the trace holds no events for that spec id
+    """
+    spec_ids = list(spec_ids)
+    results = check_traces(compiled_spec_path, [(trace_path, spec_id) for spec_id in spec_ids],
+                           processes, tree_eval_strategy, check_options)
+    return dict(zip(spec_ids, results))
+
+
+def can_shard_bindings(specification) -> bool:
+    """
+    Decide whether the bindings of the outermost quantifier of `specification` can be checked in separate shards.
+    """
+    return type(specification) is forall and type(specification.get_predicate()) in [changes, calls]
+
+
+def check_trace_in_shards(compiled_spec_path: typing.Union[str, pathlib.Path],
+                          trace_path: typing.Union[str, pathlib.Path],
+                          spec_id: typing.Optional[int] = None,
+                          number_of_shards: typing.Optional[int] = None,
+                          processes: typing.Optional[int] = None,
+                          tree_eval_strategy: str = 'up',
+                          check_options: typing.Optional[dict] = None) -> typing.Optional[dict]:
+    """
+    Check the trace at `trace_path` with respect to the specification with id `spec_id` (or, if `spec_id` is None,
+    the one given by the first event of the trace), splitting the bindings of the outermost quantifier into
+    `number_of_shards` shards (by default, one per worker process) that are checked in parallel.
+
+    Each worker reads the trace from disk itself, keeping only the events relevant to its shard.  The verdicts,
+    measurements and diagnoses of the shards are then merged.  If the specification cannot be sharded
+    (see can_shard_bindings), the trace is checked as a single shard.  `check_options` is as for check_traces.
+
+    :return: dict holding the same entries as the results of check_trace (with the number of events being the number
+        of events in the trace, and the tree size being the total over all shards), along with the merged
+        measurements, the report printed by each shard under "output" and the number of shards under
+        "number_of_shards", or None if the trace holds no events
+    """
+    trace_path = str(trace_path)
+    trace = TraceFile(trace_path)
+    if spec_id is None:
+        first_event = trace.peek_first_event()
+        if first_event is None:
+            return None
+        spec_id = first_event["spec_id"]
+    elif SpecificationTrace(trace, spec_id).peek_first_event() is None:
+        return None
+
+    if number_of_shards is None:
+        number_of_shards = processes or os.cpu_count()
+    specification = load_specifications(compiled_spec_path)[spec_id]
+    if not can_shard_bindings(specification):
+        number_of_shards = 1
+
+    shards = [(trace_path, spec_id, shard_index, number_of_shards, tree_eval_strategy, check_options or {})
+              for shard_index in range(number_of_shards)]
+    with multiprocessing.Pool(processes, initializer=_initialise_worker, initargs=(str(compiled_spec_path),)) as pool:
+        shard_results = pool.map(_check_shard_in_worker, shards)
+
+    return merge_shard_results(shard_results, trace_path, spec_id)
+
+
+def merge_shard_results(shard_results: typing.List[dict], trace_path: str, spec_id: int) -> dict:
+    """
+    Merge the results of checking each shard of the bindings of a forall quantifier.
+
+    Diagnoses and measurements are put back in the order of the bindings they concern, which is the order in which
+    they would have been found by checking the trace as a whole.
+    """
+    output_substrings = []
+    for shard_index, results in enumerate(shard_results):
+        output_substrings.append(f"----- shard {shard_index + 1} of {len(shard_results)} -----\n")
+        output_substrings.append(results["output"])
+
+    return {
+        "verdict": combine_verdicts([results["verdict"] for results in shard_results]),
+        "number_of_events": shard_results[0]["number_of_events_read"],
+        "tree_size": sum(results["tree_size"] for results in shard_results),
+        # shards are checked in parallel, so the slowest shard determines the time taken
+        "monitoring_time": max(results["monitoring_time"] for results in shard_results),
+        "diagnosis": sorted([entry for results in shard_results for entry in results["diagnosis"]],
+                            key=lambda entry: binding_creation_order_key(entry[1])),
+        "time": max(results["time"] for results in shard_results),
+        "memory": max(results["memory"] for results in shard_results),
+        "measurements": sorted([measurement for results in shard_results for measurement in results["measurements"]],
+                               key=lambda measurement: (measurement["atomic_constraint_index"],
+                                                        binding_order_key(measurement["binding"]))),
+        "output": '\n'.join(output_substrings),
+        "number_of_shards": len(shard_results),
+        "trace_path": trace_path,
+        "spec_id": spec_id
+    }
+
+
+def _initialise_worker(compiled_spec_path: str) -> None:
+    global _worker_specifications
+    _worker_specifications = load_specifications(compiled_spec_path)
+
+
+def _check_trace_in_worker(check: typing.Tuple[str, typing.Optional[int], str, dict]) -> typing.Optional[dict]:
+    """
+    Check the events for a spec id in a trace, capturing the report that is printed.
+    """
+    trace_path, spec_id, tree_eval_strategy, check_options = check
+    trace = TraceFile(trace_path)
+    if spec_id is None:
+        # use the spec id stored in the trace
+        first_event = trace.peek_first_event()
+        if first_event is None:
+            return None
+        spec_id = first_event["spec_id"]
+    else:
+        trace = SpecificationTrace(trace, spec_id)
+        if trace.peek_first_event() is None:
+            return None
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        results = check_trace(_worker_specifications[spec_id], trace, tree_eval_strategy, **check_options)
+    results["output"] = output.getvalue()
+    results["trace_path"] = trace_path
+    results["spec_id"] = spec_id
+    return results
+
+
+def _check_shard_in_worker(shard: typing.Tuple[str, int, int, int, str, dict]) -> dict:
+    """
+    Check one shard of the bindings of the outermost quantifier, capturing the report that is printed.
+    """
+    trace_path, spec_id, shard_index, number_of_shards, tree_eval_strategy, check_options = shard
+    specification = _worker_specifications[spec_id]
+    trace = SpecificationTrace(TraceFile(trace_path), spec_id)
+    shard_trace = BindingShardTrace(trace, specification.get_id(), shard_index, number_of_shards)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        results = check_trace(specification, shard_trace, tree_eval_strategy, include_measurements=True,
+                              **check_options)
+    results["output"] = output.getvalue()
+    results["number_of_events_read"] = shard_trace.get_number_of_events_read()
+    return results
@@ -1,27 +1,28 @@
 import argparse
 import datetime
+import glob
 import logging
 import json
 import pathlib
-import runpy
 import sys
 
-import tracemalloc
+from time import perf_counter
 
-from SCSL.TraceChecker import Monitor
-from SCSL.Monitoring import get_diagnosis, timer, CustomJSONizer
+from SCSL.TraceChecker import TraceFile, combine_verdicts
+from SCSL.TraceChecker.checking import load_specifications, check_trace, check_traces, check_trace_in_shards
+from SCSL.TraceChecker.aggregation import DiagnosisSummary, aggregate_diagnoses
+from SCSL.Monitoring import CustomJSONizer
 
 
 def main():
     # define command line arguments
     parser = argparse.ArgumentParser(description="Checks traces with respect to SCSL specifications.")
-    parser.add_argument("trace_file",
-                        help="JSON trace file output by the instrumented program")
-    parser.add_argument("project_path",
-                        help="Path to the instrumented project (default: '.')",
-                        type=pathlib.Path,
-                        nargs='?',
-                        default=pathlib.Path('.'))
+    parser.add_argument("paths",
+                        metavar="trace_file [trace_file ...] [project_path]",
+                        nargs='+',
+                        help="JSON (or newline-delimited JSON) trace files output by the instrumented program "
+                             "(or glob patterns matching them), optionally followed by the path to the "
+                             "instrumented project (default: '.')")
     parser.add_argument("--write-tree",
                         action='store_true',
                         help="Write the final monitoring tree to .gv and .pdf files.")
@@ -31,9 +32,45 @@ def main():
                         const='down',
                         default='up',
                         help="Evaluate the tree from the root down rather than from the leaves up.")
+    parser.add_argument("--all-specifications",
+                        action='store_true',
+                        help="Check each trace with respect to every specification it holds events for, "
+                             "rather than the specification given by its first event.")
+    parser.add_argument("--processes",
+                        type=int,
+                        default=None,
+                        help="Number of worker processes to use when checking several traces, or with "
+                             "--all-specifications or --shards (default: the number of CPUs).")
+    parser.add_argument("--fail-fast",
+                        action='store_true',
+                        help="Stop checking a trace as soon as its verdict can no longer change (the bindings "
+                             "falsified by then are still diagnosed).")
+    parser.add_argument("--prune",
+                        action='store_true',
+                        help="Retire the part of the monitoring tree for each binding once its value is final, "
+                             "keeping only what is needed to report False bindings, so that memory does not grow "
+                             "with the length of the trace.")
+    parser.add_argument("--keep-true-bindings",
+                        dest='max_true_binding_summaries',
+                        type=int,
+                        default=0,
+                        help="With --prune, the number of True bindings whose measurements are still reported "
+                             "(default: 0).")
+    parser.add_argument("--shards",
+                        type=int,
+                        default=None,
+                        help="Check a single trace in parallel, by dealing the bindings of the outermost quantifier "
+                             "out to this many worker processes (only for specifications of the form "
+                             "forall q ... with q ranging over changes or calls).")
+    parser.add_argument("--diagnosis-processes",
+                        type=int,
+                        default=1,
+                        help="Diagnose the violations found in a single trace once monitoring has finished, in "
+                             "parallel on this many worker processes, rather than during monitoring (default: 1).")
 
     # parse the arguments
     args = parser.parse_args()
+    trace_patterns, project_path = split_paths(args.paths)
 
     # initialise logging
     logging_path = pathlib.Path('./logs')
@@ -45,71 +82,315 @@ def main():
                         level=logging.INFO)
 
     # read specification from the file generated by instrumentation
-    compiled_spec_path: pathlib.Path = args.project_path.joinpath('compiled_spec.py')
+    compiled_spec_path: pathlib.Path = project_path.joinpath('compiled_spec.py')
     if not compiled_spec_path.exists():
         print('SCSL.TraceChecker: Failed to find a compiled specification in the project directory!')
         print('Has the project been instrumented?')
         sys.exit(-1)
 
-    specifications = runpy.run_path(str(compiled_spec_path))['specifications']
+    specifications = load_specifications(compiled_spec_path)
 
-    # read in trace
-    with open(args.trace_file) as h:
-        trace = json.loads(h.read())
+    trace_paths = expand_trace_patterns(trace_patterns)
+    if len(trace_paths) == 0:
+        print('SCSL.TraceChecker: No trace files match the arguments given!')
+        sys.exit(-1)
 
-    # use the spec ids stored in the trace to get the specification object we need
-    if len(trace) > 0:
-        specification = specifications[trace[0]["spec_id"]]
-    else:
-        print("Trace is empty - nothing to do.")
-        exit()
+    if args.shards is not None and (len(trace_paths) > 1 or args.all_specifications):
+        parser.error("--shards can only be used to check a single trace with respect to a single specification")
 
-    # instantiate a monitor
-    monitor = Monitor(specification, args.tree_eval_strategy)
-    for event in trace:
-        monitor.process_event(event)
+    if args.shards is not None and args.shards < 1:
+        parser.error("--shards must be at least 1")
 
-    # perform final tasks (such as tree resolution for inconclusive verdicts)
-    monitor.wrap_up()
+    if args.diagnosis_processes < 1:
+        parser.error("--diagnosis-processes must be at least 1")
 
-    # print verdict
-    final_verdict = monitor.get_verdict()
-    print(f"SIMPLE VERDICT: {final_verdict}\n")
+    if args.diagnosis_processes > 1 and (args.shards is not None or len(trace_paths) > 1 or args.all_specifications):
+        parser.error("--diagnosis-processes can only be used to check a single trace with respect to a single "
+                     "specification, without --shards")
 
-    print(monitor.get_verdict_explanation())
+    if args.shards is not None:
+        check_sharded(compiled_spec_path, trace_paths[0], args)
+        return
 
-    print("\nSTATISTICS:\n")
+    if len(trace_paths) > 1 or args.all_specifications:
+        check_many(compiled_spec_path, specifications, trace_paths, args)
+        return
 
-    print(f"{monitor.get_number_of_events_observed()} events processed")
+    # the trace is read from disk one event at a time, each time it is iterated over
+    trace = TraceFile(trace_paths[0])
 
-    print(f"{monitor.get_tree_size()} monitoring tree nodes")
+    # use the spec ids stored in the trace to get the specification object we need
+    first_event = trace.peek_first_event()
+    if first_event is not None:
+        specification = specifications[first_event["spec_id"]]
+    else:
+        print("Trace is empty - nothing to do.")
+        exit()
 
     # if args.write_tree:
     #     # write out monitoring tree
     #     monitor.write_tree_to_file("final-tree.gv")
     #     print("Final state of monitoring tree written to 'final-tree.gv.pdf'.")
 
-    # EVALUATION
-    tracemalloc.start()
+    results = check_trace(specification, trace, args.tree_eval_strategy, **get_check_options(args),
+                          diagnosis_processes=args.diagnosis_processes)
+
+    write_results(results, 0)
+
+
+def aggregate_main():
+    # define command line arguments
+    parser = argparse.ArgumentParser(description="Summarises the diagnoses written by many runs of scsl-check-trace, "
+                                                 "ranking the functions and lines at which points of no return "
+                                                 "were found.")
+    parser.add_argument("diagnosis_files",
+                        nargs='+',
+                        help="Diagnosis files written by scsl-check-trace (or glob patterns matching them).")
+    parser.add_argument("--traces",
+                        nargs='+',
+                        default=[],
+                        help="The traces that were checked (or glob patterns matching them), from which the calls of "
+                             "each function are counted, so that the number of points of no return per call of each "
+                             "function is also reported.")
+    parser.add_argument("--summary",
+                        default='diagnosis-summary.json',
+                        help="File holding the summary, which is updated with the files that it does not yet cover "
+                             "(or that have been written since), and written back (default: diagnosis-summary.json).")
+    parser.add_argument("--rebuild",
+                        action='store_true',
+                        help="Ignore any existing summary, and summarise every file given.")
+    parser.add_argument("--processes",
+                        type=int,
+                        default=None,
+                        help="Number of worker processes reading the files (default: the number of CPUs).")
+    parser.add_argument("--top",
+                        type=int,
+                        default=10,
+                        help="Number of functions and lines to print (default: 10).")
+
+    # parse the arguments
+    args = parser.parse_args()
+
+    # (the summary is not a diagnosis file, even if a pattern matches it)
+    diagnosis_paths = [path for path in expand_trace_patterns(args.diagnosis_files)
+                       if pathlib.Path(path).resolve() != pathlib.Path(args.summary).resolve()]
+    trace_paths = expand_trace_patterns(args.traces)
+    missing_paths = [path for path in diagnosis_paths + trace_paths if not pathlib.Path(path).is_file()]
+    if missing_paths:
+        parser.error(f"no such file: {missing_paths[0]}")
+
+    summary = None
+    if not args.rebuild and pathlib.Path(args.summary).exists():
+        with open(args.summary) as in_file:
+            summary = DiagnosisSummary.from_dict(json.load(in_file))
+        print(f'Updating the summary in {args.summary} ({summary.get_number_of_files()} diagnosis files, '
+              f'{summary.get_number_of_violations()} violations).')
+
+    start_time = perf_counter()
+    summary = aggregate_diagnoses(diagnosis_paths, trace_paths, summary, args.processes)
+    print(f'{summary.get_number_of_violations()} violations from {summary.get_number_of_files()} diagnosis files '
+          f'summarised in {perf_counter() - start_time:0.4f} s')
+
+    write_diagnosis_summary(summary, args.summary, args.top)
+
+
+def write_diagnosis_summary(summary: DiagnosisSummary, path: str, top: int):
+    """
+    Print the functions and lines at which points of no return were most often found, and write the summary to
+    `path`.
+    """
+    overrun = summary.get_overruns().summarise()
+    if overrun["count"]:
+        print(f'\nOverruns: p50 {overrun["p50"]:0.4f} s, p99 {overrun["p99"]:0.4f} s, max {overrun["max"]:0.4f} s')
+
+    print("\nPOINTS OF NO RETURN BY FUNCTION:\n")
+    for function in summary.get_function_ranking()[:top]:
+        rate = '' if function["pnr_rate"] is None else \
+            f', {function["pnr_rate"]:0.4f} per call over {function["number_of_calls"]} calls'
+        # (diagnosis files written before overruns were recorded have none)
+        overrun = '' if function["overrun"]["count"] == 0 else \
+            f', overrun p50 {function["overrun"]["p50"]:0.4f} s, p99 {function["overrun"]["p99"]:0.4f} s'
+        print(f'{function["function_name"]}: {function["pnr_count"]} violations '
+              f'({100 * function["pnr_frequency"]:0.2f}%{rate}){overrun}')
 
-    # get diagnosis
-    diagnosis, time = get_diagnosis(specification, trace, monitor)
+    print("\nPOINTS OF NO RETURN BY LINE:\n")
+    for hotspot in summary.get_line_hotspots()[:top]:
+        print(f'{hotspot["function_name"]} (line {hotspot["line_number"]}): {hotspot["pnr_count"]} violations')
 
-    print(f"Consumed memory: current {tracemalloc.get_traced_memory()[0] / (1024):0.4f} kB"
-          f" and the peak {tracemalloc.get_traced_memory()[1] / (1024):0.4f} kB")
+    with open(path, "w") as out_file:
+        print(f'\nThe summary was written as {path}!')
+        out_file.write(json.dumps(summary.to_dict(), cls=CustomJSONizer))
 
-    memory = tracemalloc.get_traced_memory()[1] / (1024)
-    tracemalloc.stop()
 
-    time_mem = tuple([time, memory])  # Replace with your time and memory data
-    with open(f'diagnosis-{0}.json', "w") as out_file:
-        print(f'The diagnosis ({len(diagnosis)} events) was written as diagnosis-{0}.json!')
+def get_check_options(args) -> dict:
+    """
+    Get the keyword arguments for check_trace given by the command line arguments.
+    """
+    return {
+        "fail_fast": args.fail_fast,
+        "prune": args.prune,
+        "max_true_binding_summaries": args.max_true_binding_summaries
+    }
+
+
+def split_paths(paths: list) -> tuple:
+    """
+    Split the positional arguments into the trace patterns and the project path.
+
+    The project path is the last argument, if there is more than one argument and the last one is a directory.
+    """
+    if len(paths) > 1 and pathlib.Path(paths[-1]).is_dir():
+        return paths[:-1], pathlib.Path(paths[-1])
+    return paths, pathlib.Path('.')
+
+
+def expand_trace_patterns(trace_patterns: list) -> list:
+    """
+    Expand glob patterns (which the shell has not already expanded), keeping the order of the arguments and
+    dropping duplicates.
+    """
+    trace_paths = []
+    for pattern in trace_patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for trace_path in matches:
+            if trace_path not in trace_paths:
+                trace_paths.append(trace_path)
+    return trace_paths
+
+
+def get_output_suffix(trace_path: str, spec_id, single_trace: bool) -> str:
+    """
+    Get the suffix of the names of the files written for a check, based on the name of the trace (without the
+    extensions added by offline monitoring) and, if every specification is checked, the spec id.
+    """
+    if single_trace:
+        return str(spec_id)
+    name = pathlib.Path(trace_path).name
+    for extension in ['.gz', '.xz', '.jsonl', '.json']:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return name if spec_id is None else f'{name}-{spec_id}'
+
+
+def check_many(compiled_spec_path: pathlib.Path, specifications: list, trace_paths: list, args):
+    """
+    Check each trace (with respect to either every specification or the one given by its first event) on a pool of
+    worker processes, printing the reports in order, then write and print a summary of all the checks.
+    """
+    spec_ids = range(len(specifications)) if args.all_specifications else [None]
+    checks = [(trace_path, spec_id) for trace_path in trace_paths for spec_id in spec_ids]
+
+    start_time = perf_counter()
+    entries = []
+    used_suffixes = set()
+    for (trace_path, spec_id), results in zip(checks, check_traces(compiled_spec_path, checks, args.processes,
+                                                                    args.tree_eval_strategy,
+                                                                    get_check_options(args))):
+        heading = trace_path if spec_id is None else f'{trace_path} (spec id {spec_id})'
+        print(f"===== {heading} =====\n")
+        if results is None:
+            print("The trace holds no events for this specification - nothing to do.\n")
+            continue
+        print(results["output"])
+
+        # make sure that the files written for different checks have different names
+        suffix = get_output_suffix(trace_path, spec_id, len(trace_paths) == 1)
+        unique_suffix = suffix
+        duplicates = 0
+        while unique_suffix in used_suffixes:
+            duplicates += 1
+            unique_suffix = f'{suffix}-{duplicates}'
+        used_suffixes.add(unique_suffix)
+        write_results(results, unique_suffix)
+
+        entries.append({
+            "trace": trace_path,
+            "spec_id": results["spec_id"],
+            "verdict": results["verdict"],
+            "number_of_events": results["number_of_events"],
+            "monitoring_time": results["monitoring_time"],
+            "throughput": results["number_of_events"] / results["monitoring_time"]
+            if results["monitoring_time"] > 0 else None,
+            "diagnosis_time_ms": results["time"],
+            "diagnosis_memory_kb": results["memory"],
+            "diagnosis_file": f'diagnosis-{unique_suffix}.json'
+        })
+
+    write_summary(entries, perf_counter() - start_time)
+
+
+def check_sharded(compiled_spec_path: pathlib.Path, trace_path: str, args):
+    """
+    Check a single trace with its bindings split into shards that are checked on a pool of worker processes,
+    printing the report for each shard followed by the merged verdict.
+    """
+    results = check_trace_in_shards(compiled_spec_path, trace_path, number_of_shards=args.shards,
+                                    processes=args.processes, tree_eval_strategy=args.tree_eval_strategy,
+                                    check_options=get_check_options(args))
+    if results is None:
+        print("Trace is empty - nothing to do.")
+        return
+    print(results["output"])
+    if results["number_of_shards"] < args.shards:
+        print("The specification does not allow its bindings to be split into shards, "
+              "so the trace was checked as a single shard.\n")
+
+    print(f"SIMPLE VERDICT: {results['verdict']}\n")
+    print(f"{results['number_of_events']} events processed by {results['number_of_shards']} shards")
+    print(f"{results['tree_size']} monitoring tree nodes")
+
+    write_results(results, 0)
+
+
+def write_summary(entries: list, wall_clock_time: float):
+    """
+    Print a summary of all the checks performed, and write it to summary.json.
+    """
+    if len(entries) == 0:
+        print("Trace is empty - nothing to do.")
+        return
+
+    verdicts = [entry["verdict"] for entry in entries]
+    number_of_events = sum(entry["number_of_events"] for entry in entries)
+    summary = {
+        "number_of_checks": len(entries),
+        "verdict_counts": {str(verdict): verdicts.count(verdict) for verdict in [True, False, None]},
+        "combined_verdict": combine_verdicts(verdicts),
+        "number_of_events": number_of_events,
+        "wall_clock_time": wall_clock_time,
+        "throughput": number_of_events / wall_clock_time if wall_clock_time > 0 else None,
+        "checks": entries
+    }
+
+    print("\nSUMMARY:\n")
+    for entry in entries:
+        print(f'{entry["trace"]} (spec id {entry["spec_id"]}): verdict {entry["verdict"]}, '
+              f'{entry["number_of_events"]} events in {entry["monitoring_time"]:0.4f} s, '
+              f'diagnosis in {entry["diagnosis_time_ms"]:0.4f} ms using {entry["diagnosis_memory_kb"]:0.4f} kB')
+    print(f'\nVerdicts: {summary["verdict_counts"]["True"]} True, {summary["verdict_counts"]["False"]} False, '
+          f'{summary["verdict_counts"]["None"]} None')
+    print(f'{number_of_events} events checked in {wall_clock_time:0.4f} s')
+    print(f'\nCOMBINED VERDICT: {summary["combined_verdict"]}')
+
+    with open('summary.json', "w") as out_file:
+        print('The summary was written as summary.json!')
+        out_file.write(json.dumps(summary, cls=CustomJSONizer))
+
+
+def write_results(results: dict, suffix):
+    """
+    Write the diagnosis to diagnosis-<suffix>.json, and append the time and memory it took to time-mem-<suffix>.json.
+    """
+    diagnosis = results["diagnosis"]
+    time_mem = tuple([results["time"], results["memory"]])  # Replace with your time and memory data
+    with open(f'diagnosis-{suffix}.json', "w") as out_file:
+        print(f'The diagnosis ({len(diagnosis)} events) was written as diagnosis-{suffix}.json!')
         out_file.write(json.dumps(diagnosis, cls=CustomJSONizer))
 
-    # Reading existing time-mem data from 'time-mem-{0}.json'
+    # Reading existing time-mem data from 'time-mem-{suffix}.json'
     existing_data = []
     try:
-        with open(f'time-mem-{0}.json', 'r') as in_file:
+        with open(f'time-mem-{suffix}.json', 'r') as in_file:
             content = in_file.read()
             if content:
                 existing_data = json.loads(content)
@@ -119,8 +400,7 @@ def main():
     # Appending new time_mem to existing_data
     existing_data.append(time_mem)
 
-    # Writing the combined data back to 'time-mem-{0}.json'
-    with open(f'time-mem-{0}.json', "w") as out_file:
-        print(f'The time and memory was written as time-mem-{0}.json!')
+    # Writing the combined data back to 'time-mem-{suffix}.json'
+    with open(f'time-mem-{suffix}.json', "w") as out_file:
+        print(f'The time and memory was written as time-mem-{suffix}.json!')
         out_file.write(json.dumps(existing_data, cls=CustomJSONizer, separators=(',', ']')))
-
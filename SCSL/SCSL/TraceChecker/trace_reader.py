@@ -0,0 +1,248 @@
+"""
+Module holding the logic for reading traces incrementally, one event at a time.
+
+Two formats are supported:
+
+- a JSON array of events, and
+- newline-delimited JSON, with one event per line (the format written by offline monitoring),
+  optionally compressed with gzip or lzma.
+
+Compression is detected from the first bytes of the file, and the format from the first non-whitespace character.
+"""
+import contextlib
+import gzip
+import json
+import lzma
+import re
+
+# matches whitespace and the commas separating the elements of a JSON array
+_SEPARATOR_PATTERN = re.compile(r'[\s,]*')
+
+# number of characters read from a trace file at a time
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+# type of the event written at the end of a trace by offline monitoring
+# (it carries no information for monitors, so it is not yielded by the reader)
+TRACE_FOOTER_TYPE = "end-of-trace"
+
+# magic numbers at the start of compressed files
+_GZIP_MAGIC_NUMBER = b'\x1f\x8b'
+_LZMA_MAGIC_NUMBER = b'\xfd7zXZ\x00'
+
+
+class TraceFormatError(Exception):
+    pass
+
+
+class TraceFile:
+    """
+    Class representing a trace stored on disk.
+
+    Iterating over an instance reads the trace from disk, yielding one event at a time, so a trace can be
+    scanned more than once (for example, by `get_diagnosis`) without ever being held in memory.
+    """
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._path = path
+        self._chunk_size = chunk_size
+
+    def get_path(self):
+        return self._path
+
+    def __iter__(self):
+        return iterate_trace_events(self._path, self._chunk_size)
+
+    def peek_first_event(self):
+        """
+        Get the first event in the trace (or None if it holds no events), closing the file before returning.
+        """
+        with contextlib.closing(iter(self)) as events:
+            return next(events, None)
+
+    def __repr__(self):
+        return f"TraceFile({self._path!r})"
+
+
+class SpecificationTrace:
+    """
+    Class representing the events of a trace that are relevant to a single specification.
+
+    Events without a spec id (such as signal events) are relevant to every specification.
+    Like TraceFile, an instance can be iterated over more than once.
+    """
+
+    def __init__(self, trace, spec_id):
+        self._trace = trace
+        self._spec_id = spec_id
+
+    def get_spec_id(self):
+        return self._spec_id
+
+    def __iter__(self):
+        spec_id = self._spec_id
+        return (event for event in self._trace if event.get("spec_id", spec_id) == spec_id)
+
+    def peek_first_event(self):
+        """
+        Get the first event relevant to the specification (or None if there is none), closing the trace file before
+        returning.
+        """
+        spec_id = self._spec_id
+        with contextlib.closing(iter(self._trace)) as events:
+            return next((event for event in events if event.get("spec_id", spec_id) == spec_id), None)
+
+
+class BindingShardTrace:
+    """
+    Class representing the events of a trace that are needed to monitor one shard of the bindings of the outermost
+    quantifier (with id `quantifier_id`).
+
+    Triggers for the outermost quantifier are dealt out to the `number_of_shards` shards in turn, so the shard with
+    index `shard_index` holds the triggers whose position among those triggers is `shard_index` modulo
+    `number_of_shards`.  Every other event can concern any binding, so it is kept, except for measurement and
+    function events that occur before the shard's first trigger (these can only concern the bindings of other shards).
+    Like TraceFile, an instance can be iterated over more than once.
+    """
+
+    def __init__(self, trace, quantifier_id, shard_index, number_of_shards):
+        self._trace = trace
+        self._quantifier_id = quantifier_id
+        self._shard_index = shard_index
+        self._number_of_shards = number_of_shards
+        self._number_of_events_read = 0
+
+    def get_shard_index(self):
+        return self._shard_index
+
+    def get_number_of_events_read(self):
+        """
+        Get the number of events read from the underlying trace (including those not in the shard)
+        during the most recent iteration.
+        """
+        return self._number_of_events_read
+
+    def __iter__(self):
+        return self._iterate_shard_events()
+
+    def _iterate_shard_events(self):
+        self._number_of_events_read = 0
+        # number of triggers for the outermost quantifier seen so far
+        number_of_triggers = 0
+        seen_first_trigger = False
+        for event in self._trace:
+            self._number_of_events_read += 1
+            if event["type"] == "trigger" and event["quantifier_id"] == self._quantifier_id:
+                owned = number_of_triggers % self._number_of_shards == self._shard_index
+                number_of_triggers += 1
+                if not owned:
+                    continue
+                seen_first_trigger = True
+            elif event["type"] in ["measurement", "function"] and not seen_first_trigger:
+                continue
+            yield event
+
+
+def iterate_trace_events(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Open the trace at `path` and yield its events one at a time, in either of the supported formats.
+    """
+    # close the file as soon as this generator is closed, even if it is closed before the end of the trace
+    with contextlib.closing(_iterate_all_trace_events(path, chunk_size)) as events:
+        for event in events:
+            if event.get("type") != TRACE_FOOTER_TYPE:
+                yield event
+
+
+def iterate_json_values(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Open the file at `path` (holding a JSON array or newline-delimited JSON, in the same way as a trace) and yield
+    the values it holds one at a time, whatever they are.  This is used to read diagnosis files.
+    """
+    yield from _iterate_all_trace_events(path, chunk_size)
+
+
+def _open_trace(path):
+    """
+    Open the trace at `path` for reading text, decompressing it if needed.
+    """
+    with open(path, 'rb') as handle:
+        magic_number = handle.read(len(_LZMA_MAGIC_NUMBER))
+    if magic_number.startswith(_GZIP_MAGIC_NUMBER):
+        return gzip.open(path, 'rt')
+    elif magic_number.startswith(_LZMA_MAGIC_NUMBER):
+        return lzma.open(path, 'rt')
+    else:
+        return open(path)
+
+
+def _iterate_all_trace_events(path, chunk_size):
+    """
+    Yield every event in the trace at `path`, including the footer (if there is one).
+    """
+    with _open_trace(path) as handle:
+        # decide on the format using the first non-whitespace character
+        first_chunk = handle.read(chunk_size)
+        stripped_first_chunk = first_chunk.lstrip()
+        while stripped_first_chunk == '' and first_chunk != '':
+            first_chunk = handle.read(chunk_size)
+            stripped_first_chunk = first_chunk.lstrip()
+        if stripped_first_chunk == '':
+            # empty trace
+            return
+        if stripped_first_chunk[0] == '[':
+            yield from _iterate_json_array(handle, stripped_first_chunk[1:], chunk_size)
+        else:
+            yield from _iterate_json_lines(handle, stripped_first_chunk)
+
+
+def _iterate_json_array(handle, buffer, chunk_size):
+    """
+    Yield the elements of a JSON array, given the text following the opening bracket in `buffer`
+    and the handle from which the rest of the array can be read.
+    """
+    decoder = json.JSONDecoder()
+    position = 0
+    end_of_file = False
+    while True:
+        # skip whitespace and separators
+        position = _SEPARATOR_PATTERN.match(buffer, position).end()
+        if position == len(buffer):
+            if end_of_file:
+                raise TraceFormatError("The trace ended before the closing ']' of the JSON array.")
+            # drop the text that has already been decoded, then read more
+            buffer = handle.read(chunk_size)
+            position = 0
+            end_of_file = buffer == ''
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            event, end_position = decoder.raw_decode(buffer, position)
+            # a value that reaches the end of the buffer may have been cut off (for example, a number)
+            if end_position == len(buffer) and not end_of_file:
+                raise json.JSONDecodeError("Value may continue in the next chunk", buffer, end_position)
+        except json.JSONDecodeError as e:
+            if end_of_file:
+                raise TraceFormatError(f"Could not decode an event from the trace: {e}")
+            # the event spans the end of the buffer, so read more and try again
+            chunk = handle.read(chunk_size)
+            end_of_file = chunk == ''
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield event
+        position = end_position
+
+
+def _iterate_json_lines(handle, first_chunk):
+    """
+    Yield the events of a newline-delimited JSON trace, given the first chunk already read from `handle`.
+    """
+    # complete the line that the first chunk ends in
+    lines = (first_chunk + handle.readline()).splitlines()
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+    for line in handle:
+        if line.strip():
+            yield json.loads(line)
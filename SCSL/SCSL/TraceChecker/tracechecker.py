@@ -2,8 +2,13 @@
 Module holding the logic for offline monitoring of LHS specifications.
 """
 # import pprint
+import bisect
+import collections.abc
 import functools
+import heapq
 import itertools
+import math
+import operator
 import typing
 
 import graphviz
@@ -15,7 +20,6 @@ import logging
 import sys
 
 from SCSL.Specifications.predicates import inTimeInterval
-from SCSL.Specifications.builder import construct_cumulative_binding
 from SCSL.Specifications.builder import forall, exists, conjunction, disjunction, negate
 from SCSL.Specifications.predicates import calls, changes
 from SCSL.Specifications.constraints import (is_normal_atom,
@@ -47,6 +51,109 @@ from SCSL.Specifications.constraints import (is_normal_atom,
 class IncompatibleTypeError(Exception):
     pass
 
+class Binding(collections.abc.Mapping):
+    """
+    Class representing the binding held by the nodes of a branch of a monitoring tree (a map from quantifier ids to
+    timestamps).
+
+    A binding is shared by every node in its branch, and extends the binding of the branch above it with at most one
+    entry, so constructing a binding for a new branch takes constant time.  A provisional branch (one added below a
+    quantifier before any trigger for that quantifier has been observed) holds a binding without a timestamp, which
+    `bind` then fills in for every node below the quantifier at once.
+
+    Bindings are numbered in the order in which they are constructed, which is the order in which their branches are
+    added, even if the subtree of a branch is only constructed later (see MonitorTreeLazyBranchNode).
+    """
+
+    __slots__ = ('_parent', '_quantifier_id', '_timestamp', '_creation_index')
+
+    _creation_counter = itertools.count()
+
+    def __init__(self, parent=None, quantifier_id=None, timestamp=None):
+        self._parent = parent
+        self._quantifier_id = quantifier_id
+        self._timestamp = timestamp
+        self._creation_index = next(Binding._creation_counter)
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        """
+        Construct a binding with the entries of `dictionary`, in order.
+        """
+        binding = cls()
+        for quantifier_id, timestamp in dictionary.items():
+            binding = cls(binding, quantifier_id, timestamp)
+        return binding
+
+    def get_creation_index(self):
+        return self._creation_index
+
+    def bind(self, timestamp):
+        """
+        Give the provisional entry of this binding the timestamp `timestamp`.
+        """
+        self._timestamp = timestamp
+
+    def _get_entries(self):
+        """
+        Get the (quantifier id, timestamp) pairs in this binding, from the outermost quantifier inwards.
+        """
+        entries = []
+        binding = self
+        while binding is not None:
+            if binding._timestamp is not None:
+                entries.append((binding._quantifier_id, binding._timestamp))
+            binding = binding._parent
+        entries.reverse()
+        return entries
+
+    def to_dict(self):
+        return dict(self._get_entries())
+
+    def __getitem__(self, quantifier_id):
+        binding = self
+        while binding is not None:
+            if binding._quantifier_id == quantifier_id and binding._timestamp is not None:
+                return binding._timestamp
+            binding = binding._parent
+        raise KeyError(quantifier_id)
+
+    def __contains__(self, quantifier_id):
+        binding = self
+        while binding is not None:
+            if binding._quantifier_id == quantifier_id and binding._timestamp is not None:
+                return True
+            binding = binding._parent
+        return False
+
+    def __iter__(self):
+        return (quantifier_id for quantifier_id, _ in self._get_entries())
+
+    def __len__(self):
+        return len(self._get_entries())
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def walk_tree(root, visit):
+    """
+    Walk the monitoring tree below `root` depth first, using an explicit stack rather than recursion (so the size of
+    the tree is not limited by the recursion limit, and no call is made per level).
+
+    `visit` is called on each node and gives the nodes to walk next (usually the children of the node, or none to
+    stop there).  These are taken one at a time, and the whole subtree below each is walked before the next is taken,
+    so `visit` may be a generator that looks at the nodes it has given so far before giving the next, or that does
+    something once the subtrees below them have all been walked.
+    """
+    iterators = [iter(visit(root))]
+    while iterators:
+        node = next(iterators[-1], None)
+        if node is None:
+            iterators.pop()
+        else:
+            iterators.append(iter(visit(node)))
+
 class MonitorTreeNode():
     """
     Class representing a node in a monitoring tree.
@@ -54,18 +161,22 @@ class MonitorTreeNode():
     The node needs to contain a reference to the subformula to which it corresponds.
     """
 
+    __slots__ = ('_monitor', '_binding', '_subformula', '_children', '_parent', '_value')
+
     def __init__(self, subformula, binding, monitor):
         self._monitor = monitor
-        self._binding = binding
+        self._binding = binding if isinstance(binding, Binding) else Binding.from_dict(binding)
         self._subformula = subformula
-        self._children = []
+        # leaves share an empty tuple, and a list is only created once a node has a child
+        self._children = ()
         self._parent = None
         # to be used when evaluating the monitoring tree
         self._value = None
         # # add node to monitor's list
         # self._monitor._monitoring_tree_nodes.append(self)
-        # add to list of all nodes
-        self._monitor._all_nodes.append(self)
+        # add to the (insertion-ordered) collection of all nodes, and count it as open until it has a value
+        self._monitor._all_nodes[self] = None
+        self._monitor._number_of_open_nodes += 1
 
     def __sizeof__(self):
         return sys.getsizeof(self.get_value()) + sys.getsizeof(self.get_subformula())
@@ -74,10 +185,19 @@ class MonitorTreeNode():
         return self._value
 
     def set_value(self, value):
+        if self._parent is not None and value is not self._value:
+            self._parent._update_child_counts(self._value, value)
+            if value is False or self._value is False:
+                self._monitor._update_false_binding_nodes(self, value)
+        if (value is None) is not (self._value is None):
+            self._monitor._number_of_open_nodes += 1 if value is None else -1
         self._value = value
 
     def get_binding(self):
-        return self._binding
+        """
+        Get the binding held by this node, as a dictionary.
+        """
+        return self._binding.to_dict()
 
     def get_subformula(self):
         return self._subformula
@@ -92,94 +212,83 @@ class MonitorTreeNode():
         return self._children
 
     def add_child(self, child_node):
-        self._children.append(child_node)
+        if self._children:
+            self._children.append(child_node)
+        else:
+            self._children = [child_node]
         child_node.set_parent(self)
+        self._update_child_counts(None, child_node.get_value())
 
-    def evaluate_upwards(self):
+    def _update_child_counts(self, old_value, new_value):
         """
-        Depending on the type of the parent, update it accordingly.
-        """
-        # get parent
-        parent = self.get_parent()
-        # check to see if we're at the root
-        if parent:
-            if type(parent) is MonitorTreeQuantifierNode:
-                # dealing with a quantifier node, so evaluating its truth value
-                # just involves either and-ing or or-ing its existing truth value
-                # with the value given by evaluating the current node
-                if type(parent.get_subformula()) is forall:
-                    # and the current value with self.get_value()
-                    original_parent_value = parent.get_value()
-                    if parent.get_value() is None and self.get_value() is False:
-                        parent.set_value(self.get_value())
-                    elif parent.get_value() is not None and self.get_value() is not False:
-                        parent.set_value(parent.get_value() and self.get_value())
-                elif type(parent.get_subformula()) is exists:
-                    # or the current value with self.get_value()
-                    if parent.get_value() is None:
-                        parent.set_value(self.get_value())
-                    elif parent.get_value() is not True:
-                        parent.set_value(parent.get_value() or self.get_value())
-                    # exists is not allowed to be False until the end of the trace,
-                    # so check and revert to None if this is the case
-                    if parent.get_value() is False:
-                        parent.set_value(None)
-                    # if the exists is true now, remove it from self._monitor._nodes_with_timestamp_quantifiers
-                    # (if it's in there)
-                    if parent in self._monitor._nodes_with_timestamp_quantifiers and parent.get_value() is True:
-                        self._monitor._nodes_with_timestamp_quantifiers.remove(parent)
-                    # if true, remove the quantifier from the list of quantifiers
-                    # to which branches can be added
-                    if parent.get_value() is True:
-                        if parent in parent._monitor.quantifier_id_to_nodes[parent.quantifier_id]:
-                            parent._monitor.quantifier_id_to_nodes[parent.quantifier_id].remove(parent)
-            elif type(parent) is MonitorTreeConjunctionNode:
-                # get truth values of children
-                all_truth_values = list(map(lambda child : child.get_value(), parent.get_children()))
-                # compute current truth value of conjunction
-                current_truth_value = True
-                for value in all_truth_values:
-                    current_truth_value = current_truth_value and value
-                parent.set_value(current_truth_value)
-            elif type(parent) is MonitorTreeDisjunctionNode:
-                # get truth values of children
-                all_truth_values = list(map(lambda child: child.get_value(), parent.get_children()))
-                # compute current truth value of disjunction
-                current_truth_value = False
-                for value in all_truth_values:
-                    current_truth_value = current_truth_value or value
-                parent.set_value(current_truth_value)
-            else:
-                # we're dealing with an atomic constraint or expression node
-                parent.evaluate()
+        Called when the value of a child of this node changes from `old_value` to `new_value`.
 
-            # continue upwards evaluation from the parent
-            parent.evaluate_upwards()
+        Only nodes that derive their values from counts of the values of their children (see MonitorTreeCountingNode)
+        need to do anything.
+        """
+        pass
 
-    def update_subtree_binding(self, additional_entry):
+    def get_depth(self):
+        """
+        Get the number of nodes above this node.
         """
-        Given `additional_entry`, recurse on the subtree, adding
-        the key-value pair to the binding held by each node.
+        depth = 0
+        node = self._parent
+        while node is not None:
+            depth += 1
+            node = node._parent
+        return depth
+
+    def update_value(self):
         """
-        # update binding
-        self._binding.update(additional_entry)
-        # recurse
-        for child in self.get_children():
-            child.update_subtree_binding(additional_entry)
+        Evaluate this node from the values of its children, and return whether its value changed.
+        """
+        original_value = self.get_value()
+        self.evaluate()
+        return self.get_value() is not original_value
 
-    def extract_measurements_from_subtree(self, atoms, up_to_id):
+    def evaluate_upwards(self):
+        """
+        Evaluate the ancestors of this node in turn, stopping at the first whose value does not change
+        (since nothing above it can change either).
+        """
+        node = self
+        parent = node.get_parent()
+        while parent is not None:
+            # if this is a binding of the outermost quantifier and its value is now final,
+            # the monitor can retire its subtree once the current event has been processed
+            if (parent is self._monitor._monitoring_tree and self._monitor._prune
+                    and node.get_value() is not None):
+                self._monitor._resolved_bindings.append(node)
+            if not parent.update_value():
+                # the binding holding the parent may still have been waiting for this node to have a value
+                self._monitor._note_evaluated_binding(parent)
+                break
+            node, parent = parent, parent.get_parent()
+
+    def update_subtree_binding(self, timestamp):
+        """
+        Give the provisional binding held by this node (the root of a provisional subtree) the timestamp `timestamp`.
+
+        Every node in the subtree shares, or extends, this binding, so the whole subtree is updated at once.
+        """
+        self._binding.bind(timestamp)
+
+    def extract_measurements_from_subtree(self, compiled_specification, up_to_id):
         """
         Construct a map from atom and subatom indices to measurements.
         """
         # initialise empty dictionary
         atom_subatom_measurement_map = {}
-        # recurse on subtree
-        self._extract_measurements_from_subtree(atoms, up_to_id, atom_subatom_measurement_map)
+        # walk the subtree
+        walk_tree(self, lambda node: node._extract_measurements_from_subtree(compiled_specification, up_to_id,
+                                                                             atom_subatom_measurement_map))
         return atom_subatom_measurement_map
 
-    def _extract_measurements_from_subtree(self, atoms, up_to_id, atom_subatom_measurement_map):
+    def _extract_measurements_from_subtree(self, compiled_specification, up_to_id, atom_subatom_measurement_map):
         """
-        Recurse and base cases.
+        Add the measurements held by this node to `atom_subatom_measurement_map` if it is an atom, and return the
+        nodes to walk next.
         """
         # check whether the current tree root is an atomic constraint
         if is_normal_atom(self.get_subformula()) and type(self.get_subformula()) is not BooleanConstant:
@@ -188,7 +297,7 @@ class MonitorTreeNode():
             # to the root of the specification
             if self.get_children()[0].get_subformula().get_base_variable().get_name() < up_to_id:
                 dictionary = {
-                    atoms.index(self.get_subformula()): {
+                    compiled_specification.get_atom_index(self.get_subformula()): {
                         0: self.get_children()[0].get_value()
                     }
                 }
@@ -197,7 +306,7 @@ class MonitorTreeNode():
             # only include measurements from this atomic constraint
             # if those measurements are derived from a variable close enough
             # to the root of the specification
-            atom_index = atoms.index(self.get_subformula())
+            atom_index = compiled_specification.get_atom_index(self.get_subformula())
             dictionary = {
                 atom_index: {}
             }
@@ -208,11 +317,11 @@ class MonitorTreeNode():
             if dictionary != {atom_index: {}}:
                 atom_subatom_measurement_map.update(dictionary)
         else:
-            # not an atomic constraint, so recurse on children
-            for child in self.get_children():
-                child._extract_measurements_from_subtree(atoms, up_to_id, atom_subatom_measurement_map)
+            # not an atomic constraint, so walk the children
+            return self.get_children()
+        return ()
 
-    def update_newest_branch(self, atoms, measurements):
+    def update_newest_branch(self, compiled_specification, measurements):
         """
         Given a dictionary of measurements, traverse the newest branch attached to self
         and set values of nodes to values found on another branch.
@@ -221,16 +330,17 @@ class MonitorTreeNode():
         monitoring tree that those measurements also apply on new branches, hence must be copied over
         when we add a new branch.
         """
-        self._update_newest_branch(atoms, measurements)
+        walk_tree(self, lambda node: node._update_newest_branch(compiled_specification, measurements))
 
-    def _update_newest_branch(self, atoms, measurements):
+    def _update_newest_branch(self, compiled_specification, measurements):
         """
-        Recursive and base cases.
+        Set the values of the children of this node from `measurements` if it is an atom, and return the nodes to walk
+        next.
         """
         # check type of current_node
         if is_normal_atom(self.get_subformula()) or is_mixed_atom(self.get_subformula()):
             # check atom index
-            atom_index = atoms.index(self.get_subformula())
+            atom_index = compiled_specification.get_atom_index(self.get_subformula())
             if atom_index in measurements:
                 for subatom_index in measurements[atom_index]:
                     self.get_children()[subatom_index].set_value(
@@ -239,54 +349,82 @@ class MonitorTreeNode():
                     # evaluate
                     self.get_children()[subatom_index].evaluate_upwards()
         else:
-            # recurse
-            for child in self.get_children():
-                child._update_newest_branch(atoms, measurements)
+            # walk the children
+            return self.get_children()
+        return ()
 
 
-class MonitorTreeConjunctionNode(MonitorTreeNode):
+class MonitorTreeCountingNode(MonitorTreeNode):
     """
-    Class representing a node in a tree that holds a conjunction.
+    Class representing a node whose truth value is derived from the truth values of its children (a connective or a
+    quantifier).
+
+    The node counts its children that are True and those that are False (the rest have no truth value yet).  Setting
+    the value of a child updates these counts, so the node can be evaluated in constant time, however many children
+    it has.
     """
 
+    __slots__ = ('_number_of_true_children', '_number_of_false_children')
+
     def __init__(self, subformula, binding, monitor):
         # superclass call
         super().__init__(subformula, binding, monitor)
-        # set value
-        # self.set_value(True)
+        self._number_of_true_children = 0
+        self._number_of_false_children = 0
+
+    def _update_child_counts(self, old_value, new_value):
+        if old_value is True:
+            self._number_of_true_children -= 1
+        elif old_value is False:
+            self._number_of_false_children -= 1
+        if new_value is True:
+            self._number_of_true_children += 1
+        elif new_value is False:
+            self._number_of_false_children += 1
+
+    def remove_child(self, child_node):
+        self._children.remove(child_node)
+        self._update_child_counts(child_node.get_value(), None)
+        child_node.set_parent(None)
+
+
+class MonitorTreeConjunctionNode(MonitorTreeCountingNode):
+    """
+    Class representing a node in a tree that holds a conjunction.
+    """
+
+    __slots__ = ()
 
     def evaluate(self):
-        if self.get_value() is not False:
-            final_value = True
-            for child in self.get_children():
-                child.evaluate()
-                final_value = final_value and child.get_value()
-            self.set_value(final_value)
-
-class MonitorTreeDisjunctionNode(MonitorTreeNode):
+        if self._number_of_false_children > 0:
+            self.set_value(False)
+        elif self._number_of_true_children == len(self.get_children()):
+            self.set_value(True)
+        else:
+            self.set_value(None)
+
+class MonitorTreeDisjunctionNode(MonitorTreeCountingNode):
     """
     Class representing a node in a tree that holds a disjunction.
     """
 
-    def __init__(self, subformula, binding, monitor):
-        # superclass call
-        super().__init__(subformula, binding, monitor)
-        # set value
-        # self.set_value(True)
+    __slots__ = ()
 
     def evaluate(self):
-        if self.get_value() is not True:
-            final_value = False
-            for child in self.get_children():
-                child.evaluate()
-                final_value = final_value or child.get_value()
-            self.set_value(final_value)
+        if self._number_of_true_children > 0:
+            self.set_value(True)
+        elif self._number_of_false_children == len(self.get_children()):
+            self.set_value(False)
+        else:
+            self.set_value(None)
 
 class MonitorTreeNegateNode(MonitorTreeNode):
     """
     Class representing a node in a tree that holds a disjunction.
     """
 
+    __slots__ = ()
+
     def evaluate(self):
         # evaluate the child
         self.get_children()[0].evaluate()
@@ -294,169 +432,115 @@ class MonitorTreeNegateNode(MonitorTreeNode):
         child_value = self.get_children()[0].get_value()
         # reverse the child value, if it's a truth value
         if child_value == True:
-            self._value = False
+            self.set_value(False)
         elif child_value == False:
-            self._value = True
+            self.set_value(True)
+
+# the comparisons made by atoms that compare the value of their expression (or, for timeBetween, the time between
+# their two expressions) with their constant, with the operators used to describe them in errors
+ATOM_COMPARISONS = {
+    SignalAtTimestampEqualsNumber: (operator.eq, "=="),
+    SignalAtTimestampLessThanNumber: (operator.lt, "<"),
+    SignalAtTimestampGreaterThanNumber: (operator.gt, ">"),
+    ValueInConcreteStateEqualToConstant: (operator.eq, "=="),
+    ValueInConcreteStateLessThanConstant: (operator.lt, "<"),
+    ValueInConcreteStateGreaterThanConstant: (operator.gt, ">"),
+    ValueInConcreteStateNotEqualToConstant: (operator.ne, "!="),
+    ValueInConcreteStateLessThanEqualToConstant: (operator.le, "<="),
+    ValueInConcreteStateGreaterThanEqualToConstant: (operator.ge, ">="),
+    DurationOfTransitionLessThanNumber: (operator.lt, "<"),
+    TimeBetweenLessThanConstant: (operator.lt, "<"),
+}
+
+def compile_atom_evaluator(atom):
+    """
+    Compile `atom` into a function that, given the children of a node holding the atom, evaluates them and returns
+    the truth value of the atom (or None if the values of the children are not yet known).
+
+    The comparison and the constant of the atom are looked up once, here, rather than every time a node is
+    evaluated.  Atoms whose nodes are never evaluated (Boolean constants, whose nodes are given their values when
+    they are constructed) are compiled to None.
+    """
+    if type(atom) is TimeBetweenLessThanConstant:
+        comparison, _ = ATOM_COMPARISONS[type(atom)]
+        constant = atom.get_constant()
+
+        def evaluate_time_between(children):
+            lhs_child, rhs_child = children[0], children[1]
+            lhs_child.evaluate()
+            rhs_child.evaluate()
+            lhs_child_value = lhs_child._value
+            rhs_child_value = rhs_child._value
+            if lhs_child_value is None or rhs_child_value is None:
+                return None
+            return comparison(rhs_child_value - lhs_child_value, constant)
+
+        return evaluate_time_between
+    elif type(atom) in ATOM_COMPARISONS:
+        comparison, operator_symbol = ATOM_COMPARISONS[type(atom)]
+        constant = atom.get_constant()
+
+        def evaluate_comparison(children):
+            child = children[0]
+            child.evaluate()
+            child_value = child._value
+            # the child value will be None if the quantity it refers to has not been observed yet
+            # (for example, if no signal entry has reached the timestamp that is needed)
+            if child_value is None:
+                return None
+            try:
+                return bool(comparison(child_value, constant))
+            except TypeError:
+                raise IncompatibleTypeError(
+                    f"The value recorded at runtime ({child_value}, type {type(child_value).__name__}) "
+                    f"could not be compared under {operator_symbol} with the value from the specification "
+                    f"({constant}, type {type(constant).__name__})"
+                )
+
+        return evaluate_comparison
+    return None
 
 class MonitorTreeAtomNode(MonitorTreeNode):
     """
     Class representing a node in a tree that holds an atom.
     """
 
+    __slots__ = ('_atom_index', '_evaluator')
+
     def __init__(self, subformula, binding, monitor, atom_index):
         # superclass call
         super().__init__(subformula, binding, monitor)
         # store additional variables
         self._atom_index = atom_index
+        # the function that derives the truth value of the atom from the values of the children of this node
+        self._evaluator = monitor._atom_evaluators[atom_index]
         # update the monitor's atom -> subatom -> nodes map
         if atom_index not in self._monitor._atom_subatom_nodes:
             self._monitor._atom_subatom_nodes[atom_index] = {}
         # if we have a boolean constant, set the node to have a constant value
         if type(subformula) is BooleanConstant:
             self.set_value(subformula.get_value())
+        # when diagnosing online, keep the function events for this atom until its value is known
+        if atom_index in self._monitor._function_call_histories:
+            self._monitor._function_call_histories[atom_index].watch(self)
 
     def evaluate(self):
-        # depending on the type of atom, get the value of the child (representing the value of an expression)
-        if not self.get_value():
-            if type(self._subformula) is SignalAtTimestampEqualsNumber:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get child value
-                child_value = self.get_children()[0].get_value()
-                self.set_value(bool(child_value == self._subformula.get_constant()))
-            if type(self._subformula) is SignalAtTimestampLessThanNumber:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get child value
-                child_value = self.get_children()[0].get_value()
-                # check for the existence of a child value
-                # if we're performing evaluation of the tree based on observation
-                # of a signal entry that is not yet >= the timestamp that is needed
-                # the child value will be None
-                if child_value is not None:
-                    try:
-                        self.set_value(bool(child_value < self._subformula.get_constant()))
-                    except TypeError as e:
-                        raise IncompatibleTypeError(
-                            f"The value recorded at runtime ({child_value}, type {type(child_value).__name__}) "
-                            f"could not be compared under < with the value from the specification "
-                            f"({self._subformula.get_constant()}, "
-                            f"type {type(self._subformula.get_constant()).__name__})"
-                        )
-            if type(self._subformula) is SignalAtTimestampGreaterThanNumber:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get child value
-                child_value = self.get_children()[0].get_value()
-                # check for the existence of a child value
-                # if we're performing evaluation of the tree based on observation
-                # of a signal entry that is not yet >= the timestamp that is needed
-                # the child value will be None
-                if child_value is not None:
-                    try:
-                        self.set_value(bool(child_value > self._subformula.get_constant()))
-                    except TypeError as e:
-                        raise IncompatibleTypeError(
-                            f"The value recorded at runtime ({child_value}, type {type(child_value).__name__}) "
-                            f"could not be compared under > with the value from the specification "
-                            f"({self._subformula.get_constant()}, "
-                            f"type {type(self._subformula.get_constant()).__name__})"
-                        )
-            elif type(self._subformula) is ValueInConcreteStateEqualToConstant:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get child value
-                child_value = self.get_children()[0].get_value()
-                self.set_value(child_value == self._subformula.get_constant())
-            elif type(self._subformula) is ValueInConcreteStateLessThanConstant:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get child value
-                child_value = self.get_children()[0].get_value()
-                try:
-                    self.set_value(child_value < self._subformula.get_constant())
-                except TypeError as e:
-                    raise IncompatibleTypeError(
-                        f"The value recorded at runtime ({child_value}, type {type(child_value).__name__}) "
-                        f"could not be compared under < with the value from the specification "
-                        f"({self._subformula.get_constant()}, "
-                        f"type {type(self._subformula.get_constant()).__name__})"
-                    )
-            elif type(self._subformula) is ValueInConcreteStateGreaterThanConstant:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get child value
-                child_value = self.get_children()[0].get_value()
-                try:
-                    self.set_value(child_value > self._subformula.get_constant())
-                except TypeError as e:
-                    raise IncompatibleTypeError(
-                        f"The value recorded at runtime ({child_value}, type {type(child_value).__name__}) "
-                        f"could not be compared under > with the value from the specification "
-                        f"({self._subformula.get_constant()}, "
-                        f"type {type(self._subformula.get_constant()).__name__})"
-                    )
-            elif type(self._subformula) is ValueInConcreteStateNotEqualToConstant:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get child value
-                child_value = self.get_children()[0].get_value()
-                self.set_value(child_value != self._subformula.get_constant())
-            elif type(self._subformula) is ValueInConcreteStateLessThanEqualToConstant:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get child value
-                child_value = self.get_children()[0].get_value()
-                try:
-                    self.set_value(child_value <= self._subformula.get_constant())
-                except TypeError as e:
-                    raise IncompatibleTypeError(
-                        f"The value recorded at runtime ({child_value}, type {type(child_value).__name__}) "
-                        f"could not be compared under <= with the value from the specification "
-                        f"({self._subformula.get_constant()}, "
-                        f"type {type(self._subformula.get_constant()).__name__})"
-                    )
-            elif type(self._subformula) is ValueInConcreteStateGreaterThanEqualToConstant:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get child value
-                child_value = self.get_children()[0].get_value()
-                try:
-                    self.set_value(child_value >= self._subformula.get_constant())
-                except TypeError as e:
-                    raise IncompatibleTypeError(
-                        f"The value recorded at runtime ({child_value}, type {type(child_value).__name__}) "
-                        f"could not be compared under >= with the value from the specification "
-                        f"({self._subformula.get_constant()}, "
-                        f"type {type(self._subformula.get_constant()).__name__})"
-                    )
-            elif type(self._subformula) is TimeBetweenLessThanConstant:
-                # evaluate children
-                self.get_children()[0].evaluate()
-                self.get_children()[1].evaluate()
-                # get values
-                lhs_child_value = self.get_children()[0].get_value()
-                rhs_child_value = self.get_children()[1].get_value()
-                # compare
-                if rhs_child_value is not None and lhs_child_value is not None:
-                    self.set_value(rhs_child_value - lhs_child_value < self._subformula.get_constant())
-            elif type(self._subformula) is DurationOfTransitionLessThanNumber:
-                # evaluate child
-                self.get_children()[0].evaluate()
-                # get values
-                child_value = self.get_children()[0].get_value()
-                # check constraint, if there is a child value
-                if child_value is not None:
-                    self.set_value(child_value < self._subformula.get_constant())
-            elif type(self._subformula) is BooleanConstant:
-                # no need to set value - there's already a value
-                pass
+        # derive the truth value of the atom from the values of the children (representing the values of expressions)
+        if not self._value and self._evaluator is not None:
+            value = self._evaluator(self._children)
+            if value is not None:
+                decided = self._value is None
+                self.set_value(value)
+                if decided and self._atom_index in self._monitor._function_call_histories:
+                    self._monitor._diagnose_atom(self)
 
 class MonitorTreeExpressionNode(MonitorTreeNode):
     """
     Class representing a node in a tree that holds an expression found in an atom.
     """
 
+    __slots__ = ('_atom_index', '_subatom_index', '_line_number', '_module_name')
+
     def __init__(self, expression, binding, monitor, atom_index, subatom_index, is_leaf=False):
         # superclass call
         super().__init__(expression, binding, monitor)
@@ -468,17 +552,12 @@ class MonitorTreeExpressionNode(MonitorTreeNode):
         # if we have a leaf, update the monitor's atom -> subatom -> nodes map
         if is_leaf:
             if subatom_index not in self._monitor._atom_subatom_nodes[atom_index]:
-                self._monitor._atom_subatom_nodes[atom_index][subatom_index] = [self]
+                self._monitor._atom_subatom_nodes[atom_index][subatom_index] = {self: None}
             else:
-                self._monitor._atom_subatom_nodes[atom_index][subatom_index].append(self)
-        # if we have a signal.at(t) expression, add to the relevant map
+                self._monitor._atom_subatom_nodes[atom_index][subatom_index][self] = None
+        # if we have a signal.at(t) expression, wait for a sample of its signal
         if type(expression) is SignalAtTimestamp:
-            # add signal to map from signal names to expression nodes
-            signal_name = expression.get_signal_name()
-            if signal_name not in self._monitor._signals_to_expression_nodes:
-                self._monitor._signals_to_expression_nodes[signal_name] = [self]
-            else:
-                self._monitor._signals_to_expression_nodes[expression.get_signal_name()].append(self)
+            self._monitor._signal_histories[expression.get_signal_name()].add_expression_node(self)
 
     def set_measurement_location(self, module_name, line_number):
         self._module_name = module_name
@@ -487,71 +566,69 @@ class MonitorTreeExpressionNode(MonitorTreeNode):
     def get_measurement_location(self):
         return self._module_name, self._line_number
 
+    def get_signal_timestamp(self):
+        """
+        Get the timestamp given by the child of this signal.at(t) expression node, or None if it is not yet known.
+        """
+        # get the child node
+        child_node = self.get_children()[0]
+        # evaluate the child node
+        child_node.evaluate()
+        return child_node.get_value()
+
     def evaluate(self, measurement=None, module_name=None, line_number=None):
         """
         Depending on the type of expression held, if the child node has been replaced by a value,
         evaluate this expression and replace the expression with the new value.
         """
-        if self.get_value() is not None:
+        if self._value is not None:
             # if a value is already set, no need to evaluate further down the tree
             return
-        if type(self._subformula) is SignalAtTimestamp:
-            # get the child node
-            child_node = self.get_children()[0]
-            # evaluate the child node
-            child_node.evaluate()
-            # check the child node for a value
-            child_value = child_node.get_value()
-            if child_value:
-                # set the value of this expression node to be the value
-                # of the signal at the timestamp set by the child
-                event_dictionary =\
-                    self._monitor.get_signal_at_time(self.get_subformula().get_signal_name(), child_value)
-                if event_dictionary:
-                    self.set_value(event_dictionary["value"])
-                else:
-                    pass
-        elif type(self._subformula) is TimestampExpressionWithAddition:
-            # get the child node
-            child_node = self.get_children()[0]
-            # evaluate the child node
-            child_node.evaluate()
-            # check the child node for a value
-            child_value = child_node.get_value()
-            if child_value:
-                # derive the arithmetic sequence and apply it
-                arithmetic_sequence = self.get_subformula().derive_arithmetic_sequence()
-                final_value = child_value
-                for f in arithmetic_sequence:
-                    final_value = f(final_value)
-                self.set_value(final_value)
-        elif type(self._subformula) is TimestampVariable:
-            variable_name = self._subformula.get_name()
-            if variable_name in self._binding:
-                # set the value
-                self.set_value(self._binding[variable_name])
-                # remove this node from the map used during monitoring
-                # self._monitor._atom_subatom_nodes[self._atom_index][self._subatom_index].remove(self)
-        elif type(self._subformula) in [ValueInConcreteState,
-                                        TimeOfConcreteState,
-                                        TimeOfTransition,
-                                        DurationOfTransition]:
-            # if no value exists, assign the measurement given as the new value
-            if self.get_value() is None:
-                self.set_value(measurement)
-                self.set_measurement_location(module_name, line_number)
-                # remove this node from the map used during monitoring
-                # self._monitor._atom_subatom_nodes[self._atom_index][self._subatom_index].remove(self)
-        elif type(self._subformula) is MeasurementVariable:
-            # if no value exists, assign the measurement given as the new value
-            if not self.get_value():
-                # the value to assign is the value held by the binding
-                # under the variable with id the same as that held by MeasurementVariable
-                quantifier_id = self._subformula.get_name()
-                measurement_from_binding = self._binding[quantifier_id]
-                self.set_value(measurement_from_binding)
-                # remove this node from the map used during monitoring
-                # self._monitor._atom_subatom_nodes[self._atom_index][self._subatom_index].remove(self)
+        evaluator = MonitorTreeExpressionNode.EVALUATORS.get(type(self._subformula))
+        if evaluator is not None:
+            evaluator(self, measurement, module_name, line_number)
+
+    def _evaluate_signal_at_timestamp(self, measurement, module_name, line_number):
+        child_value = self.get_signal_timestamp()
+        if child_value is not None:
+            # set the value of this expression node to be the value
+            # of the signal at the timestamp set by the child
+            event_dictionary = self._monitor.get_signal_at_time(self._subformula.get_signal_name(), child_value)
+            if event_dictionary:
+                self.set_value(event_dictionary["value"])
+
+    def _evaluate_timestamp_with_addition(self, measurement, module_name, line_number):
+        # get the child node, which holds the expression to which the number is added
+        child_node = self._children[0]
+        # evaluate the child node
+        child_node.evaluate()
+        # check the child node for a value
+        child_value = child_node._value
+        if child_value is not None:
+            # the child's value already includes any numbers added further down the expression
+            self.set_value(child_value + self._subformula.get_number())
+
+    def _evaluate_timestamp_variable(self, measurement, module_name, line_number):
+        variable_name = self._subformula.get_name()
+        if variable_name in self._binding:
+            # set the value
+            self.set_value(self._binding[variable_name])
+
+    def _evaluate_measurement(self, measurement, module_name, line_number):
+        # assign the measurement given as the new value
+        self.set_value(measurement)
+        self.set_measurement_location(module_name, line_number)
+
+    # map from the types of expressions to the methods that evaluate them
+    EVALUATORS = {
+        SignalAtTimestamp: _evaluate_signal_at_timestamp,
+        TimestampExpressionWithAddition: _evaluate_timestamp_with_addition,
+        TimestampVariable: _evaluate_timestamp_variable,
+        ValueInConcreteState: _evaluate_measurement,
+        TimeOfConcreteState: _evaluate_measurement,
+        TimeOfTransition: _evaluate_measurement,
+        DurationOfTransition: _evaluate_measurement,
+    }
 
 
 class MonitorTreeVariableNode(MonitorTreeNode):
@@ -559,6 +636,8 @@ class MonitorTreeVariableNode(MonitorTreeNode):
     Class representing a node in a tree that holds a variable found in an atom.
     """
 
+    __slots__ = ()
+
     def evaluate(self):
         """
         Check whether the variable represented by this instance is given a value by `binding`.
@@ -567,31 +646,127 @@ class MonitorTreeVariableNode(MonitorTreeNode):
         variable_name = self._subformula.get_name()
         if variable_name in self._binding:
             # set the value
+            if self._value is None:
+                self._monitor._number_of_open_nodes -= 1
             self._value = self._binding[variable_name]
+            if self._value is None:
+                self._monitor._number_of_open_nodes += 1
+
+class MonitorTreeLazyBranchNode(MonitorTreeNode):
+    """
+    Class representing a branch of a quantifier node whose subtree has not yet been constructed.
 
-class MonitorTreeQuantifierNode(MonitorTreeNode):
+    The node holds the instantiated subformula and the binding of the branch.  The subtree is only constructed (by
+    `materialise`, which puts the root of the subtree in place of this node) once an event concerns it, so a branch
+    that no event concerns before the end of the trace costs a single node.
+    """
+
+    __slots__ = ()
+
+    def evaluate(self):
+        # nothing has been observed for this branch, so there is nothing to evaluate
+        pass
+
+    def get_dependencies(self):
+        return self._monitor.get_branch_dependencies(self._parent.quantifier_id)
+
+    def materialise(self):
+        """
+        Construct the subtree for this branch and put its root in place of this node.  Returns the root.
+        """
+        parent = self._parent
+        # forget this node
+        del self._monitor._all_nodes[self]
+        if self._value is None:
+            self._monitor._number_of_open_nodes -= 1
+        del self._monitor._lazy_branches[parent.quantifier_id][self]
+        del self._monitor._binding_nodes[self]
+        # construct the subtree (which is added as the newest child of the parent), then move it into place
+        parent.expand_subtree(self._subformula, parent, self._binding)
+        children = parent.get_children()
+        branch_root = children.pop()
+        # lazy branches are usually among the newest children, so search from the end
+        index = len(children) - 1
+        while children[index] is not self:
+            index -= 1
+        children[index] = branch_root
+        self._parent = None
+        return branch_root
+
+    def _extract_measurements_from_subtree(self, compiled_specification, up_to_id, atom_subatom_measurement_map):
+        """
+        No measurement has been given to this branch, but the subtree would still report the (missing) measurements
+        of atoms that depend on variables of enclosing quantifiers, so construct it if there are any.
+        """
+        if self.get_dependencies().has_outer_measurements:
+            return (self.materialise(),)
+        return ()
+
+    def _update_newest_branch(self, compiled_specification, measurements):
+        """
+        Construct the subtree if any of the measurements are for its atoms, then update it.
+        """
+        atom_indices = self.get_dependencies().atom_indices
+        if any(atom_index in atom_indices for atom_index in measurements):
+            return (self.materialise(),)
+        return ()
+
+class MonitorTreeQuantifierNode(MonitorTreeCountingNode):
     """
     Class representing a node in a monitoring tree that holds a quantifier.
     """
 
+    __slots__ = ('quantifier_id',)
+
     def __init__(self, quantifier, binding, monitor):
         # superclass call
         super().__init__(quantifier, binding, monitor)
         # update map from quantifier ids to nodes
         self.quantifier_id = quantifier.get_id()
         if self.quantifier_id in self._monitor.quantifier_id_to_nodes:
-            self._monitor.quantifier_id_to_nodes[self.quantifier_id].append(self)
+            self._monitor.quantifier_id_to_nodes[self.quantifier_id][self] = None
         else:
-            self._monitor.quantifier_id_to_nodes[self.quantifier_id] = [self]
-        # if the quantifier is over timestamps, add to the monitor's list
+            self._monitor.quantifier_id_to_nodes[self.quantifier_id] = {self: None}
+        # if the quantifier is over timestamps, add to the monitor's index of windows
         if type(quantifier.get_predicate()) is inTimeInterval:
-            self._monitor._nodes_with_timestamp_quantifiers.append(self)
+            self._monitor._timestamp_quantifier_index.add(self)
+
+    def add_child(self, child_node):
+        super().add_child(child_node)
+        # a child that is not itself a quantifier is the root of the subtree for a binding
+        if type(child_node) is not MonitorTreeQuantifierNode:
+            self._monitor._add_binding_node(child_node)
 
     def set_sub_expression_value(self, value, sub_expression_index):
         """
         Set the quantifier's predicate's subexpression at index `sub_expression_index` to `value`.
         """
         self._subformula.set_sub_expression_value(value, sub_expression_index)
+        self._monitor._timestamp_quantifier_index.update_bounds(self)
+
+    def is_false_once_closed(self):
+        """
+        Decide whether this node holds an exists over timestamps whose window has closed without any branch that is
+        not False (so no branch can make it True).
+        """
+        if not self._monitor._timestamp_quantifier_index.is_closed(self):
+            return False
+        children = self.get_children()
+        if len(children) == 1 and self.quantifier_id not in children[0]._binding:
+            # the only branch is provisional, so no timestamp was found in the window
+            return True
+        return self._number_of_false_children == len(children)
+
+    def close_window(self):
+        """
+        Called once the window of the quantifier over timestamps held by this node has closed.  An exists whose
+        branches are all False is then False.
+        """
+        # the bounds of the window are numbers, so quantifier-expression events no longer concern this node
+        self._monitor.quantifier_id_to_nodes[self.quantifier_id].pop(self, None)
+        if self.get_value() is None and self.is_false_once_closed():
+            self.set_value(False)
+            self.evaluate_upwards()
 
     def check_satisfaction(self, event_dict):
         """
@@ -619,13 +794,15 @@ class MonitorTreeQuantifierNode(MonitorTreeNode):
             # check for satisfaction
             return predicate.check_satisfaction(timestamp)
 
-    def add_branch(self, event_dict):
+    def add_branch(self, event_dict, lazy=False):
         """
         This is called in the case that a trigger is observed for a quantifier.
+
+        If `lazy` is True, the subtree for the branch is only constructed once an event concerns it (if the atoms
+        below this quantifier allow it).
         """
         # instantiate subformula
-        argument_dict = construct_cumulative_binding(self._subformula)
-        subformula_instance = self._subformula.get_subformula()(argument_dict)
+        subformula_instance = self._monitor._compiled_specification.instantiate_subformula(self._subformula)
         # if we have an exists, only add a new branch if the quantifier is not true
         # if we have a forall, only add a new branch if the quantifier is not false
 
@@ -633,18 +810,10 @@ class MonitorTreeQuantifierNode(MonitorTreeNode):
         # if (not(type(self.get_subformula()) is exists and self.get_value() is True) and
         #         not(type(self.get_subformula()) is forall and self.get_value() is False)):
         # extend self._binding with the value key from event_dict
-        # first, copy
-        subtree_binding = {}
-        for key in self._binding:
-            subtree_binding[key] = self._binding[key]
-        # update
-        if type(self._subformula.get_predicate()) in [changes, calls]:
-            # for concrete states and transitions, we don't use the value of individual variables
-            # during monitoring - the static counterpart of the value is only used during instrumentation
-            subtree_binding[self._subformula.get_id()] = event_dict["time"]
-        else:
-            # for signals, we actually use the value of the variable
-            subtree_binding[self._subformula.get_id()] = event_dict["time"]
+        # for concrete states and transitions, we don't use the value of individual variables
+        # during monitoring - the static counterpart of the value is only used during instrumentation
+        # (for signals, the timestamp is the value of the variable)
+        subtree_binding = Binding(self._binding, self._subformula.get_id(), event_dict["time"])
         # check for subformula being a Boolean constant
         # if this is the case, we immediately evaluate upwards with the truth value given by the boolean constant
         # if the new node doesn't contain a boolean constant, we recurse
@@ -658,9 +827,25 @@ class MonitorTreeQuantifierNode(MonitorTreeNode):
                 # set value to True and evaluate upwards
                 self.set_value(True)
                 self.evaluate_upwards()
+        elif lazy and self._monitor.get_branch_dependencies(self.quantifier_id).is_lazy:
+            # add a placeholder, whose subtree is constructed once an event concerns it
+            self.add_lazy_branch(subformula_instance, subtree_binding)
         else:
             # add subtree with new binding
             self.expand_subtree(subformula_instance, self, subtree_binding)
+        if (type(subformula_instance) is not BooleanConstant and
+                self._monitor.get_tree_evaluation_strategy() == "down"):
+            # when the tree is evaluated downwards, evaluate this quantifier again (with its new branch)
+            # once the event has been processed
+            self._monitor._dirty_nodes[self.get_children()[-1]] = None
+
+    def add_lazy_branch(self, subformula, binding):
+        """
+        Add a MonitorTreeLazyBranchNode for `subformula` with `binding` as a child of this node.
+        """
+        lazy_branch = MonitorTreeLazyBranchNode(subformula, binding, self._monitor)
+        self.add_child(lazy_branch)
+        self._monitor._lazy_branches[self.quantifier_id][lazy_branch] = None
 
     def expand_subtree(self, subformula, parent_node, binding, atom_index=None, subatom_index=None):
         """
@@ -675,14 +860,14 @@ class MonitorTreeQuantifierNode(MonitorTreeNode):
             parent_node.add_child(new_node)
             # expand the subformula with a partial binding (nothing has actually been observed
             # for this quantifier yet)
-            argument_dict = construct_cumulative_binding(subformula)
-            subformula_instance = subformula.get_subformula()(argument_dict)
-            # copy the binding
-            subtree_binding = {}
-            for key in binding:
-                subtree_binding[key] = binding[key]
-            # expand the subtree, rooted at the quantifier
-            self.expand_subtree(subformula_instance, new_node, subtree_binding)
+            subformula_instance = self._monitor._compiled_specification.instantiate_subformula(subformula)
+            # extend the binding with a provisional entry for this quantifier
+            subtree_binding = Binding(binding, subformula.get_id())
+            # expand the subtree, rooted at the quantifier (once an event concerns it, if possible)
+            if self._monitor.get_branch_dependencies(subformula.get_id()).is_lazy:
+                new_node.add_lazy_branch(subformula_instance, subtree_binding)
+            else:
+                self.expand_subtree(subformula_instance, new_node, subtree_binding)
         elif type(subformula) is conjunction:
             # instantiate a new node
             new_node = MonitorTreeConjunctionNode(subformula, binding, self._monitor)
@@ -708,8 +893,7 @@ class MonitorTreeQuantifierNode(MonitorTreeNode):
             self.expand_subtree(subformula.get_subformula(), new_node, binding)
         elif is_normal_atom(subformula) or is_mixed_atom(subformula):
             # get atom index
-            atoms = self._monitor._monitoring_tree._subformula.get_atoms()
-            atom_index = atoms.index(subformula)
+            atom_index = self._monitor._compiled_specification.get_atom_index(subformula)
             # instantiate a new node
             new_node = MonitorTreeAtomNode(subformula, binding, self._monitor, atom_index)
             # add atom to monitor map
@@ -797,84 +981,736 @@ class MonitorTreeQuantifierNode(MonitorTreeNode):
 
     def evaluate(self):
         """
-        Recurse down the structure of the tree from this node, substituting measurements and deriving
-        truth values where possible.
+        Derive the truth value of this node from the counts of the truth values of its branches.
         """
+        value = self.get_value()
         if type(self.get_subformula()) is forall:
-            final_value = self.get_value() if self.get_value() else True
-            for child in self.get_children():
-                if not child.get_value():
-                    child.evaluate()
-                    final_value = final_value and child.get_value()
-            self.set_value(final_value)
+            # a forall that is False stays False (its False children may have been retired)
+            if value is False or self._number_of_false_children > 0:
+                self.set_value(False)
+            elif (self._number_of_true_children == len(self.get_children()) and
+                  (value is True or self._monitor.get_tree_evaluation_strategy() == "down")):
+                # (when the tree is evaluated downwards, a forall whose branches are all True so far is True)
+                self.set_value(True)
+            else:
+                self.set_value(None)
         elif type(self.get_subformula()) is exists:
-            if self.get_value() is not True:
-                final_value = False
-                for child in self.get_children():
-                    child.evaluate()
-                    final_value = final_value or child.get_value()
-                self.set_value(final_value)
-                # exists is not allowed to be False until the end of the trace,
-                # so check and revert to None if this is the case
-                if self.get_value() is False:
-                    self.set_value(None)
-                # if the exists is true now, remove it from self._monitor._nodes_with_timestamp_quantifiers
-                # (if it's in there)
-                if self in self._monitor._nodes_with_timestamp_quantifiers and self.get_value() is True:
-                    self._monitor._nodes_with_timestamp_quantifiers.remove(self)
-                # if true, remove the quantifier from the list of quantifiers
-                # to which branches can be added
-                if self.get_value() is True:
-                    if self in self._monitor.quantifier_id_to_nodes[self.quantifier_id]:
-                        self._monitor.quantifier_id_to_nodes[self.quantifier_id].remove(self)
-        elif type(self.get_subformula()) is using:
-            if self.get_value() is None:
-                self.set_value(self.get_children()[0].get_value())
-                if self in self._monitor.quantifier_id_to_nodes[self.quantifier_id]:
-                    self._monitor.quantifier_id_to_nodes[self.quantifier_id].remove(self)
+            if value is not True:
+                if self._number_of_true_children > 0:
+                    self.set_value(True)
+                    # if the exists is true now, no more branches need to be added for its window
+                    self._monitor._timestamp_quantifier_index.remove(self)
+                    # remove the quantifier from the list of quantifiers to which branches can be added
+                    self._monitor.quantifier_id_to_nodes[self.quantifier_id].pop(self, None)
+                else:
+                    # exists is not allowed to be False until the end of the trace (or the end of its window)
+                    # (once its window has closed, a provisional branch that is still None cannot make it True)
+                    self.set_value(False if self.is_false_once_closed() else None)
+
+class BranchDependencies():
+    """
+    Class holding what the events that concern a branch of a quantifier (with id `quantifier_id`) depend on: the
+    indices of the atoms and the names of the signals found below the quantifier.
+
+    Branches are only constructed lazily (`is_lazy`) if there is no quantifier below the quantifier (so constructing
+    a subtree never adds branches) and every atom below the quantifier is given its value by an event for that atom
+    (or for its signal), since other atoms can be evaluated as soon as the branch is added.
+    """
+
+    __slots__ = ('quantifier_id', 'atom_indices', 'signal_names', 'has_outer_measurements', 'is_lazy')
+
+    def __init__(self, quantifier_id):
+        self.quantifier_id = quantifier_id
+        self.atom_indices = set()
+        self.signal_names = set()
+        # whether any atom takes a measurement from a variable of an enclosing quantifier
+        self.has_outer_measurements = False
+        self.is_lazy = True
+
+    def concerns(self, atom_index=None, signal_name=None):
+        """
+        Decide whether an event for `atom_index` or `signal_name` concerns the branches.
+        """
+        if atom_index is not None:
+            return atom_index in self.atom_indices
+        return signal_name in self.signal_names
+
+class TimestampQuantifierIndex():
+    """
+    Class holding the quantifier nodes whose quantifiers range over the timestamps in an interval (their windows),
+    indexed by the bounds of their windows.
+
+    Signals are assumed to be observed in the order of their timestamps, so each window is first waiting (the
+    timestamps of signals have not reached its lower bound), then open, then closed (the timestamps of signals have
+    passed its upper bound).  Waiting windows are kept in a heap ordered by their lower bounds and open windows in a
+    heap ordered by their upper bounds, so a signal only touches the windows that contain its timestamp (or that open
+    or close at it).  Windows whose bounds are still expressions (to be given by quantifier-expression events) are
+    kept aside until their bounds are numbers.
+    """
+
+    def __init__(self):
+        # map from each node in the index to the order in which it was added
+        self._node_to_number = {}
+        self._number_of_nodes_added = 0
+        # nodes whose windows do not yet have numerical bounds
+        self._unbounded_nodes = {}
+        # heaps of (bound, number, node) triples for waiting and open windows
+        # (entries for nodes that have left the index are skipped once they reach the top)
+        self._waiting_windows = []
+        self._open_windows = []
+        # map from the nodes with open windows to the order in which they were added
+        self._open_nodes = {}
+        # nodes holding an exists whose window has closed
+        self._closed_exists_nodes = set()
+
+    def add(self, node):
+        self._node_to_number[node] = self._number_of_nodes_added
+        self._number_of_nodes_added += 1
+        self._unbounded_nodes[node] = None
+        self.update_bounds(node)
+
+    def update_bounds(self, node):
+        """
+        Start waiting for the window of `node` to open, if its bounds are now numbers.
+        """
+        if node in self._unbounded_nodes:
+            predicate = node.get_subformula().get_predicate()
+            lower_bound = predicate.get_left_expression()
+            if type(lower_bound) in [int, float] and type(predicate.get_right_expression()) in [int, float]:
+                del self._unbounded_nodes[node]
+                heapq.heappush(self._waiting_windows, (lower_bound, self._node_to_number[node], node))
+
+    def remove(self, node):
+        if node in self._node_to_number:
+            del self._node_to_number[node]
+            self._unbounded_nodes.pop(node, None)
+            self._open_nodes.pop(node, None)
+        self._closed_exists_nodes.discard(node)
+
+    def is_closed(self, node):
+        """
+        Decide whether `node` holds an exists whose window has closed.
+        """
+        return node in self._closed_exists_nodes
+
+    def get_number_of_open_windows(self):
+        return len(self._open_nodes)
+
+    def advance(self, timestamp):
+        """
+        Open and close windows given that a signal has been observed at `timestamp`.
+
+        Returns the nodes whose windows contain `timestamp` and the nodes whose windows have just closed (each in the
+        order in which the nodes were added).  Closed windows leave the index.
+        """
+        # open the windows whose lower bounds have been reached
+        not_yet_open = []
+        while self._waiting_windows and self._waiting_windows[0][0] <= timestamp:
+            entry = heapq.heappop(self._waiting_windows)
+            lower_bound, number, node = entry
+            if self._node_to_number.get(node) != number:
+                continue
+            predicate = node.get_subformula().get_predicate()
+            if lower_bound == timestamp and not predicate.includes_bounds():
+                not_yet_open.append(entry)
+                continue
+            self._open_nodes[node] = number
+            heapq.heappush(self._open_windows, (predicate.get_right_expression(), number, node))
+        for entry in not_yet_open:
+            heapq.heappush(self._waiting_windows, entry)
+        # close the windows whose upper bounds have been passed
+        not_yet_closed = []
+        closed_nodes = []
+        while self._open_windows and self._open_windows[0][0] <= timestamp:
+            entry = heapq.heappop(self._open_windows)
+            upper_bound, number, node = entry
+            if self._node_to_number.get(node) != number:
+                continue
+            if upper_bound == timestamp and node.get_subformula().get_predicate().includes_bounds():
+                not_yet_closed.append(entry)
+                continue
+            del self._open_nodes[node]
+            del self._node_to_number[node]
+            if type(node.get_subformula()) is exists:
+                self._closed_exists_nodes.add(node)
+            closed_nodes.append((number, node))
+        for entry in not_yet_closed:
+            heapq.heappush(self._open_windows, entry)
+        closed_nodes.sort(key=lambda number_and_node: number_and_node[0])
+        open_nodes = sorted(self._open_nodes, key=self._open_nodes.__getitem__)
+        return open_nodes, [node for _, node in closed_nodes]
+
+
+class SignalHistory():
+    """
+    Class holding the recent samples of a signal (ordered by time), along with the signal.at(t) expression nodes
+    waiting for a sample at or after their timestamps.
+
+    A sample is kept until it is more than `horizon` older than the most recent sample, after which no expression
+    can refer to it (if `horizon` is None, every sample is kept).  Samples are held in lists from an offset, so they
+    can be searched with bisect, and the lists are compacted once half of their contents have been evicted.
+
+    Expression nodes whose timestamps are not yet known (because they are in provisional branches) are checked on
+    each sample.  Once the timestamp of a node is known, the node is kept in a heap ordered by timestamp, so it is
+    only looked at again once a sample reaches its timestamp.
+    """
+
+    def __init__(self, horizon=None):
+        self._horizon = horizon
+        self._times = []
+        self._events = []
+        self._start = 0
+        # map from each waiting expression node to the order in which it was added
+        self._node_to_number = {}
+        self._number_of_nodes_added = 0
+        # nodes whose timestamps are not yet known
+        self._unscheduled_nodes = {}
+        # heap of (timestamp, number, node) triples
+        # (entries for nodes that have stopped waiting are skipped once they reach the top)
+        self._scheduled_nodes = []
+
+    def __len__(self):
+        return len(self._times) - self._start
+
+    def add(self, event):
+        """
+        Add the sample held by the signal event `event`, evicting the samples that have passed the horizon.
+        """
+        time = event["time"]
+        if len(self) > 0 and time < self._times[-1]:
+            # keep the samples ordered by time if this one has arrived late
+            index = bisect.bisect_right(self._times, time, self._start)
+            self._times.insert(index, time)
+            self._events.insert(index, event)
+        else:
+            self._times.append(time)
+            self._events.append(event)
+        if self._horizon is not None:
+            self._start = bisect.bisect_left(self._times, self._times[-1] - self._horizon, self._start)
+            if self._start > len(self._times) // 2:
+                del self._times[:self._start]
+                del self._events[:self._start]
+                self._start = 0
+
+    def get_latest_time(self):
+        if len(self) > 0:
+            return self._times[-1]
+
+    def get_sample_at(self, timestamp):
+        """
+        Get the event giving the value of the signal at `timestamp`: the most recent sample at `timestamp` if there is
+        one, and otherwise the earliest sample after it (or None, if no sample has reached `timestamp`).
+        """
+        index = bisect.bisect_right(self._times, timestamp, self._start)
+        if index > self._start and self._times[index - 1] == timestamp:
+            return self._events[index - 1]
+        elif index < len(self._times):
+            return self._events[index]
+
+    def add_expression_node(self, node):
+        self._node_to_number[node] = self._number_of_nodes_added
+        self._number_of_nodes_added += 1
+        self._unscheduled_nodes[node] = None
+
+    def remove_expression_node(self, node):
+        if node in self._node_to_number:
+            del self._node_to_number[node]
+            self._unscheduled_nodes.pop(node, None)
+
+    def take_resolvable_expression_nodes(self):
+        """
+        Get the waiting expression nodes whose timestamps have been reached by a sample (in the order in which the
+        nodes were added).  These nodes stop waiting.
+        """
+        for node in list(self._unscheduled_nodes):
+            timestamp = node.get_signal_timestamp()
+            if timestamp is not None:
+                del self._unscheduled_nodes[node]
+                heapq.heappush(self._scheduled_nodes, (timestamp, self._node_to_number[node], node))
+        resolvable_nodes = []
+        latest_time = self.get_latest_time()
+        while self._scheduled_nodes and self._scheduled_nodes[0][0] <= latest_time:
+            _, number, node = heapq.heappop(self._scheduled_nodes)
+            if self._node_to_number.get(node) != number:
+                continue
+            del self._node_to_number[node]
+            resolvable_nodes.append((number, node))
+        resolvable_nodes.sort(key=lambda number_and_node: number_and_node[0])
+        return [node for _, node in resolvable_nodes]
+
+
+class FunctionCallHistory():
+    """
+    Class holding the function events for an atom (ordered by time), so that the calls made during the window of a
+    false atom can be found by binary search.
+
+    Atom nodes whose values are not yet known can be watched, in which case the events from before the earliest of
+    them started to be watched are evicted (the window of an atom is assumed not to start before its node is
+    constructed).  If no nodes are watched, every event is kept.  As in SignalHistory, events are held in lists from
+    an offset, and the lists are compacted once half of their contents have been evicted.
+    """
+
+    def __init__(self):
+        self._times = []
+        self._events = []
+        self._start = 0
+        # the time of the most recent event added (even if it has been evicted)
+        self._latest_time = None
+        # map from each watched node to the time of the most recent event when it started to be watched,
+        # and (time, node) pairs in the order in which the nodes started to be watched
+        # (pairs for nodes that are no longer watched are skipped once they reach the front)
+        self._watched_nodes = {}
+        self._watch_queue = collections.deque()
+
+    def __len__(self):
+        return len(self._times) - self._start
+
+    def add(self, event):
+        time = event["time"]
+        if len(self) > 0 and time < self._times[-1]:
+            # keep the events ordered by time if this one has arrived late
+            index = bisect.bisect_right(self._times, time, self._start)
+            self._times.insert(index, time)
+            self._events.insert(index, event)
+        else:
+            self._times.append(time)
+            self._events.append(event)
+            self._latest_time = time
+
+    def watch(self, node):
+        self._watched_nodes[node] = self._latest_time
+        self._watch_queue.append((self._latest_time, node))
+
+    def unwatch(self, node):
+        """
+        Stop watching `node`, evicting the events that no watched node can need.
+        """
+        self._watched_nodes.pop(node, None)
+        while self._watch_queue and self._watch_queue[0][1] not in self._watched_nodes:
+            self._watch_queue.popleft()
+        earliest_time = self._watch_queue[0][0] if self._watch_queue else self._latest_time
+        if earliest_time is not None:
+            self._start = bisect.bisect_left(self._times, earliest_time, self._start)
+            if self._start > len(self._times) // 2:
+                del self._times[:self._start]
+                del self._events[:self._start]
+                self._start = 0
+
+    def find_calls_in_window(self, start, end, include_end, deadline, include_deadline):
+        """
+        Get the function events whose times are in [start, end] (or [start, end) if `include_end` is False), in order
+        of time, along with the position among them of the point of no return: the first call made at or after
+        `deadline` (or strictly after it, if `include_deadline` is False), or the number of calls if there is none.
+        """
+        lower_index = bisect.bisect_left(self._times, start, self._start)
+        if include_end:
+            upper_index = bisect.bisect_right(self._times, end, lower_index)
+        else:
+            upper_index = bisect.bisect_left(self._times, end, lower_index)
+        if include_deadline:
+            point_of_no_return_index = bisect.bisect_left(self._times, deadline, lower_index, upper_index)
+        else:
+            point_of_no_return_index = bisect.bisect_right(self._times, deadline, lower_index, upper_index)
+        return self._events[lower_index:upper_index], point_of_no_return_index - lower_index
+
+
+class LatencyHistogram():
+    """
+    Class holding a histogram of durations (in seconds) in a fixed number of buckets, whose widths grow with the
+    durations they hold, so that quantiles can be estimated to within a quarter of a power of two without keeping
+    every duration.
+    """
+
+    # each power of two is split into this many buckets
+    SUB_BUCKETS = 4
+    # durations below 2 ** (MIN_EXPONENT - 1) seconds are counted in the first bucket
+    # and durations from 2 ** MAX_EXPONENT seconds upwards in the last
+    MIN_EXPONENT = -30
+    MAX_EXPONENT = 10
+
+    def __init__(self):
+        self._buckets = [0] * ((self.MAX_EXPONENT - self.MIN_EXPONENT + 1) * self.SUB_BUCKETS)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def add(self, duration):
+        self._count += 1
+        self._total += duration
+        if duration > self._max:
+            self._max = duration
+        # duration = mantissa * 2 ** exponent, with 0.5 <= mantissa < 1 (unless the duration is 0)
+        mantissa, exponent = math.frexp(duration)
+        if duration <= 0 or exponent < self.MIN_EXPONENT:
+            index = 0
+        elif exponent > self.MAX_EXPONENT:
+            index = len(self._buckets) - 1
+        else:
+            index = ((exponent - self.MIN_EXPONENT) * self.SUB_BUCKETS +
+                     int((mantissa - 0.5) * 2 * self.SUB_BUCKETS))
+        self._buckets[index] += 1
+
+    def get_count(self):
+        return self._count
+
+    def get_total(self):
+        return self._total
+
+    def get_max(self):
+        return self._max
+
+    def get_quantile(self, quantile):
+        """
+        Estimate the duration below which the fraction `quantile` of the durations fall, as the upper bound of the
+        bucket holding that duration (or the largest duration, if that is smaller).
+        """
+        if self._count == 0:
+            return 0.0
+        rank = quantile * self._count
+        cumulative_count = 0
+        for index, count in enumerate(self._buckets):
+            cumulative_count += count
+            if count and cumulative_count >= rank:
+                exponent, sub_bucket = divmod(index, self.SUB_BUCKETS)
+                upper_bound = math.ldexp(0.5 + (sub_bucket + 1) / (2 * self.SUB_BUCKETS),
+                                         exponent + self.MIN_EXPONENT)
+                return min(upper_bound, self._max)
+        return self._max
+
+    def summarise(self):
+        return {
+            "count": self._count,
+            "total": self._total,
+            "p50": self.get_quantile(0.5),
+            "p99": self.get_quantile(0.99),
+            "max": self._max
+        }
+
+    def merge(self, other):
+        """
+        Add the durations held by the histogram `other` to this histogram.
+        """
+        self._buckets = [count + other_count for count, other_count in zip(self._buckets, other._buckets)]
+        self._count += other._count
+        self._total += other._total
+        self._max = max(self._max, other._max)
+
+    def to_dict(self):
+        """
+        Get a dictionary (that can be written as JSON) from which from_dict reconstructs this histogram.  Only the
+        buckets that are not empty are included.
+        """
+        return {
+            "count": self._count,
+            "total": self._total,
+            "max": self._max,
+            "buckets": {str(index): count for index, count in enumerate(self._buckets) if count}
+        }
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        histogram = cls()
+        histogram._count = dictionary["count"]
+        histogram._total = dictionary["total"]
+        histogram._max = dictionary["max"]
+        for index, count in dictionary["buckets"].items():
+            histogram._buckets[int(index)] = count
+        return histogram
+
+
+class ViolationDiagnosis():
+    """
+    Class holding the diagnosis of a false atom (constraining the time between two points or the duration of a
+    transition): the function calls made during its window, and the point of no return among them, which is the first
+    call made once the time allowed by the atom had been consumed.
+    """
+
+    def __init__(self, atom, binding, calls, point_of_no_return_index, overrun=None):
+        self._atom = atom
+        self._binding = binding
+        self._calls = calls
+        # the number of calls if there is no point of no return
+        self._point_of_no_return_index = point_of_no_return_index
+        # the time by which the window of the atom exceeded the time allowed
+        self._overrun = overrun
+
+    def get_atom(self):
+        return self._atom
+
+    def get_binding(self):
+        return self._binding
+
+    def get_calls(self):
+        return self._calls
+
+    def get_point_of_no_return_index(self):
+        return self._point_of_no_return_index
+
+    def get_overrun(self):
+        return self._overrun
+
+    def get_calls_before_point_of_no_return(self):
+        return self._calls[:self._point_of_no_return_index]
+
+    def get_point_of_no_return(self):
+        if self._point_of_no_return_index < len(self._calls):
+            return self._calls[self._point_of_no_return_index]
+
+    def to_entry(self):
+        """
+        Get the (atom, binding, number of calls, function name, line number, overrun) entry for this diagnosis in the
+        diagnosis file, or None if there is no point of no return.
+        """
+        point_of_no_return = self.get_point_of_no_return()
+        if point_of_no_return is not None:
+            return (str(self._atom), self._binding, len(self._calls),
+                    point_of_no_return.get('function_name'), point_of_no_return.get('line_number'), self._overrun)
+
+
+class BindingSummary():
+    """
+    Class holding what is kept of a binding of the outermost quantifier once its subtree has been retired:
+    its value, the values and measurement locations of its atoms, and its falsifying atoms (if it is False).
+    """
+
+    def __init__(self, binding, value, atom_index_to_records, falsifying_atoms):
+        self._binding = binding
+        self._value = value
+        # map from atom indices to (binding, values, measurement locations, truth value) tuples,
+        # as given by Monitor.get_bindings_and_values_for_atom
+        self._atom_index_to_records = atom_index_to_records
+        self._falsifying_atoms = falsifying_atoms
+
+    def get_binding(self):
+        return self._binding
+
+    def get_value(self):
+        return self._value
+
+    def get_records_for_atom(self, atom_index):
+        return self._atom_index_to_records.get(atom_index, [])
+
+    def get_falsifying_atoms(self):
+        return self._falsifying_atoms
+
 
 class Monitor():
     """
     Class representing a monitor that wraps a tree, recursively constructed using MonitorTreeNode instances.
+
+    If `prune` is True, the subtree for each binding of the outermost quantifier is retired once the value of the
+    binding is final and every atom in the subtree has a value, so that the size of the tree does not grow with the
+    number of triggers.  A BindingSummary
+    is kept for each False binding (for diagnosis) and for up to `max_true_binding_summaries` True bindings.
+
+    The time taken to process every `event_timing_interval`th event is added to a histogram (see stats), and no events
+    are timed if `event_timing_interval` is 0.
+
+    If `online_diagnosis` is True, the function events for atoms constraining the time between two points or the
+    duration of a transition are kept while the values of these atoms are not known, and each such atom is diagnosed
+    (see ViolationDiagnosis) as soon as it is False, so that diagnosis does not need to read the trace again.
     """
 
-    def __init__(self, specification_instance, tree_evaluation_strategy="up"):
+    def __init__(self, specification_instance, tree_evaluation_strategy="up", fail_fast=False, prune=False,
+                 max_true_binding_summaries=0, event_timing_interval=1, online_diagnosis=False):
         # store spec instance
         self._specification = specification_instance
+        # if True, process_events stops consuming events once the verdict can no longer change
+        self._fail_fast = fail_fast
+        # initialise the state used to retire the subtrees of resolved bindings
+        self._prune = prune
+        self._max_true_binding_summaries = max_true_binding_summaries
+        self._number_of_true_binding_summaries = 0
+        self._number_of_retired_bindings = 0
+        self._binding_summaries = []
+        # bindings of the outermost quantifier whose values became final during the current event
+        self._resolved_bindings = []
+        # nodes given values by the current event, whose ancestors are evaluated at the end of the event
+        # when the tree is evaluated downwards
+        self._dirty_nodes = {}
+        # line numbers of the triggers for the bindings held by summaries
+        self._retired_timestamp_to_line_number = {}
+        # store the compiled form of the specification, so that atoms and their indices are not re-derived per event
+        self._compiled_specification = specification_instance.compile()
+        # the functions that derive the truth values of atoms, indexed by atom index
+        self._atom_evaluators = tuple(map(compile_atom_evaluator, self._compiled_specification.get_atoms()))
+        # when diagnosing online, map from the indices of the atoms that can be diagnosed to their function events,
+        # and the diagnoses of the atoms found to be False so far
+        self._online_diagnosis = online_diagnosis
+        self._function_call_histories = {}
+        if online_diagnosis:
+            for atom_index in get_diagnosable_atoms(self._compiled_specification).values():
+                self._function_call_histories[atom_index] = FunctionCallHistory()
+        self._violation_diagnoses = []
         # store the tree evaluation strategy
         self._tree_evaluation_strategy = tree_evaluation_strategy
-        # initialise empty list of all nodes
-        self._all_nodes = []
+        # initialise an empty collection of all nodes (a dictionary, so that nodes keep the order in which they were
+        # added, and nodes in retired subtrees can be removed in constant time)
+        self._all_nodes = {}
+        # the number of nodes in the tree whose values are None (kept up to date as values are set and nodes are
+        # removed, so that it can be reported without scanning the tree)
+        self._number_of_open_nodes = 0
+        # initialise the (insertion-ordered) collection of the roots of the subtrees for bindings (the children of
+        # quantifier nodes that are not quantifier nodes), and of those roots whose values are False
+        self._binding_nodes = {}
+        self._false_binding_nodes = {}
         # initialise a map atom index -> subatom index -> nodes
+        # (the nodes are held in dictionaries, so that they keep the order in which they were added,
+        # and nodes can be removed in constant time)
         self._atom_subatom_nodes = {}
-        # initialise a map from quantifier ids to nodes in the tree
+        # initialise a map from quantifier ids to nodes in the tree (held in the same way)
         self.quantifier_id_to_nodes = {}
         # initialise a map from atom indices to nodes in the tree
         self.atom_index_to_node = {}
-        # initialise a list of quantifiers whose predicates concern timestamps
-        self._nodes_with_timestamp_quantifiers = []
-        # initialise map from signals to expression nodes
-        self._signals_to_expression_nodes = {}
+        # initialise an index of the quantifier nodes whose predicates concern timestamps
+        self._timestamp_quantifier_index = TimestampQuantifierIndex()
+        # initialise a map from quantifier ids to the dependencies of their branches,
+        # and a map from quantifier ids to the (insertion-ordered) branches whose subtrees have not been constructed
+        self._quantifier_id_to_branch_dependencies = {}
+        self._lazy_branches = {}
+        # (the root is not necessarily a forall or an exists, so it is not always one of the compiled quantifiers)
+        for quantifier in [specification_instance] + list(self._compiled_specification.get_quantifiers()):
+            if quantifier.get_id() not in self._lazy_branches:
+                self._quantifier_id_to_branch_dependencies[quantifier.get_id()] = \
+                    self._derive_branch_dependencies(quantifier)
+                self._lazy_branches[quantifier.get_id()] = {}
+        # initialise a map from each signal to its recent samples (and the expression nodes waiting for them)
+        signal_history_horizon = self._derive_signal_history_horizon(
+            [specification_instance] + list(self._compiled_specification.get_quantifiers()))
+        self._signal_histories = {}
+        for signal_name in self._compiled_specification.get_signal_names():
+            self._signal_histories[signal_name] = SignalHistory(signal_history_horizon)
         # initialise the map from signal names to timestamps to event dictionaries
         self.signal_map = {}
         # set the root to be a quantifier node (at the moment, we assume specifications start with a quantifier)
-        self._monitoring_tree = MonitorTreeQuantifierNode(specification_instance, {}, self)
-        # initialise a map from each signal to its most recent value
-        all_signal_names = specification_instance.get_all_signal_names()
-        self._latest_event_map = {}
-        for signal_name in all_signal_names:
-            self._latest_event_map[signal_name] = None
+        self._monitoring_tree = MonitorTreeQuantifierNode(specification_instance, Binding(), self)
         # initialise number of events counter
         self._number_of_events_observed = 0
-        # initialise list of event processing times
-        self._event_processing_times = []
+        # initialise the number of events of each type, and the histogram of the times taken to process the events
+        # that are timed
+        self._event_type_counts = {}
+        self._event_timing_interval = event_timing_interval
+        self._event_processing_times = LatencyHistogram()
         # initialise empty map from timestamps to line numbers
         # we use this to determine the line number of the trigger that generated a specific entry in a binding
         self._timestamp_to_line_number = {}
+        # timestamps observed in more than one trigger (whose line numbers may be needed by more than one binding)
+        self._shared_trigger_timestamps = set()
 
     def __sizeof__(self):
         return sum(map(sys.getsizeof, self._all_nodes))
 
+    def get_branch_dependencies(self, quantifier_id):
+        return self._quantifier_id_to_branch_dependencies[quantifier_id]
+
+    def _derive_signal_history_horizon(self, quantifiers):
+        """
+        Derive how far behind the most recent sample of a signal a signal.at(t) expression can refer to.
+
+        A binding can be extended (and the expressions in its new branch constructed) at any point in the windows of
+        the quantifiers over timestamps in `quantifiers`, and an expression can subtract from a timestamp, so the
+        horizon is the sum of the lengths of the windows plus the largest amount subtracted.  If the length of a window
+        cannot be derived from the specification (for example, if one of its bounds is a number and the other is
+        given by a binding), None is returned and every sample is kept.
+
+        Timestamps measured at runtime (such as the time of a transition) cannot be bounded in this way, so those that
+        fall behind the horizon take the earliest sample that is kept.
+        """
+        def get_offset(timestamp_expression):
+            offset = 0
+            for f in timestamp_expression.derive_arithmetic_sequence():
+                offset = f(offset)
+            return offset
+
+        horizon = 0
+        quantifier_ids = set()
+        for quantifier in quantifiers:
+            if quantifier.get_id() in quantifier_ids or type(quantifier.get_predicate()) is not inTimeInterval:
+                continue
+            quantifier_ids.add(quantifier.get_id())
+            lower_bound = quantifier.get_predicate().get_left_expression()
+            upper_bound = quantifier.get_predicate().get_right_expression()
+            if type(lower_bound) in [int, float] and type(upper_bound) in [int, float]:
+                horizon += upper_bound - lower_bound
+            elif (hasattr(lower_bound, "derive_arithmetic_sequence") and
+                  hasattr(upper_bound, "derive_arithmetic_sequence") and
+                  lower_bound.get_base_variable() == upper_bound.get_base_variable()):
+                # the window is given relative to a timestamp that has already been observed
+                horizon += max(0, get_offset(upper_bound), get_offset(upper_bound) - get_offset(lower_bound))
+            else:
+                return None
+        largest_subtraction = 0
+        for atom in self._compiled_specification.get_atoms():
+            if type(atom) in [SignalAtTimestampEqualsNumber,
+                              SignalAtTimestampLessThanNumber,
+                              SignalAtTimestampGreaterThanNumber]:
+                offset = get_offset(atom.get_expression(0).get_timestamp())
+                largest_subtraction = max(largest_subtraction, -offset)
+        return horizon + largest_subtraction
+
+    def _derive_branch_dependencies(self, quantifier):
+        """
+        Construct the BranchDependencies for the branches of `quantifier`.
+        """
+        dependencies = BranchDependencies(quantifier.get_id())
+        if quantifier.get_subformula() is not None:
+            self._add_branch_dependencies(self._compiled_specification.instantiate_subformula(quantifier),
+                                          dependencies)
+        return dependencies
+
+    def _add_branch_dependencies(self, subformula, dependencies):
+        """
+        Recurse on `subformula` (in the same way as expand_subtree), adding what it depends on to `dependencies`.
+        """
+        if type(subformula) in [forall, exists]:
+            # constructing the subtree would add a provisional branch below this quantifier
+            dependencies.is_lazy = False
+        elif type(subformula) in [conjunction, disjunction]:
+            for conjunct in subformula.get_subformulae():
+                if type(conjunct) is not dict:
+                    self._add_branch_dependencies(conjunct, dependencies)
+        elif type(subformula) is negate:
+            self._add_branch_dependencies(subformula.get_subformula(), dependencies)
+        elif (is_normal_atom(subformula) or is_mixed_atom(subformula)) and type(subformula) is not BooleanConstant:
+            dependencies.atom_indices.add(self._compiled_specification.get_atom_index(subformula))
+            expressions = [subformula.get_expression(0)]
+            if is_mixed_atom(subformula):
+                expressions.append(subformula.get_expression(1))
+            for expression in expressions:
+                if expression.get_base_variable().get_name() < dependencies.quantifier_id:
+                    dependencies.has_outer_measurements = True
+            if type(subformula) in [SignalAtTimestampEqualsNumber,
+                                    SignalAtTimestampLessThanNumber,
+                                    SignalAtTimestampGreaterThanNumber]:
+                dependencies.signal_names.add(subformula.get_expression(0).get_signal_name())
+            elif type(subformula) is TimeBetweenLessThanConstant:
+                # at least one side must be a measurement (rather than a timestamp given by the binding)
+                if all(TimestampExpression in type(expression).__bases__ for expression in expressions):
+                    dependencies.is_lazy = False
+            elif type(subformula) not in [ValueInConcreteStateEqualToConstant,
+                                          ValueInConcreteStateLessThanConstant,
+                                          ValueInConcreteStateGreaterThanConstant,
+                                          ValueInConcreteStateNotEqualToConstant,
+                                          ValueInConcreteStateLessThanEqualToConstant,
+                                          ValueInConcreteStateGreaterThanEqualToConstant,
+                                          DurationOfTransitionLessThanNumber]:
+                dependencies.is_lazy = False
+        else:
+            # Boolean constants have a value as soon as they are added
+            dependencies.is_lazy = False
+
+    def _materialise_lazy_branches(self, atom_index=None, signal_name=None):
+        """
+        Construct the subtrees of the lazy branches concerned by an event for `atom_index` or `signal_name`
+        (or of every lazy branch, if neither is given), in the order in which they were added.
+        """
+        materialise_all = atom_index is None and signal_name is None
+        for lazy_quantifier_id, lazy_branches in self._lazy_branches.items():
+            if lazy_branches and (materialise_all or self._quantifier_id_to_branch_dependencies[
+                    lazy_quantifier_id].concerns(atom_index, signal_name)):
+                for lazy_branch in list(lazy_branches):
+                    lazy_branch.materialise()
+
     def get_measurements_for_db(self):
         """
         Construct a list of dictionaries that model instances of atomic constraints in the final monitoring tree.
@@ -901,7 +1737,7 @@ class Monitor():
         # initialise an empty list that we'll populate with dictionaries
         final_list = []
         # get all atoms
-        atoms = self._specification.get_atoms()
+        atoms = self._compiled_specification.get_atoms()
         # iterate over atoms
         for atomic_constraint_index, atom in enumerate(atoms):
             # get all bindings and values for this atom
@@ -940,7 +1776,7 @@ class Monitor():
         """
         # initialise final dictionary to be populated
         measurements_dictionary = {}
-        atoms = self._specification.get_atoms()
+        atoms = self._compiled_specification.get_atoms()
         # iterate over atoms
         for atom in atoms:
             # get all the bindings in the monitoring tree at which this atomic constraint was found
@@ -979,11 +1815,48 @@ class Monitor():
             return measurements_dictionary
 
     def get_line_number_from_timestamp(self, timestamp):
-        return self._timestamp_to_line_number[timestamp]
+        if timestamp in self._timestamp_to_line_number:
+            return self._timestamp_to_line_number[timestamp]
+        return self._retired_timestamp_to_line_number[timestamp]
+
+    def get_binding_summaries(self):
+        return self._binding_summaries
+
+    def get_number_of_retired_bindings(self):
+        return self._number_of_retired_bindings
+
+    def is_diagnosing_online(self):
+        return self._online_diagnosis
+
+    def get_violation_diagnoses(self):
+        """
+        Get the diagnoses of the atoms found to be False so far (in the order in which they were found to be False),
+        when diagnosing online.
+        """
+        return self._violation_diagnoses
+
+    def _diagnose_atom(self, atom_node):
+        """
+        Diagnose the atom held by `atom_node` if its value (which has just become known) is False, then stop keeping
+        function events for it.
+        """
+        function_call_history = self._function_call_histories[atom_node._atom_index]
+        if atom_node.get_value() is False:
+            violation_diagnosis = diagnose_false_atom(atom_node.get_subformula(), atom_node.get_binding(),
+                                                      [child.get_value() for child in atom_node.get_children()],
+                                                      function_call_history)
+            if violation_diagnosis is not None:
+                self._violation_diagnoses.append(violation_diagnosis)
+                point_of_no_return = violation_diagnosis.get_point_of_no_return()
+                if point_of_no_return is not None:
+                    logging.info(f'{atom_node.get_subformula()} is False at binding {atom_node.get_binding()}, '
+                                 f'with point of no return {point_of_no_return.get("function_name")} '
+                                 f'(line {point_of_no_return.get("line_number")})')
+        function_call_history.unwatch(atom_node)
 
     def get_bindings_and_values_for_atom(self, atomic_constraint):
         """
-        Recurse on the monitoring tree to find all occurrences of the given atomic constraint.
+        Walk the monitoring tree to find all occurrences of the given atomic constraint.
         In each case, record the binding, value, and line number.
         """
         # initialise list of relevant bindings
@@ -996,28 +1869,36 @@ class Monitor():
         relevant_truth_values = []
         # set current node to the root node
         current_node = self._monitoring_tree
-        # recurse
-        self._get_bindings_and_values_for_atom(atomic_constraint, current_node, relevant_bindings,
-                                               relevant_values, relevant_measurement_locations, relevant_truth_values)
-        return list(zip(relevant_bindings, relevant_values, relevant_measurement_locations, relevant_truth_values))
-
-    def _get_bindings_and_values_for_atom(self, atomic_constraint, current_node, relevant_bindings,
+        # atom nodes store the index of their atom, so compare indices rather than atoms
+        atom_index = self._compiled_specification.get_atom_index(atomic_constraint)
+        # every branch must have its subtree to be reported
+        self._materialise_lazy_branches()
+        # walk the tree
+        walk_tree(current_node,
+                  lambda node: self._get_bindings_and_values_for_atom(atom_index, node, relevant_bindings,
+                                                                      relevant_values, relevant_measurement_locations,
+                                                                      relevant_truth_values))
+        records = list(zip(relevant_bindings, relevant_values, relevant_measurement_locations, relevant_truth_values))
+        if self._binding_summaries:
+            # add the records kept for retired bindings, then restore the order of the bindings
+            for binding_summary in self._binding_summaries:
+                records += binding_summary.get_records_for_atom(atom_index)
+            records.sort(key=lambda record: binding_order_key(record[0]))
+        return records
+
+    def _get_bindings_and_values_for_atom(self, atom_index, current_node, relevant_bindings,
                                           relevant_values, relevant_measurement_locations, relevant_truth_values):
         """
-        Either take the binding from the current node (if it contains the atomic constraint given),
-        or recurse.
+        Either take the binding from the current node (if it contains the atomic constraint with index `atom_index`),
+        or return its children to walk next.
         """
-        # base case - see if current_node holds atomic_constraint
+        # see if current_node holds atomic_constraint
         if type(current_node) is not MonitorTreeAtomNode:
-            # recurse on children
-            for child in current_node.get_children():
-                self._get_bindings_and_values_for_atom(atomic_constraint, child, relevant_bindings,
-                                                       relevant_values, relevant_measurement_locations,
-                                                       relevant_truth_values)
+            # walk the children
+            return current_node.get_children()
         else:
-            # recursive case
-            # we have found an atom, so check its subformula
-            if current_node.get_subformula() == atomic_constraint:
+            # we have found an atom, so check its index
+            if current_node._atom_index == atom_index:
                 # add binding to list
                 relevant_bindings.append(current_node.get_binding())
                 # add value to list
@@ -1029,9 +1910,11 @@ class Monitor():
                 relevant_measurement_locations.append(child_measurement_locations)
                 # add truth values to list
                 relevant_truth_values.append(current_node.get_value())
-
+            return ()
 
     def wrap_up(self):
+        # construct the subtrees of branches that no event concerned, so that they are reported
+        self._materialise_lazy_branches()
         # resolve the monitoring tree if it has no truth value
         if self.get_verdict() is None:
             self.resolve_monitoring_tree()
@@ -1042,6 +1925,16 @@ class Monitor():
     def get_verdict(self):
         return self._monitoring_tree.get_value()
 
+    def is_verdict_settled(self):
+        """
+        Decide whether the verdict can no longer change, whatever events are observed next.
+
+        This is the case once a forall at the root is False, or once an exists at the root is True.
+        """
+        verdict = self.get_verdict()
+        return ((verdict is False and type(self._specification) is forall)
+                or (verdict is True and type(self._specification) is exists))
+
     def get_verdict_explanation(self) -> str:
         message_substrings: typing.List[str] = ["VALUES RECORDED:\n"]
 
@@ -1049,7 +1942,7 @@ class Monitor():
         # if we had a formula with something like ((exists...) and (exists...)), this may break
         # it's done like this because we've never had a formula like the above, so for now this is fine
         # print enhanced verdict (atomic constraint -> bindings -> measurements)
-        atoms = self._specification.get_atoms()
+        atoms = self._compiled_specification.get_atoms()
         # iterate over atoms
         for atom in atoms:
             message_substrings.append(str(atom))
@@ -1098,149 +1991,143 @@ class Monitor():
 
     def resolve_monitoring_tree(self, current_node=None):
         """
-        Recurse on the structure of the monitoring tree, assigning a truth value to any node without one.
+        Walk the monitoring tree, assigning a truth value to any node without one.
         """
         # if None, set current_node to root
         current_node = self._monitoring_tree if not current_node else current_node
+        walk_tree(current_node, self._resolve_node)
+        return current_node.get_value()
+
+    def _resolve_node(self, current_node):
+        """
+        If `current_node` has no truth value, give the children from which its truth value is derived (stopping as soon
+        as the truth value is decided), then assign it its truth value once each of these has been resolved.
+        """
         # follow this path through the tree if we have no truth value
-        if current_node.get_value() is None:
-            if type(current_node) is MonitorTreeQuantifierNode:
-                if type(current_node.get_subformula()) is forall:
-                    # check for no children (so, one child, but with a limited binding)
-                    quantifier_id = current_node.get_subformula().get_id()
-                    if (len(current_node.get_children()) == 1
-                            and quantifier_id not in current_node.get_children()[0].get_binding()):
-                        # in this case, set the forall to True
-                        final_truth_value = True
-                    else:
-                        # recurse on subtrees
-                        final_truth_value = True
-                        for child in current_node.get_children():
-                            final_truth_value = final_truth_value and self.resolve_monitoring_tree(child)
-                elif type(current_node.get_subformula()) is exists:
-                    # recurse on subtrees
-                    final_truth_value = False
-                    for child in current_node.get_children():
-                        final_truth_value = final_truth_value or self.resolve_monitoring_tree(child)
-            elif type(current_node) is MonitorTreeConjunctionNode:
-                # recurse on subtrees
+        if current_node.get_value() is not None:
+            return
+        if type(current_node) is MonitorTreeAtomNode:
+            if type(current_node.get_subformula()) is not BooleanConstant:
+                # an atom has no truth value because the quantity that it constrained was never observed
+                # for now, assume a 'weak' notion of truth and set it to True
                 final_truth_value = True
-                for child in current_node.get_children():
-                    final_truth_value = final_truth_value and self.resolve_monitoring_tree(child)
-            elif type(current_node) is MonitorTreeDisjunctionNode:
-                # recurse on subtrees
-                final_truth_value = False
-                for child in current_node.get_children():
-                    final_truth_value = final_truth_value or self.resolve_monitoring_tree(child)
-            elif type(current_node) is MonitorTreeNegateNode:
-                # recurse on subtree
-                final_truth_value = self.resolve_monitoring_tree(current_node.get_children()[0])
-                # current_node.set_value(final_truth_value)
-            elif type(current_node) is MonitorTreeAtomNode:
-                if type(current_node.get_subformula()) is not BooleanConstant:
-                    # an atom has no truth value because the quantity that it constrained was never observed
-                    # for now, assume a 'weak' notion of truth and set it to True
-                    final_truth_value = True
-                else:
-                    final_truth_value = current_node.get_subformula().get_value()
-            # set the final truth value of the node
-            current_node.set_value(final_truth_value)
+            else:
+                final_truth_value = current_node.get_subformula().get_value()
+        elif type(current_node) is MonitorTreeNegateNode:
+            # resolve the subtree
+            child = current_node.get_children()[0]
+            yield child
+            final_truth_value = child.get_value()
         else:
-            # the node already has a truth value, so use that
-            final_truth_value = current_node.get_value()
-        return final_truth_value
+            if type(current_node) is MonitorTreeQuantifierNode:
+                is_conjunction = type(current_node.get_subformula()) is forall
+                # check for no children (so, one child, but with a limited binding)
+                if (is_conjunction and len(current_node.get_children()) == 1
+                        and current_node.get_subformula().get_id() not in current_node.get_children()[0]._binding):
+                    # in this case, set the forall to True
+                    current_node.set_value(True)
+                    return
+            elif type(current_node) in [MonitorTreeConjunctionNode, MonitorTreeDisjunctionNode]:
+                is_conjunction = type(current_node) is MonitorTreeConjunctionNode
+            else:
+                return
+            # resolve the subtrees in turn until one decides the truth value
+            # (a False child for a forall or a conjunction, a True child for an exists or a disjunction)
+            final_truth_value = is_conjunction
+            for child in current_node.get_children():
+                yield child
+                final_truth_value = child.get_value()
+                if bool(final_truth_value) is not is_conjunction:
+                    break
+        # set the final truth value of the node
+        current_node.set_value(final_truth_value)
 
     def process_event(self, event):
         """
         Given `event`, assumed to be a dictionary, transform `self._monitoring_tree`,
         perform the relevant monitoring actions.
         """
-        # take first measurement for event processing time
-        event_processing_start_time = timeit.default_timer()
-
         # increment number of events counter
         self._number_of_events_observed += 1
+        self._event_type_counts[event["type"]] = self._event_type_counts.get(event["type"], 0) + 1
 
-        # update the most recent event map
-        if event["type"] == "signal":
-            self._latest_event_map[event["signal_name"]] = event
+        # take first measurement for event processing time, if this event is timed
+        event_is_timed = (self._event_timing_interval and
+                          self._number_of_events_observed % self._event_timing_interval == 0)
+        if event_is_timed:
+            event_processing_start_time = timeit.default_timer()
+
+        # add the sample to the history of its signal
+        if event["type"] == "signal" and event["signal_name"] in self._signal_histories:
+            self._signal_histories[event["signal_name"]].add(event)
 
         # check the type of the event
         if event["type"] == "signal":
-            # find quantifiers whose predicate concerns timestamps, and check whether
-            # this event satisfies their predicates
-
-            for quantifier_node in self._nodes_with_timestamp_quantifiers:
-                satisfied = quantifier_node.check_satisfaction(event)
-                if satisfied:
-                    # if there is just a single child branch, check its binding
-                    # if its binding should be extended then, rather than adding a new branch,
-                    # we extend the binding of the existent one
-                    children = quantifier_node.get_children()
-                    if (len(children) == 1 and
-                            (quantifier_node.get_subformula().get_id() not in
-                                quantifier_node.get_children()[0].get_binding())):
-                        # extend the binding of the entire subtree
-                        quantifier_node.get_children()[0].update_subtree_binding(
-                            {
-                                quantifier_node.get_subformula().get_id(): event["time"]
-                            }
+            # find quantifiers over timestamps whose windows contain the timestamp of this event
+            open_nodes, closed_nodes = self._timestamp_quantifier_index.advance(event["time"])
+            for quantifier_node in open_nodes:
+                # if there is just a single child branch, check its binding
+                # if its binding should be extended then, rather than adding a new branch,
+                # we extend the binding of the existent one
+                children = quantifier_node.get_children()
+                if (len(children) == 1 and
+                        (quantifier_node.get_subformula().get_id() not in
+                            quantifier_node.get_children()[0]._binding)):
+                    # extend the binding of the entire subtree
+                    quantifier_node.get_children()[0].update_subtree_binding(event["time"])
+                else:
+                    # get measurements from previous subtree
+                    if len(quantifier_node.get_children()) > 0:
+                        measurements = quantifier_node.get_children()[-1].extract_measurements_from_subtree(
+                            self._compiled_specification,
+                            quantifier_node.get_subformula().get_id()
                         )
                     else:
-                        # get list of atoms
-                        atoms = self._monitoring_tree.get_subformula().get_atoms()
-                        # get measurements from previous subtree
-                        if len(quantifier_node.get_children()) > 0:
-                            measurements = quantifier_node.get_children()[-1].extract_measurements_from_subtree(
-                                atoms,
-                                quantifier_node.get_subformula().get_id()
-                            )
-                        else:
-                            measurements = {}
-
-                        # add a new branch to the quantifier node whose quantifier captures this event
-                        quantifier_node.add_branch(event)
-                        # update the branch with the measurements extracted from the old branch
-                        if len(measurements) != 0:
-                            quantifier_node.update_newest_branch(atoms, measurements)
-
+                        measurements = {}
 
-            # iterate through expression nodes associated with this signal
-            if event["signal_name"] in self._signals_to_expression_nodes:
-                # iterate over copy
-                for expression_node in self._signals_to_expression_nodes[event["signal_name"]][:]:
-                    # evaluate the parts of the tree that can be evaluated using the value
-                    # generated by the quantifier on the new branch
+                    # add a new branch to the quantifier node whose quantifier captures this event
+                    quantifier_node.add_branch(event, lazy=True)
+                    # update the branch with the measurements extracted from the old branch
+                    if len(measurements) != 0:
+                        quantifier_node.update_newest_branch(self._compiled_specification, measurements)
+            # no more branches will be added for windows that have closed
+            for quantifier_node in closed_nodes:
+                quantifier_node.close_window()
+            # construct the branches that can be affected by this signal (including those it has just added)
+            self._materialise_lazy_branches(signal_name=event["signal_name"])
+
+            # iterate through the expression nodes whose timestamps have been reached by a sample of this signal
+            if event["signal_name"] in self._signal_histories:
+                for expression_node in \
+                        self._signal_histories[event["signal_name"]].take_resolvable_expression_nodes():
+                    # evaluate the parts of the tree that can be evaluated using the value of the signal
                     expression_node.evaluate_upwards()
-                    # if the expression node now has a value, remove it from the list of nodes for this signal
-                    if expression_node.get_value() is not None:
-                        self._signals_to_expression_nodes[event["signal_name"]].remove(expression_node)
 
         elif event["type"] == "trigger":
             # add an entry in the map from timestamps to line numbers
+            if event["time"] in self._timestamp_to_line_number:
+                self._shared_trigger_timestamps.add(event["time"])
             self._timestamp_to_line_number[event["time"]] = event["line_number"]
             # find quantifiers with the quantifier id held by this trigger
             quantifier_id = event["quantifier_id"]
             quantifier_nodes = self.quantifier_id_to_nodes[quantifier_id]
             # add a branch to each of these nodes
-            for node in quantifier_nodes:
+            # (adding a branch can make an exists True, which removes it from quantifier_nodes,
+            # so iterate over a copy and skip the nodes that have been removed)
+            for node in list(quantifier_nodes):
+                if node not in quantifier_nodes:
+                    continue
                 children = node.get_children()
                 if (len(children) == 1 and
                         (node.get_subformula().get_id() not in
-                         node.get_children()[0].get_binding())):
+                         node.get_children()[0]._binding)):
                     # extend the binding of the entire subtree
-                    node.get_children()[0].update_subtree_binding(
-                        {
-                            node.get_subformula().get_id(): event["time"]
-                        }
-                    )
+                    node.get_children()[0].update_subtree_binding(event["time"])
                 else:
-                    # get list of atoms
-                    atoms = self._monitoring_tree.get_subformula().get_atoms()
                     # get measurements from previous subtree
                     if len(node.get_children()) > 0:
                         measurements = node.get_children()[-1].extract_measurements_from_subtree(
-                            atoms,
+                            self._compiled_specification,
                             node.get_subformula().get_id()
                         )
                     else:
@@ -1248,10 +2135,10 @@ class Monitor():
 
                     if node.check_satisfaction(event):
                         # add a new branch to the quantifier node whose quantifier captures this event
-                        node.add_branch(event)
+                        node.add_branch(event, lazy=True)
                         # update the branch with the measurements extracted from the old branch
                         if len(measurements) != 0:
-                            node.update_newest_branch(atoms, measurements)
+                            node.update_newest_branch(self._compiled_specification, measurements)
         elif event["type"] == "measurement":
             # find the nodes with the atom and subatom indices matching this measurement
             # and set their values with that given by this measurement
@@ -1260,6 +2147,8 @@ class Monitor():
             measurement = event["value"]
             module_name = event["module_name"]
             line_number = event["line_number"]
+            # construct the branches that contain this atom
+            self._materialise_lazy_branches(atom_index=atom_index)
             nodes = self._atom_subatom_nodes[atom_index][subatom_index]
             for n, node in enumerate(nodes):
                 # add the measurement to the node
@@ -1267,11 +2156,11 @@ class Monitor():
                 if self.get_tree_evaluation_strategy() == "up":
                     # evaluate upwards from the node
                     node.evaluate_upwards()
-            # check for downwards evaluation
-            if self.get_tree_evaluation_strategy() == "down":
-                self._monitoring_tree.evaluate()
+                else:
+                    # evaluate the ancestors of the node once the event has been processed
+                    self._dirty_nodes[node] = None
             # empty the list, since we have now given values to these expressions
-            self._atom_subatom_nodes[atom_index][subatom_index] = []
+            self._atom_subatom_nodes[atom_index][subatom_index] = {}
         elif event["type"] == "quantifier-expression":
             # find quantifiers with the quantifier id held by this trace event
             quantifier_id = event["quantifier_id"]
@@ -1291,6 +2180,11 @@ class Monitor():
             measurement = event["value"]
             module_name = event["module_name"]
             line_number = event["line_number"]
+            # construct the branches that contain this atom
+            self._materialise_lazy_branches(atom_index=atom_index)
+            # when diagnosing online, keep the event until the atoms that may need it have values
+            if atom_index in self._function_call_histories:
+                self._function_call_histories[atom_index].add(event)
             # functions are not realted to subatoms so we put by default subatom index = 0
             nodes = self._atom_subatom_nodes[atom_index][0]
             for n, node in enumerate(nodes):
@@ -1299,42 +2193,244 @@ class Monitor():
                 if self.get_tree_evaluation_strategy() == "up":
                     # evaluate upwards from the node
                     node.evaluate_upwards()
-            # check for downwards evaluation
-            if self.get_tree_evaluation_strategy() == "down":
-                self._monitoring_tree.evaluate()
+                else:
+                    # evaluate the ancestors of the node once the event has been processed
+                    self._dirty_nodes[node] = None
             # empty the list, since we have now given values to these expressions
-            self._atom_subatom_nodes[atom_index][0] = []
+            self._atom_subatom_nodes[atom_index][0] = {}
 
-        # take second measurement for the time taken to process the event
-        event_processing_end_time = timeit.default_timer()
-        # compute time taken
-        event_processing_time_taken = event_processing_end_time - event_processing_start_time
-        # append to list
-        self._event_processing_times.append(event_processing_time_taken)
+        # when the tree is evaluated downwards, evaluate the parts of the tree that this event has changed
+        if self._dirty_nodes:
+            self._evaluate_dirty_nodes()
+
+        # retire the subtrees of bindings whose values became final
+        if self._resolved_bindings:
+            self._retire_resolved_bindings()
+
+        # take second measurement for the time taken to process the event, and add it to the histogram
+        if event_is_timed:
+            self._event_processing_times.add(timeit.default_timer() - event_processing_start_time)
 
         # self.write_tree_to_file(f"{self.get_number_of_events_observed()}.gv")
 
-    def get_event_processing_times(self):
+    def _evaluate_dirty_nodes(self):
+        """
+        When the tree is evaluated downwards, evaluate the ancestors of the nodes given values by the current event.
+
+        Ancestors are evaluated deepest first, so each is evaluated once, after all of its children that have changed,
+        and a node's parent is only evaluated if the value of the node has changed.
+        """
+        dirty_nodes = self._dirty_nodes
+        self._dirty_nodes = {}
+        # the nodes that have been scheduled for evaluation
+        scheduled_nodes = {}
+        # heap of (-depth, number, node) triples
+        nodes_to_evaluate = []
+        for node in dirty_nodes:
+            parent = node.get_parent()
+            if parent is not None and parent not in scheduled_nodes:
+                scheduled_nodes[parent] = None
+                heapq.heappush(nodes_to_evaluate, (-parent.get_depth(), len(scheduled_nodes), parent))
+        while nodes_to_evaluate:
+            negated_depth, _, node = heapq.heappop(nodes_to_evaluate)
+            if node.update_value():
+                parent = node.get_parent()
+                if parent is self._monitoring_tree and self._prune and node.get_value() is not None:
+                    self._resolved_bindings.append(node)
+                if parent is not None and parent not in scheduled_nodes:
+                    scheduled_nodes[parent] = None
+                    heapq.heappush(nodes_to_evaluate, (negated_depth + 1, len(scheduled_nodes), parent))
+            else:
+                self._note_evaluated_binding(node)
+
+    def _note_evaluated_binding(self, node):
+        """
+        Called once evaluation of the tree has stopped at `node`.  If `node` is in the subtree of a binding of the
+        outermost quantifier whose value is final, that binding may have been waiting for one of its atoms to be
+        evaluated before it could be retired, so try again.
+        """
+        if not self._prune:
+            return
+        root = self._monitoring_tree
+        while node._parent is not None and node._parent is not root:
+            node = node._parent
+        if node._parent is root and node.get_value() is not None:
+            self._resolved_bindings.append(node)
+
+    def _retire_resolved_bindings(self):
+        resolved_bindings = self._resolved_bindings
+        self._resolved_bindings = []
+        for binding_node in resolved_bindings:
+            # a binding can be found to be resolved more than once while processing an event
+            if binding_node.get_parent() is not self._monitoring_tree:
+                continue
+            # (when the tree is evaluated downwards, a forall whose branches are all True so far can still be False)
+            if (type(binding_node) is MonitorTreeQuantifierNode and type(binding_node.get_subformula()) is forall
+                    and binding_node.get_value() is True):
+                continue
+            self._retire_binding(binding_node)
+
+    def _retire_binding(self, binding_node):
+        """
+        Remove the subtree rooted at `binding_node` (a child of the root whose value is final) from the monitoring
+        tree and from every map that refers to its nodes, keeping a summary of it if it will be needed later.
+
+        The subtree is only retired once every atom in it has a value, so that measurements that arrive after the
+        value of the binding is final are still recorded.  Otherwise, it is checked again when its next atom is
+        evaluated.
+        """
+        # gather the nodes in the subtree, in depth-first order
+        subtree_nodes = []
+        nodes_to_visit = [binding_node]
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            if ((type(node) is MonitorTreeAtomNode and node.get_value() is None)
+                    or type(node) is MonitorTreeLazyBranchNode):
+                return
+            subtree_nodes.append(node)
+            nodes_to_visit.extend(reversed(node.get_children()))
+
+        value = binding_node.get_value()
+        if value is False or self._number_of_true_binding_summaries < self._max_true_binding_summaries:
+            self._binding_summaries.append(self._summarise_binding(binding_node, subtree_nodes))
+            if value is not False:
+                self._number_of_true_binding_summaries += 1
+
+        # detach the subtree, so that evaluation of any of its nodes stops at binding_node
+        root = self._monitoring_tree
+        root.remove_child(binding_node)
+        # forget the line number of the trigger for this binding, unless another binding has the same timestamp
+        root_id = root.get_subformula().get_id()
+        timestamp = binding_node._binding.get(root_id)
+        if timestamp not in self._shared_trigger_timestamps:
+            self._timestamp_to_line_number.pop(timestamp, None)
+        elif not any(child._binding.get(root_id) == timestamp for child in root.get_children()):
+            self._timestamp_to_line_number.pop(timestamp, None)
+            self._shared_trigger_timestamps.discard(timestamp)
+
+        # remove the nodes in the subtree from the maps used during monitoring
+        for node in subtree_nodes:
+            del self._all_nodes[node]
+            if node.get_value() is None:
+                self._number_of_open_nodes -= 1
+            if node in self._binding_nodes:
+                del self._binding_nodes[node]
+                self._false_binding_nodes.pop(node, None)
+            if type(node) is MonitorTreeQuantifierNode:
+                self.quantifier_id_to_nodes[node.quantifier_id].pop(node, None)
+                self._timestamp_quantifier_index.remove(node)
+            elif type(node) is MonitorTreeExpressionNode:
+                # leaves waiting for measurements
+                nodes = self._atom_subatom_nodes[node._atom_index].get(node._subatom_index)
+                if nodes:
+                    nodes.pop(node, None)
+                if type(node.get_subformula()) is SignalAtTimestamp:
+                    self._signal_histories[node.get_subformula().get_signal_name()].remove_expression_node(node)
+
+        self._number_of_retired_bindings += 1
+
+    def _add_binding_node(self, node):
+        """
+        Record that `node` is the root of the subtree for a binding.
+        """
+        self._binding_nodes[node] = None
+        if node.get_value() is False:
+            self._false_binding_nodes[node] = None
+
+    def _update_false_binding_nodes(self, node, value):
+        """
+        Called when the value of `node` changes to or from False, to keep the collection of the roots of the subtrees
+        for bindings that are False up to date.
+        """
+        if node in self._binding_nodes:
+            if value is False:
+                self._false_binding_nodes[node] = None
+            else:
+                self._false_binding_nodes.pop(node, None)
+
+    def get_false_binding_nodes(self):
+        """
+        Get the roots of the subtrees for bindings that are False (excluding bindings whose subtrees have been
+        retired), in the order in which the bindings were created.
+        """
+        # the subtrees of lazy branches are only constructed once an event concerns them,
+        # so restore the order in which the branches were added
+        return sorted(self._false_binding_nodes, key=lambda node: node._binding.get_creation_index())
+
+    def _summarise_binding(self, binding_node, subtree_nodes):
+        """
+        Construct a BindingSummary for the subtree rooted at `binding_node`, whose nodes are `subtree_nodes`.
+        """
+        atom_index_to_records = {}
+        falsifying_atoms = []
+        for node in subtree_nodes:
+            if type(node) is MonitorTreeAtomNode:
+                atom_index_to_records.setdefault(node._atom_index, []).append((
+                    node.get_binding(),
+                    list(map(lambda child: child.get_value(), node.get_children())),
+                    list(map(lambda child: child.get_measurement_location(), node.get_children())),
+                    node.get_value()
+                ))
+                # keep the line numbers of the triggers that generated the binding
+                for timestamp in node.get_binding().values():
+                    if timestamp in self._timestamp_to_line_number:
+                        self._retired_timestamp_to_line_number[timestamp] = self._timestamp_to_line_number[timestamp]
+            # the falsifying atoms are found in the same way as for the bindings still in the tree
+            # (see get_false_atoms_per_false_bindings)
+            if (not isinstance(node, MonitorTreeQuantifierNode)
+                    and isinstance(node.get_parent(), MonitorTreeQuantifierNode)
+                    and node.get_value() == False):
+                get_false_atoms(falsifying_atoms, node)
+        return BindingSummary(binding_node.get_binding(), binding_node.get_value(), atom_index_to_records,
+                              falsifying_atoms)
+
+    def process_events(self, events):
+        """
+        Process each event from `events`, which can be any iterable (including a generator reading a trace from disk).
+
+        In fail-fast mode, no more events are consumed from `events` once the verdict is settled.
         """
-        Get the list of event processing times constructed during monitoring.
+        if self._fail_fast and self.is_verdict_settled():
+            return
+        for event in events:
+            self.process_event(event)
+            if self._fail_fast and self.is_verdict_settled():
+                break
 
-        Assumes monitoring has taken place.
+    def get_event_processing_time(self):
+        """
+        Get the total time taken to process events, estimated from the events that were timed
+        (0 if no events were timed).
         """
-        return self._event_processing_times
+        number_of_timed_events = self._event_processing_times.get_count()
+        if number_of_timed_events == 0:
+            return 0.0
+        return self._event_processing_times.get_total() * self._number_of_events_observed / number_of_timed_events
+
+    def stats(self):
+        """
+        Get statistics on monitoring so far: the number of events of each type, a summary of the times taken to process
+        the events that were timed (in seconds), and the current size of the tree.
+        """
+        return {
+            "number_of_events": self._number_of_events_observed,
+            "event_type_counts": dict(self._event_type_counts),
+            "event_processing_time": self._event_processing_times.summarise(),
+            "tree_size": len(self._all_nodes),
+            "open_nodes": self._number_of_open_nodes,
+            "lazy_branches": sum(map(len, self._lazy_branches.values())),
+            "open_windows": self._timestamp_quantifier_index.get_number_of_open_windows(),
+            "retired_bindings": self._number_of_retired_bindings
+        }
 
     def get_signal_at_time(self, signal_name, timestamp):
         """
         Assume `timestamp` is a float, and get the value of the signal `signal_name` at time `timestamp`.
-        To do this, look at self._latest_event_map for the relevant signal name.
-        If the signal entry there has timestamp >= the given timestamp,
-        use it as the value of the signal at the given timestamp (this way, we interpolate by looking at the
-        closest value available to a timestamp in the future).
+        To do this, look in the history of the signal for the sample at the given timestamp or, if there is none,
+        the earliest sample after it (this way, we interpolate by looking at the closest value available to a
+        timestamp in the future).
         """
-        # get the signal entry held in the most recent event map
-        most_recent_signal_entry = self._latest_event_map[signal_name]
-        if most_recent_signal_entry:
-            if most_recent_signal_entry["time"] >= timestamp:
-                return most_recent_signal_entry
+        return self._signal_histories[signal_name].get_sample_at(timestamp)
 
     def write_tree_to_file(self, filename):
         """
@@ -1365,6 +2461,114 @@ class Monitor():
         graph.render(filename)
 
 
+def get_false_atoms(falsifying_atoms:list, child):
+    """
+    Walk the subtree rooted at `child`, adding to `falsifying_atoms` a (subformula, binding, values of children) triple
+    for each False node that is responsible for the subtree being False.
+    """
+    walk_tree(child, functools.partial(_get_false_atoms_at_node, falsifying_atoms))
+
+
+def _get_false_atoms_at_node(falsifying_atoms:list, child):
+    """
+    Add `child` to `falsifying_atoms` if it is responsible for its parent being False, and otherwise return the
+    children to walk next.
+    """
+    unwanted_types_node = [MonitorTreeConjunctionNode,MonitorTreeDisjunctionNode,MonitorTreeNegateNode]
+    #stop condition for the walk
+    if type(child) not in unwanted_types_node:
+        # if the binding/child is in one of the unwanted types
+        #we check if the child is false
+        if child.get_value() == False:
+            #if is_normal_atom(child ) or is_mixed_atom(child) then
+            #parent is quantifier
+            # if the parent is in one of the unwanted types, or is a quantifier
+            if (isinstance(child.get_parent(), tuple(unwanted_types_node))
+                    or isinstance(child.get_parent(), MonitorTreeQuantifierNode)):
+                # then we check if child is already in falsifying_atoms
+                if child.get_subformula() not in falsifying_atoms:
+                    atom_children=[]
+                    #get children of the current atom
+                    for atom_child in child.get_children():
+                        atom_children.append(atom_child.get_value())
+                    # we add the subformula of the child (which is an atom)
+                    falsifying_atoms.append(tuple((child.get_subformula(),child.get_binding(),atom_children)))
+                return ()
+
+    # if binding is a disjunction then the only way it is false is only if both children are false
+    if isinstance(child,MonitorTreeDisjunctionNode) and child.get_value() == False:
+        if child.get_children()[0].get_value() == False and child.get_children()[1].get_value() == False:
+            return child.get_children()[:2]
+
+    # if binding is a conjuction then it is false if the children have the following truth values
+    elif isinstance(child,MonitorTreeConjunctionNode) and child.get_value() == False:
+        if child.get_children()[0].get_value() == False and child.get_children()[1].get_value() == False:
+            return child.get_children()[:2]
+        elif child.get_children()[0].get_value() == False and child.get_children()[1].get_value() != False:
+            return child.get_children()[:1]
+        elif child.get_children()[0].get_value() != False and child.get_children()[1].get_value() == False:
+            return child.get_children()[1:2]
+
+    #then binding/child is a complex formula so lets look at it's children
+    elif not isinstance(child,MonitorTreeNegateNode):
+        return child.get_children()
+
+    return ()
+
+
+def get_diagnosable_atoms(compiled_specification) -> dict:
+    """
+    Get a map from the atoms of `compiled_specification` that can be diagnosed (those constraining the time between
+    two points or the duration of a transition) to their indices.
+    """
+    atom_to_index = {}
+    for atom_index, atom in enumerate(compiled_specification.get_atoms()):
+        if type(atom) in [TimeBetweenLessThanConstant, DurationOfTransitionLessThanNumber]:
+            atom_to_index.setdefault(atom, atom_index)
+    return atom_to_index
+
+
+def diagnose_false_atom(atom, binding: dict, values: list, function_call_history):
+    """
+    Diagnose `atom` (false at `binding`, with its subatoms having `values`) from the function calls held by
+    `function_call_history`, or return None if its window is not known.
+
+    For timeBetween(a, b), the window runs from a to b.  For t.duration(), it runs from the time at which t was bound
+    for as long as t lasted.
+    """
+    if type(atom) is TimeBetweenLessThanConstant:
+        if len(values) < 2 or values[0] is None or values[1] is None:
+            return None
+        start, end = values[0], values[1]
+    else:
+        variable_name = atom.get_duration_expression().get_base_variable().get_name()
+        if not values or values[0] is None or binding.get(variable_name) is None:
+            return None
+        start, end = binding[variable_name], binding[variable_name] + values[0]
+    # the end of the window, and the time at which the time allowed is consumed, count if the comparison of the
+    # atom is <= (the atoms that can be diagnosed currently all compare with <)
+    includes_bound = ATOM_COMPARISONS[type(atom)][0] is operator.le
+    calls, point_of_no_return_index = function_call_history.find_calls_in_window(
+        start, end, includes_bound, start + atom.get_constant(), includes_bound)
+    return ViolationDiagnosis(atom, binding, calls, point_of_no_return_index, end - start - atom.get_constant())
+
+
+def binding_order_key(binding: dict) -> tuple:
+    """
+    Get a key that sorts bindings in the order of their branches in the monitoring tree (depth first), since each
+    binding extends the binding of its parent quantifier and timestamps only increase.
+    """
+    return tuple(binding.values())
+
+
+def binding_creation_order_key(binding: dict) -> tuple:
+    """
+    Get a key that sorts bindings in the order in which their branches were created, since the newest entry in a
+    binding is the timestamp of the trigger that created its branch.
+    """
+    return tuple(binding.values())[::-1]
+
+
 def event_loop(specification, event_queue, monitoring_statistics):
     """
     Starts a while loop that consumes from an event queue.
@@ -1408,9 +2612,8 @@ def event_loop(specification, event_queue, monitoring_statistics):
     if monitor.get_verdict() is None:
         monitor.resolve_monitoring_tree()
 
-    # compute average event processing time
-    event_processing_times = monitor.get_event_processing_times()
-    monitoring_statistics["event_processing_time"] = event_processing_times
+    # compute total event processing time
+    monitoring_statistics["event_processing_time"] = monitor.get_event_processing_time()
 
     # store monitoring statistics
     monitoring_statistics["number_of_events"] = monitor.get_number_of_events_observed()
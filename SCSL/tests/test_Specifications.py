@@ -1,8 +1,9 @@
 from unittest import TestCase
 
-from SCSL.Specifications.builder import Quantifier, forall, exists, conjunction, disjunction, negate
+from SCSL.Specifications.builder import (Quantifier, forall, exists, conjunction, disjunction, negate,
+                                         construct_cumulative_binding)
 from SCSL.Specifications.predicates import changes, calls, inTimeInterval
-from SCSL.Specifications.constraints import ValueInConcreteStateEqualToConstant, ValueInConcreteState, signal
+from SCSL.Specifications.constraints import ValueInConcreteStateEqualToConstant, ValueInConcreteState, signal, time
 
 
 class TestSpecifications(TestCase):
@@ -160,3 +161,53 @@ class TestSpecifications(TestCase):
         self.assertIsInstance(function_names, list)
         self.assertEqual(len(function_names), 1)
         self.assertEqual(function_names, ["f"])
+
+    def test_quantifier_compile_is_cached(self):
+        spec = forall(id=0, predicate=changes("x").during("f"), binding={}).check(
+            lambda binding: binding[0]("x").equals(10)
+        )
+        compiled_specification = spec.compile()
+        self.assertIs(spec.compile(), compiled_specification)
+        # setting a new subformula invalidates the compiled form
+        spec.check(lambda binding: binding[0]("x").equals(20))
+        self.assertIsNot(spec.compile(), compiled_specification)
+
+    def test_compiled_specification_atom_index(self):
+        spec = forall(id=0, predicate=changes("x").during("f"), binding={}).check(
+            lambda binding : conjunction(binding, binding[0]("x").equals(10), binding[0]("x").equals(20))
+        )
+        compiled_specification = spec.compile()
+        self.assertIsInstance(compiled_specification.get_atoms(), tuple)
+        # atoms from a new instantiation of the subformula are equal, so have the same hash and index
+        atoms = spec.get_subformula()(construct_cumulative_binding(spec)).get_atoms()
+        for (atom_index, atom) in enumerate(atoms):
+            self.assertEqual(hash(atom), hash(compiled_specification.get_atoms()[atom_index]))
+            self.assertEqual(compiled_specification.get_atom_index(atom), atom_index)
+
+    def test_predicate_hashes_do_not_change_during_monitoring(self):
+        spec = forall(id=0, predicate=changes("x").during("f"), binding={}).check(
+            lambda binding: exists(id=1, binding=binding,
+                                   predicate=inTimeInterval([time(binding[0]), time(binding[0]) + 5])).check(
+                lambda binding: binding[0]("x").equals(10)
+            )
+        )
+        predicates = [changes("x").during("f"), calls("g").during("f"),
+                      spec.get_subformula()(construct_cumulative_binding(spec)).get_predicate()]
+        hashes = [hash(predicate) for predicate in predicates]
+        predicate_set = set(predicates)
+        # substitute the values observed while monitoring
+        predicates[0].set_after_timestamp(1.0)
+        predicates[1].set_after_timestamp(2.0)
+        predicates[2].set_sub_expression_value(3.0, 0)
+        self.assertEqual(predicates[2].get_left_expression(), 3.0)
+        self.assertEqual([hash(predicate) for predicate in predicates], hashes)
+        for predicate in predicates:
+            self.assertIn(predicate, predicate_set)
+
+    def test_compiled_specification_reuses_quantifier_free_subformula(self):
+        spec = forall(id=0, predicate=changes("x").during("f"), binding={}).check(
+            lambda binding: binding[0]("x").equals(10)
+        )
+        compiled_specification = spec.compile()
+        self.assertIs(compiled_specification.instantiate_subformula(spec),
+                      compiled_specification.instantiate_subformula(spec))
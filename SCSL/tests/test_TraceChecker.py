@@ -1,4 +1,17 @@
-from unittest import TestCase
+import contextlib
+import gzip
+import io
+import json
+import operator
+import os
+import pathlib
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+from unittest import TestCase, mock, skipUnless
 
 from SCSL.TraceChecker.tracechecker import (MonitorTreeConjunctionNode,
                                             MonitorTreeDisjunctionNode,
@@ -7,9 +20,28 @@ from SCSL.TraceChecker.tracechecker import (MonitorTreeConjunctionNode,
                                             MonitorTreeExpressionNode,
                                             MonitorTreeVariableNode,
                                             MonitorTreeQuantifierNode,
-                                            Monitor)
+                                            MonitorTreeLazyBranchNode,
+                                            SignalHistory,
+                                            LatencyHistogram,
+                                            Monitor,
+                                            IncompatibleTypeError,
+                                            ATOM_COMPARISONS,
+                                            compile_atom_evaluator,
+                                            diagnose_false_atom)
+from SCSL.TraceChecker import trace_reader
+from SCSL.TraceChecker.trace_reader import TraceFile, TraceFormatError, SpecificationTrace, BindingShardTrace
+from SCSL.TraceChecker.checking import (check_trace_for_each_specification, check_traces, check_trace,
+                                        check_trace_in_shards, load_specifications)
+from SCSL.TraceChecker.cli import split_paths, expand_trace_patterns, get_output_suffix
+from SCSL.TraceChecker.aggregation import DiagnosisSummary, aggregate_diagnoses
+from SCSL.Monitoring.monitoring import get_false_atoms_per_false_bindings, get_diagnosis
+from SCSL.Monitoring.diagnosis import FunctionCallIndex, diagnose_false_atoms
+from SCSL.Monitoring.batching import EventBatcher, SpecificationRouter
+from SCSL.Monitoring.ring_buffer import SharedMemoryRingBuffer
+from SCSL.Monitoring.spooling import TraceSpooler
 from SCSL.Specifications.builder import Quantifier, forall, exists, conjunction, disjunction, negate
-from SCSL.Specifications.predicates import calls
+from SCSL.Specifications.predicates import calls, changes, inTimeInterval
+from SCSL.Specifications.constraints import signal, time, timeBetween, boolean
 
 
 class TestMonitorTreeConjunctionNode(TestCase):
@@ -65,6 +97,34 @@ class TestMonitorTreeQuantifierNode(TestCase):
         # assert that the binding attached to the new branch is correct
         self.assertEqual(quantifier_node.get_children()[0].get_binding(), {0:0})
 
+    def test_provisional_binding_is_shared(self):
+        # initialise formula
+        spec = forall(id=0, predicate=calls("f").during("g"), binding={}).check(
+            lambda binding: forall(id=1, predicate=calls("h").during("g"), binding={0: binding[0]}).check(
+                lambda binding: conjunction(binding, binding[0].duration() < 10, binding[1].duration() < 20)
+            )
+        )
+        # initialise monitor, and add a branch for the outer quantifier
+        monitor = Monitor(spec)
+        monitor.process_event({"type": "trigger", "quantifier_id": 0, "time": 1, "line_number": 1})
+        # the first trigger for the inner quantifier extends the binding of the provisional branch
+        # (whose subtree is constructed lazily)
+        monitor.process_event({"type": "trigger", "quantifier_id": 1, "time": 3, "line_number": 2})
+        inner_quantifier_node = next(iter(monitor.quantifier_id_to_nodes[1]))
+        provisional_branch = inner_quantifier_node.get_children()[0]
+        self.assertIsInstance(provisional_branch, MonitorTreeLazyBranchNode)
+        self.assertEqual(inner_quantifier_node.get_children(), [provisional_branch])
+        self.assertEqual(provisional_branch.get_binding(), {0: 1, 1: 3})
+        # a measurement for the inner quantifier's atoms constructs the subtree of the branch
+        monitor.process_event({"type": "measurement", "atom_index": 1, "subatom_index": 0, "value": 1,
+                               "time": 4, "module_name": "m", "line_number": 4})
+        branch_root = inner_quantifier_node.get_children()[0]
+        self.assertIsInstance(branch_root, MonitorTreeConjunctionNode)
+        for node in branch_root.get_children():
+            self.assertEqual(node.get_binding(), {0: 1, 1: 3})
+            # nodes are compact, so they have no per-instance dictionary
+            self.assertFalse(hasattr(node, "__dict__"))
+
     def test_trace_checking_universal_conjunction_satisfaction(self):
         # initialise formula
         spec = forall(id=0, predicate=calls("f").during("g"), binding={}).check(
@@ -354,4 +414,1107 @@ class TestMonitorTreeQuantifierNode(TestCase):
         self.assertFalse(quantifier_node.get_value())
 
 
+class TestTraceFile(TestCase):
+
+    def setUp(self):
+        # initialise events with nested values and strings containing separators
+        self.events = [
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 0.5, "line_number": 6},
+            {"type": "function", "spec_id": 0, "atom_index": 0, "value": 1.25, "function_name": "f, ]"},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 1, "value": [1, {"a": 2}]},
+        ]
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_json_array(self):
+        with open(self.path, "w") as h:
+            h.write(json.dumps(self.events, indent=1))
+        # use a small chunk size so that events span several chunks
+        trace = TraceFile(self.path, chunk_size=7)
+        self.assertEqual(list(trace), self.events)
+        # the trace can be scanned again
+        self.assertEqual(list(trace), self.events)
+
+    def test_json_lines(self):
+        with open(self.path, "w") as h:
+            h.write("\n".join(map(json.dumps, self.events)) + "\n")
+        trace = TraceFile(self.path, chunk_size=7)
+        self.assertEqual(list(trace), self.events)
+
+    def test_empty_trace(self):
+        with open(self.path, "w") as h:
+            h.write("[]")
+        self.assertEqual(list(TraceFile(self.path)), [])
+        self.assertIsNone(TraceFile(self.path).peek_first_event())
+
+    def test_peek_first_event_closes_file(self):
+        with gzip.open(self.path, "wt") as h:
+            h.write("\n".join(map(json.dumps, self.events)) + "\n")
+        # keep the handles opened for the trace, to check that they are closed
+        handles = []
+        original_open_trace = trace_reader._open_trace
+
+        def open_trace(path):
+            handles.append(original_open_trace(path))
+            return handles[-1]
+
+        with mock.patch.object(trace_reader, "_open_trace", side_effect=open_trace):
+            self.assertEqual(TraceFile(self.path).peek_first_event(), self.events[0])
+            self.assertEqual(SpecificationTrace(TraceFile(self.path), 1).peek_first_event(), None)
+        self.assertEqual(len(handles), 2)
+        self.assertTrue(all(handle.closed for handle in handles))
+
+    def test_truncated_json_array(self):
+        with open(self.path, "w") as h:
+            h.write(json.dumps(self.events)[:-10])
+        with self.assertRaises(TraceFormatError):
+            list(TraceFile(self.path, chunk_size=7))
+
+
+class TestTraceSpooler(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.events = [{"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": float(i), "line_number": 6}
+                       for i in range(10)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _check_round_trip(self, compression):
+        # use a small chunk size so that the trace is written as several chunks
+        spooler = TraceSpooler([0, 1], compression=compression, chunk_size=3, directory=self.directory)
+        for event in self.events:
+            spooler.append(0, event)
+        numbers_of_events_written = spooler.close()
+        self.assertEqual(numbers_of_events_written, {0: 10, 1: 0})
+        paths = spooler.get_paths()
+        # the footer is not yielded by the reader
+        self.assertEqual(list(TraceFile(paths[0], chunk_size=7)), self.events)
+        self.assertEqual(list(TraceFile(paths[1])), [])
+
+    def test_uncompressed(self):
+        self._check_round_trip(None)
+
+    def test_gzip(self):
+        self._check_round_trip('gzip')
+
+    def test_lzma(self):
+        self._check_round_trip('lzma')
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            TraceSpooler([0], compression='zip', directory=self.directory)
+
+    def test_stale_chunks_are_written_without_further_events(self):
+        spooler = TraceSpooler([0], flush_interval=0.01, directory=self.directory)
+        spooler.append(0, self.events[0])
+        spooler.append(0, self.events[1])
+        path = spooler.get_paths()[0]
+        # no more events are appended, so the writer thread must hand off the chunk itself
+        deadline = timeit.default_timer() + 5
+        while path.stat().st_size == 0 and timeit.default_timer() < deadline:
+            threading.Event().wait(0.01)
+        self.assertEqual([json.loads(line) for line in path.read_text().splitlines()], self.events[:2])
+        spooler.close()
+
+    def test_stale_chunks_keep_events_in_order(self):
+        spooler = TraceSpooler([0], chunk_size=7, flush_interval=0.0005, max_pending_chunks=2,
+                               directory=self.directory)
+        events = [{"type": "trigger", "spec_id": 0, "time": float(i)} for i in range(1000)]
+        for index, event in enumerate(events):
+            spooler.append(0, event)
+            # pause now and then, so that chunks are handed off both by append and by the writer thread
+            if index % 10 == 0:
+                threading.Event().wait(0.001)
+        self.assertEqual(spooler.close(), {0: 1000})
+        self.assertEqual(list(TraceFile(spooler.get_paths()[0])), events)
+
+
+class TestEventBatcher(TestCase):
+
+    def test_batches_preserve_order(self):
+        event_queue = queue.Queue()
+        batcher = EventBatcher(event_queue, batch_size=4)
+        events = [{"type": "trigger", "spec_id": i % 2, "time": float(i)} for i in range(10)]
+        for event in events:
+            batcher.append(event)
+        # two full batches have been put on the queue, and two events are still buffered
+        self.assertEqual(event_queue.qsize(), 2)
+        self.assertTrue(batcher.flush())
+        self.assertFalse(batcher.flush())
+        batches = [event_queue.get() for _ in range(3)]
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+        self.assertEqual([event for batch in batches for event in batch], events)
+
+    def test_buffers_per_thread(self):
+        event_queue = queue.Queue()
+        batcher = EventBatcher(event_queue, batch_size=2)
+        events = [{"spec_id": 0, "thread": "main", "time": 1.0}, {"spec_id": 0, "thread": "other", "time": 2.0},
+                  {"spec_id": 0, "thread": "main", "time": 3.0}]
+        batcher.append(events[0])
+        thread = threading.Thread(target=batcher.append, args=(events[1],))
+        thread.start()
+        thread.join()
+        # the main thread's buffer is now full, and the other thread's buffer is handed off with it, so the other
+        # thread's event does not reach the queue after the later events of the main thread
+        batcher.append(events[2])
+        self.assertEqual(event_queue.qsize(), 1)
+        self.assertEqual(event_queue.get(), events)
+        self.assertFalse(batcher.flush())
+
+    def test_order_is_preserved_across_threads(self):
+        event_queue = queue.Queue()
+        batcher = EventBatcher(event_queue, batch_size=3)
+        # each event is appended by one of several threads in turn, so it must follow the previous one
+        turn = threading.Condition()
+        next_index = [0]
+
+        def append_events(thread_index, number_of_threads):
+            for index in range(thread_index, 60, number_of_threads):
+                with turn:
+                    turn.wait_for(lambda: next_index[0] == index)
+                    batcher.append({"spec_id": 0, "index": index})
+                    next_index[0] += 1
+                    turn.notify_all()
+
+        threads = [threading.Thread(target=append_events, args=(thread_index, 4)) for thread_index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batcher.flush()
+        events = [event for _ in range(event_queue.qsize()) for event in event_queue.get()]
+        self.assertEqual([event["index"] for event in events], list(range(60)))
+
+    def test_signal_events_are_routed_to_every_specification(self):
+        queues = {0: queue.Queue(), 1: queue.Queue()}
+        batcher = EventBatcher(SpecificationRouter(queues), batch_size=3)
+        events = [{"type": "trigger", "spec_id": 0, "time": 1.0},
+                  {"type": "signal", "signal_name": "x", "value": 1, "time": 2.0},
+                  {"type": "trigger", "spec_id": 1, "time": 3.0}]
+        for event in events:
+            batcher.append(event)
+        self.assertEqual(queues[0].get_nowait(), events[:2])
+        self.assertEqual(queues[1].get_nowait(), events[1:])
+
+
+class TestMonitorProcessEvents(TestCase):
+
+    def test_process_events_matches_process_event(self):
+        spec = forall(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: binding[0].duration() < 1
+        )
+        events = [
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 0.0, "line_number": 1},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 0.5,
+             "time": 0.5, "line_number": 2, "module_name": "m"},
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 1.0, "line_number": 1},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 2.0,
+             "time": 3.0, "line_number": 2, "module_name": "m"},
+        ]
+        batched_monitor = Monitor(spec)
+        batched_monitor.process_events(events[:3])
+        batched_monitor.process_events(events[3:])
+        monitor = Monitor(spec)
+        for event in events:
+            monitor.process_event(event)
+        self.assertEqual(batched_monitor.get_verdict(), monitor.get_verdict())
+        self.assertEqual(batched_monitor.get_verdict(), False)
+
+    def test_fail_fast(self):
+        spec = forall(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: binding[0].duration() < 1
+        )
+        events = [
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 0.0, "line_number": 1},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 2.0,
+             "time": 2.0, "line_number": 2, "module_name": "m"},
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 3.0, "line_number": 1},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 0.5,
+             "time": 3.5, "line_number": 2, "module_name": "m"},
+        ]
+        monitor = Monitor(spec, fail_fast=True)
+        event_iterator = iter(events)
+        monitor.process_events(event_iterator)
+        self.assertTrue(monitor.is_verdict_settled())
+        self.assertFalse(monitor.get_verdict())
+        # the events after the violation are not consumed
+        self.assertEqual(monitor.get_number_of_events_observed(), 2)
+        self.assertEqual(next(event_iterator), events[2])
+        # without fail-fast, every event is processed
+        monitor = Monitor(spec)
+        monitor.process_events(events)
+        self.assertEqual(monitor.get_number_of_events_observed(), 4)
+
+    def test_exists_settled_when_true(self):
+        spec = exists(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: binding[0].duration() < 1
+        )
+        monitor = Monitor(spec, fail_fast=True)
+        monitor.process_events([
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 0.0, "line_number": 1},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 0.5,
+             "time": 0.5, "line_number": 2, "module_name": "m"},
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 1.0, "line_number": 1},
+        ])
+        self.assertTrue(monitor.get_verdict())
+        self.assertTrue(monitor.is_verdict_settled())
+        self.assertEqual(monitor.get_number_of_events_observed(), 2)
+
+
+class TestMonitorEvaluation(TestCase):
+
+    def test_unknown_operand_does_not_decide_disjunction(self):
+        spec = forall(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: disjunction(binding, binding[0].duration() < 1, negate(binding[0].duration() < 2))
+        )
+        for tree_evaluation_strategy in ["up", "down"]:
+            monitor = Monitor(spec, tree_evaluation_strategy)
+            monitor.process_events([
+                {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 0.0, "line_number": 1},
+                {"type": "measurement", "spec_id": 0, "atom_index": 1, "subatom_index": 0, "value": 0.5,
+                 "time": 0.5, "line_number": 2, "module_name": "m"},
+            ])
+            # the second operand is False, but the first is not yet known
+            self.assertIsNone(monitor.get_verdict())
+            monitor.process_event({"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0,
+                                   "value": 0.5, "time": 1.0, "line_number": 2, "module_name": "m"})
+            self.assertIsNot(monitor.get_verdict(), False)
+
+    def test_new_branches_are_evaluated_downwards(self):
+        spec = forall(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: forall(id=1, binding=binding, predicate=calls("g").during("p")).check(
+                lambda binding: binding[1].duration() < 1
+            )
+        )
+        events = [
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 0.0, "line_number": 1},
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 1, "time": 1.0, "line_number": 2},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 0.5,
+             "time": 2.0, "line_number": 3, "module_name": "m"},
+        ]
+        monitor = Monitor(spec, "down")
+        monitor.process_events(events)
+        # every branch so far is True
+        self.assertIs(monitor.get_verdict(), True)
+        # a new branch whose value is not yet known means the verdict is not known
+        monitor.process_event({"type": "trigger", "spec_id": 0, "quantifier_id": 1, "time": 3.0, "line_number": 2})
+        self.assertIsNone(monitor.get_verdict())
+        # a violation found once the binding is no longer True is still reported when pruning
+        for tree_evaluation_strategy in ["up", "down"]:
+            monitor = Monitor(spec, tree_evaluation_strategy, prune=True)
+            monitor.process_events(events + [
+                {"type": "trigger", "spec_id": 0, "quantifier_id": 1, "time": 3.0, "line_number": 2},
+                {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 2.0,
+                 "time": 4.0, "line_number": 3, "module_name": "m"},
+            ])
+            monitor.wrap_up()
+            self.assertIs(monitor.get_verdict(), False)
+
+    def test_deep_trees_are_resolved_without_recursion(self):
+        spec = forall(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: binding[0].duration() < 1
+        )
+        monitor = Monitor(spec)
+        # a chain of conjunctions far deeper than the recursion limit, ending in an empty (so True) conjunction
+        root = node = MonitorTreeConjunctionNode(spec, {}, monitor)
+        for _ in range(3 * sys.getrecursionlimit()):
+            child = MonitorTreeConjunctionNode(spec, {}, monitor)
+            node.add_child(child)
+            node = child
+        self.assertIs(monitor.resolve_monitoring_tree(root), True)
+        self.assertIs(node.get_value(), True)
+
+
+class TestAtomEvaluators(TestCase):
+
+    def test_boolean_constants_are_not_evaluated(self):
+        self.assertIsNone(compile_atom_evaluator(boolean(True)))
+
+    def test_incompatible_types(self):
+        spec = forall(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: binding[0].duration() < 1
+        )
+        monitor = Monitor(spec)
+        monitor.process_event({"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 0.0, "line_number": 1})
+        with self.assertRaises(IncompatibleTypeError):
+            monitor.process_event({"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0,
+                                   "value": "slow", "time": 1.0, "line_number": 2, "module_name": "m"})
+
+    def test_numbers_are_added_once(self):
+        spec = forall(id=0, binding={}, predicate=inTimeInterval([0, 1])).check(
+            lambda binding: signal("s").at(binding[0] + 1 + 2) < 90
+        )
+        monitor = Monitor(spec)
+        for timestamp in range(10):
+            monitor.process_event({"type": "signal", "signal_name": "s", "value": 10 * timestamp,
+                                   "time": timestamp})
+        monitor.wrap_up()
+        # the branch for timestamp 1 takes the value of the signal at 1 + 1 + 2
+        # (and the branch for timestamp 0 is evaluated, even though its timestamp is 0)
+        measurements = {summary["binding"][0]: summary["measurements"][0]["measurement_value"]
+                        for summary in monitor.get_measurements_for_db()}
+        self.assertEqual(measurements, {0: 30, 1: 40})
+
+
+class TestMonitorLazyBranches(TestCase):
+
+    def setUp(self):
+        self.spec = forall(id=0, predicate=calls("f").during("g"), binding={}).check(
+            lambda binding: conjunction(binding, binding[0].duration() < 10, binding[0].duration() < 20)
+        )
+        self.triggers = [{"type": "trigger", "quantifier_id": 0, "time": time, "line_number": time}
+                         for time in range(1, 6)]
+        self.measurement = {"type": "measurement", "atom_index": 0, "subatom_index": 0, "value": 15, "time": 6,
+                            "module_name": "m", "line_number": 6}
+
+    def test_branches_are_constructed_when_concerned(self):
+        monitor = Monitor(self.spec)
+        monitor.process_events(self.triggers)
+        # the root and a placeholder per trigger
+        self.assertEqual(monitor.get_tree_size(), 1 + len(self.triggers))
+        monitor.process_event(self.measurement)
+        # the root and a conjunction, two atoms and two expressions per trigger
+        self.assertEqual(monitor.get_tree_size(), 1 + 5 * len(self.triggers))
+        self.assertIs(monitor.get_verdict(), False)
+
+    def test_wrap_up_constructs_remaining_branches(self):
+        monitor = Monitor(self.spec)
+        monitor.process_events(self.triggers)
+        monitor.wrap_up()
+        self.assertEqual(monitor.get_tree_size(), 1 + 5 * len(self.triggers))
+        self.assertIs(monitor.get_verdict(), True)
+        self.assertEqual(len(monitor.get_measurements_for_db()), 2 * len(self.triggers))
+
+    def test_branches_added_by_a_signal_are_constructed_for_it(self):
+        spec = forall(id=0, predicate=inTimeInterval([0, 10]), binding={}).check(
+            lambda binding: signal("s").at(binding[0]) < 10
+        )
+        monitor = Monitor(spec)
+        monitor.process_event({"type": "signal", "signal_name": "s", "value": 20, "time": 1})
+        # the branch for the signal's timestamp takes the value of the signal at once
+        self.assertEqual(monitor.get_measurements_for_db()[0]["measurements"][0]["measurement_value"], 20)
+        self.assertIs(monitor.get_verdict(), False)
+
+
+class TestMonitorTimestampQuantifiers(TestCase):
+
+    @staticmethod
+    def signal(time, value):
+        return {"type": "signal", "signal_name": "s", "value": value, "time": time}
+
+    def test_signals_only_touch_open_windows(self):
+        spec = forall(id=0, predicate=calls("f").during("g"), binding={}).check(
+            lambda binding: exists(
+                id=1, binding=binding, predicate=inTimeInterval([time(binding[0]), time(binding[0]) + 5])
+            ).check(lambda binding: signal("s").at(binding[1]) < 10)
+        )
+        monitor = Monitor(spec)
+        for trigger_time in [0, 10]:
+            monitor.process_event({"type": "trigger", "quantifier_id": 0, "time": trigger_time, "line_number": 1})
+            for sub_expression_index in [0, 1]:
+                monitor.process_event({"type": "quantifier-expression", "quantifier_id": 1,
+                                       "sub_expression_index": sub_expression_index, "time": trigger_time})
+        first_window, second_window = monitor.quantifier_id_to_nodes[1]
+        monitor.process_event(self.signal(3, 20))
+        self.assertEqual(len(first_window.get_children()), 1)
+        self.assertEqual(second_window.get_children()[0].get_binding(), {0: 10})
+        # the first window closes without a branch that is not False, so its exists is False
+        monitor.process_event(self.signal(12, 20))
+        self.assertIs(first_window.get_value(), False)
+        self.assertEqual(list(monitor.quantifier_id_to_nodes[1]), [second_window])
+        self.assertEqual(second_window.get_children()[0].get_binding(), {0: 10, 1: 12})
+        self.assertIs(monitor.get_verdict(), False)
+
+    def test_closed_window_without_timestamps_is_false(self):
+        spec = exists(id=0, predicate=inTimeInterval([5, 8]), binding={}).check(
+            lambda binding: signal("s").at(binding[0]) < 10
+        )
+        monitor = Monitor(spec)
+        monitor.process_events([self.signal(1, 0), self.signal(4, 0)])
+        self.assertIsNone(monitor.get_verdict())
+        monitor.process_event(self.signal(9, 0))
+        self.assertIs(monitor.get_verdict(), False)
+
+    def test_closed_window_stays_false(self):
+        spec = forall(id=0, predicate=calls("f").during("g"), binding={}).check(
+            lambda binding: exists(
+                id=1, binding=binding, predicate=inTimeInterval([time(binding[0]), time(binding[0]) + 5])
+            ).check(lambda binding: signal("s").at(binding[1]) < 10)
+        )
+        monitor = Monitor(spec)
+        monitor.process_event({"type": "trigger", "quantifier_id": 0, "time": 0, "line_number": 1})
+        for sub_expression_index in [0, 1]:
+            monitor.process_event({"type": "quantifier-expression", "quantifier_id": 1,
+                                   "sub_expression_index": sub_expression_index, "time": 0})
+        window = next(iter(monitor.quantifier_id_to_nodes[1]))
+        # the window closes without a timestamp, and later samples cannot reopen it
+        monitor.process_events([self.signal(6, 0), self.signal(7, 0)])
+        self.assertIs(window.get_value(), False)
+        self.assertIs(monitor.get_verdict(), False)
+
+    def test_open_window_excludes_its_bounds(self):
+        spec = exists(id=0, predicate=inTimeInterval((5, 8)), binding={}).check(
+            lambda binding: signal("s").at(binding[0]) < 10
+        )
+        monitor = Monitor(spec)
+        monitor.process_events([self.signal(5, 0), self.signal(6, 20), self.signal(7, 20), self.signal(8, 20)])
+        self.assertIs(monitor.get_verdict(), False)
+        self.assertEqual([record["binding"] for record in monitor.get_measurements_for_db()], [{0: 6}, {0: 7}])
+
+    def test_closed_window_with_true_branch_is_true(self):
+        spec = exists(id=0, predicate=inTimeInterval([5, 8]), binding={}).check(
+            lambda binding: signal("s").at(binding[0]) < 10
+        )
+        monitor = Monitor(spec)
+        monitor.process_events([self.signal(5, 20), self.signal(8, 0), self.signal(9, 20)])
+        self.assertIs(monitor.get_verdict(), True)
+
+
+class TestSignalHistory(TestCase):
+
+    @staticmethod
+    def signal(time, value):
+        return {"type": "signal", "signal_name": "s", "value": value, "time": time}
+
+    def test_samples_are_looked_up_by_time(self):
+        history = SignalHistory()
+        for time, value in [(1, 10), (3, 30), (3, 31), (6, 60)]:
+            history.add(self.signal(time, value))
+        self.assertEqual(history.get_sample_at(0)["value"], 10)
+        # the most recent sample at a timestamp, otherwise the earliest sample after it
+        self.assertEqual(history.get_sample_at(3)["value"], 31)
+        self.assertEqual(history.get_sample_at(4)["value"], 60)
+        self.assertIsNone(history.get_sample_at(7))
+        # a late sample takes its place in time order
+        history.add(self.signal(5, 50))
+        self.assertEqual(history.get_sample_at(4)["value"], 50)
+        self.assertEqual(history.get_latest_time(), 6)
+
+    def test_samples_past_the_horizon_are_evicted(self):
+        history = SignalHistory(horizon=3)
+        for time in range(20):
+            history.add(self.signal(time, time))
+        self.assertEqual(len(history), 4)
+        self.assertEqual(history.get_sample_at(17)["value"], 17)
+        # timestamps before the horizon take the earliest sample that is left
+        self.assertEqual(history.get_sample_at(2)["value"], 16)
+
+    def test_monitor_derives_the_horizon_from_windows(self):
+        spec = forall(id=0, predicate=calls("f").during("g"), binding={}).check(
+            lambda binding: exists(
+                id=1, binding=binding, predicate=inTimeInterval([time(binding[0]) + 2, time(binding[0]) + 5])
+            ).check(lambda binding: signal("s").at(binding[1]) < 10)
+        )
+        monitor = Monitor(spec)
+        for sample_time in range(20):
+            monitor.process_event(self.signal(sample_time, 0))
+        self.assertEqual(len(monitor._signal_histories["s"]), 6)
+
+    def test_earlier_timestamps_take_the_samples_at_them(self):
+        spec = forall(id=0, predicate=inTimeInterval([4, 5]), binding={}).check(
+            lambda binding: signal("s").at(binding[0] + (-2)) < 10
+        )
+        monitor = Monitor(spec)
+        monitor.process_events([self.signal(sample_time, 0 if sample_time <= 3 else 20) for sample_time in range(7)])
+        # each binding refers to the signal two time units before the latest sample
+        self.assertEqual([(record["binding"], record["measurements"][0]["measurement_value"])
+                          for record in monitor.get_measurements_for_db()], [({0: 4}, 0), ({0: 5}, 0)])
+        monitor.wrap_up()
+        self.assertIs(monitor.get_verdict(), True)
+
+    def test_timestamp_zero_takes_the_sample_at_it(self):
+        spec = forall(id=0, predicate=inTimeInterval([0, 2]), binding={}).check(
+            lambda binding: signal("s").at(binding[0]) < 10
+        )
+        monitor = Monitor(spec)
+        samples = [(0, 50), (1, 0), (2, 0), (3, 0)]
+        monitor.process_events([self.signal(sample_time, value) for sample_time, value in samples])
+        # the binding at time 0 is resolved with the sample at time 0, which breaks the constraint
+        self.assertEqual([(record["binding"], record["measurements"][0]["measurement_value"])
+                          for record in monitor.get_measurements_for_db()], [({0: 0}, 50), ({0: 1}, 0), ({0: 2}, 0)])
+        monitor.wrap_up()
+        self.assertIs(monitor.get_verdict(), False)
+
+    def test_addition_giving_timestamp_zero_takes_the_sample_at_it(self):
+        spec = forall(id=0, predicate=inTimeInterval([2, 3]), binding={}).check(
+            lambda binding: signal("s").at(binding[0] + (-2)) < 10
+        )
+        monitor = Monitor(spec)
+        samples = [(0, 50), (1, 0), (2, 0), (3, 0)]
+        monitor.process_events([self.signal(sample_time, value) for sample_time, value in samples])
+        # the binding at time 2 refers to the signal at time 0
+        self.assertEqual([(record["binding"], record["measurements"][0]["measurement_value"])
+                          for record in monitor.get_measurements_for_db()], [({0: 2}, 50), ({0: 3}, 0)])
+        monitor.wrap_up()
+        self.assertIs(monitor.get_verdict(), False)
+
+
+class TestMonitorPruning(TestCase):
+
+    def setUp(self):
+        self.spec = forall(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: binding[0].duration() < 1
+        )
+        # every other binding is False
+        self.events = []
+        for i in range(10):
+            self.events.append({"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 2.0 * i,
+                                "line_number": 1})
+            self.events.append({"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0,
+                                "value": 0.5 + i % 2, "time": 2.0 * i + 1, "line_number": 2, "module_name": "m"})
+
+    def test_resolved_bindings_are_retired(self):
+        for tree_evaluation_strategy in ["up", "down"]:
+            monitor = Monitor(self.spec, tree_evaluation_strategy, prune=True)
+            monitor.process_events(self.events)
+            monitor.wrap_up()
+            self.assertFalse(monitor.get_verdict())
+            # only the root is left
+            self.assertEqual(monitor.get_tree_size(), 1)
+            self.assertEqual(monitor.get_number_of_retired_bindings(), 10)
+            # summaries are only kept for the False bindings
+            self.assertEqual([summary.get_value() for summary in monitor.get_binding_summaries()], [False] * 5)
+
+    def test_summaries_match_tree(self):
+        monitor = Monitor(self.spec)
+        monitor.process_events(self.events)
+        monitor.wrap_up()
+        pruned_monitor = Monitor(self.spec, prune=True, max_true_binding_summaries=10)
+        pruned_monitor.process_events(self.events)
+        pruned_monitor.wrap_up()
+        self.assertEqual(pruned_monitor.get_measurements_for_db(), monitor.get_measurements_for_db())
+        self.assertEqual(pruned_monitor.get_verdict_explanation(), monitor.get_verdict_explanation())
+        self.assertEqual(get_false_atoms_per_false_bindings(pruned_monitor),
+                         get_false_atoms_per_false_bindings(monitor))
+
+
+class TestMonitorScaling(TestCase):
+    """
+    Regression tests: the cost of processing an event should not grow with the number of quantifier nodes that
+    are still open (here, exists nodes waiting for a call that never happens).
+
+    The cost is measured by the number of nodes evaluated per event.  The timing benchmark depends on the load of
+    the machine, so it is only run if the environment variable SCSL_RUN_BENCHMARKS is set.
+    """
+
+    def setUp(self):
+        self.spec = forall(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: conjunction(
+                binding,
+                binding[0].duration() < 1,
+                exists(id=1, binding=binding, predicate=calls("g").during("p")).check(
+                    lambda binding: binding[1].duration() < 1
+                )
+            )
+        )
+
+    def _get_events(self, timestamp, duration):
+        return [
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": timestamp, "line_number": 1},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": duration,
+             "time": timestamp + 0.5, "line_number": 2, "module_name": "m"},
+        ]
+
+    def _get_monitor_with_open_nodes(self, number_of_open_nodes, prune):
+        monitor = Monitor(self.spec, prune=prune)
+        for timestamp in range(number_of_open_nodes):
+            monitor.process_events(self._get_events(timestamp, 0.5))
+        self.assertEqual(len(monitor.quantifier_id_to_nodes[1]), number_of_open_nodes)
+        return monitor, number_of_open_nodes
+
+    def _get_evaluations_per_event(self, number_of_open_nodes, prune):
+        monitor, timestamp = self._get_monitor_with_open_nodes(number_of_open_nodes, prune)
+        events = []
+        for _ in range(100):
+            events += self._get_events(timestamp, 2.0)
+            timestamp += 1
+        node_classes = [MonitorTreeConjunctionNode, MonitorTreeDisjunctionNode, MonitorTreeNegateNode,
+                        MonitorTreeAtomNode, MonitorTreeExpressionNode, MonitorTreeVariableNode,
+                        MonitorTreeLazyBranchNode, MonitorTreeQuantifierNode]
+        with contextlib.ExitStack() as stack:
+            evaluations = [stack.enter_context(mock.patch.object(node_class, "evaluate", autospec=True,
+                                                                 side_effect=node_class.evaluate))
+                           for node_class in node_classes]
+            monitor.process_events(events)
+        return sum(evaluation.call_count for evaluation in evaluations) / len(events)
+
+    def test_evaluations_per_event_do_not_grow_with_open_nodes(self):
+        for prune in [False, True]:
+            small = self._get_evaluations_per_event(200, prune)
+            large = self._get_evaluations_per_event(4000, prune)
+            self.assertGreater(small, 0)
+            # with 20 times as many open nodes, the same nodes are evaluated for each event
+            self.assertEqual(large, small)
+
+    def _get_time_per_event(self, number_of_open_nodes, prune):
+        monitor, timestamp = self._get_monitor_with_open_nodes(number_of_open_nodes, prune)
+        # take the fastest of several runs, to reduce noise
+        times = []
+        for _ in range(5):
+            events = []
+            for _ in range(100):
+                events += self._get_events(timestamp, 2.0)
+                timestamp += 1
+            start = timeit.default_timer()
+            monitor.process_events(events)
+            times.append((timeit.default_timer() - start) / len(events))
+        return min(times)
+
+    @skipUnless(os.environ.get("SCSL_RUN_BENCHMARKS"), "set SCSL_RUN_BENCHMARKS to run timing benchmarks")
+    def test_time_per_event_does_not_grow_with_open_nodes(self):
+        for prune in [False, True]:
+            small = self._get_time_per_event(200, prune)
+            large = self._get_time_per_event(4000, prune)
+            # with 20 times as many open nodes, the time per event should be about the same
+            self.assertLess(large, 4 * small)
+
+
+class TestMonitorStatistics(TestCase):
+
+    def setUp(self):
+        self.spec = forall(id=0, binding={}, predicate=calls("f").during("p")).check(
+            lambda binding: exists(id=1, binding=binding, predicate=calls("g").during("p")).check(
+                lambda binding: binding[1].duration() < 1
+            )
+        )
+        self.events = [
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 0, "line_number": 1},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 2.0,
+             "time": 0.5, "line_number": 2, "module_name": "m"},
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 0.5,
+             "time": 0.7, "line_number": 2, "module_name": "m"},
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 1, "line_number": 1},
+        ]
+
+    def test_histogram_quantiles(self):
+        histogram = LatencyHistogram()
+        for _ in range(99):
+            histogram.add(0.001)
+        histogram.add(2.0)
+        summary = histogram.summarise()
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["total"], 2.099)
+        self.assertEqual(summary["max"], 2.0)
+        # quantiles are given to within a quarter of a power of two
+        self.assertTrue(0.001 <= summary["p50"] <= 0.00125)
+        self.assertTrue(0.001 <= summary["p99"] <= 0.00125)
+        self.assertEqual(histogram.get_quantile(1.0), 2.0)
+        self.assertEqual(LatencyHistogram().get_quantile(0.5), 0.0)
+
+    def test_stats(self):
+        monitor = Monitor(self.spec)
+        monitor.process_events(self.events)
+        stats = monitor.stats()
+        self.assertEqual(stats["number_of_events"], 4)
+        self.assertEqual(stats["event_type_counts"], {"trigger": 2, "measurement": 2})
+        self.assertEqual(stats["event_processing_time"]["count"], 4)
+        self.assertEqual(stats["tree_size"], monitor.get_tree_size())
+        # the exists for the second binding is still waiting for a call
+        self.assertGreater(stats["open_nodes"], 0)
+
+    def test_open_nodes_are_counted_as_values_change(self):
+        events = self.events + [
+            {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": 0.5,
+             "time": 1.5, "line_number": 2, "module_name": "m"},
+            {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": 2, "line_number": 1},
+        ]
+        for prune in [False, True]:
+            monitor = Monitor(self.spec, prune=prune)
+            for event in events:
+                monitor.process_event(event)
+                # the running count agrees with a scan of the tree
+                self.assertEqual(monitor.stats()["open_nodes"],
+                                 sum(1 for node in monitor._all_nodes if node.get_value() is None))
+
+    def test_event_timing_interval(self):
+        monitor = Monitor(self.spec, event_timing_interval=2)
+        monitor.process_events(self.events)
+        self.assertEqual(monitor.stats()["event_processing_time"]["count"], 2)
+        self.assertGreater(monitor.get_event_processing_time(), 0)
+        # with timing switched off, events are still counted
+        monitor = Monitor(self.spec, event_timing_interval=0)
+        monitor.process_events(self.events)
+        self.assertEqual(monitor.stats()["event_processing_time"]["count"], 0)
+        self.assertEqual(monitor.stats()["event_type_counts"]["trigger"], 2)
+        self.assertEqual(monitor.get_event_processing_time(), 0.0)
+
+
+class TestSharedMemoryRingBuffer(TestCase):
+
+    def test_batches_wrap_around(self):
+        # use a small capacity so that records wrap around the end of the ring buffer, and writers wait for space
+        ring_buffer = SharedMemoryRingBuffer(capacity=512)
+        batches = [[{"type": "trigger", "spec_id": 0, "time": float(i), "line_number": j} for j in range(i % 4 + 1)]
+                   for i in range(50)]
+        received = []
+
+        def consume():
+            while True:
+                batch = ring_buffer.get(timeout=5)
+                if batch is None:
+                    return
+                received.append(batch)
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for batch in batches:
+            ring_buffer.put(batch)
+        ring_buffer.put_end_of_stream()
+        consumer.join()
+        ring_buffer.close()
+        self.assertEqual(received, batches)
+
+    def test_get_timeout(self):
+        ring_buffer = SharedMemoryRingBuffer(capacity=64)
+        with self.assertRaises(queue.Empty):
+            ring_buffer.get(timeout=0.01)
+        ring_buffer.close()
+
+    def test_record_too_large(self):
+        ring_buffer = SharedMemoryRingBuffer(capacity=256)
+        received = []
+
+        def consume():
+            while True:
+                batch = ring_buffer.get(timeout=5)
+                if batch is None:
+                    return
+                received.extend(batch)
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        # a batch that does not fit is written as several batches, and an event that does not fit is dropped,
+        # rather than raising in the program under scrutiny
+        events = [{"value": "x" * 20, "index": index} for index in range(8)]
+        with self.assertLogs(level='ERROR'):
+            ring_buffer.put(events[:4] + [{"value": "x" * 300}] + events[4:])
+        ring_buffer.put_end_of_stream()
+        consumer.join()
+        ring_buffer.close()
+        self.assertEqual(received, events)
+
+    def test_stopped_consumer(self):
+        ring_buffer = SharedMemoryRingBuffer(capacity=64)
+        ring_buffer.set_consumer_alive_check(lambda: False)
+        # the second batch does not fit, and is dropped rather than blocking
+        ring_buffer.put(list(range(20)))
+        ring_buffer.put(list(range(20, 40)))
+        self.assertEqual(ring_buffer.get(timeout=0), list(range(20)))
+        with self.assertRaises(queue.Empty):
+            ring_buffer.get(timeout=0)
+        ring_buffer.close()
+
+
+class TestCheckTraceForEachSpecification(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # two specifications, the second of which is violated by the trace
+        with open(os.path.join(self.directory, "compiled_spec.py"), "w") as h:
+            h.write("from SCSL.Specifications.builder import *\n"
+                    "from SCSL.Specifications.predicates import *\n"
+                    "specifications = [\n"
+                    "    forall(id=0, binding={}, predicate=calls('f').during('p')).check(\n"
+                    "        lambda binding: binding[0].duration() < 10),\n"
+                    "    forall(id=0, binding={}, predicate=calls('f').during('p')).check(\n"
+                    "        lambda binding: binding[0].duration() < 1),\n"
+                    "]\n")
+        self.trace_path = os.path.join(self.directory, "trace.jsonl")
+        with open(self.trace_path, "w") as h:
+            for spec_id in [0, 1]:
+                h.write(json.dumps({"type": "trigger", "spec_id": spec_id, "quantifier_id": 0, "time": 0.0,
+                                    "line_number": 1}) + "\n")
+            for spec_id in [0, 1]:
+                h.write(json.dumps({"type": "measurement", "spec_id": spec_id, "atom_index": 0, "subatom_index": 0,
+                                    "value": 2.0, "time": 2.0, "line_number": 2, "module_name": "m"}) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_specification_trace(self):
+        trace = SpecificationTrace(TraceFile(self.trace_path), 1)
+        self.assertEqual([event["spec_id"] for event in trace], [1, 1])
+        self.assertEqual(trace.peek_first_event()["spec_id"], 1)
+
+    def test_verdicts_per_specification(self):
+        spec_ids_to_results = check_trace_for_each_specification(
+            os.path.join(self.directory, "compiled_spec.py"), self.trace_path, [0, 1, 2], processes=2
+        )
+        self.assertTrue(spec_ids_to_results[0]["verdict"])
+        self.assertFalse(spec_ids_to_results[1]["verdict"])
+        self.assertEqual(spec_ids_to_results[1]["number_of_events"], 2)
+        self.assertIn("SIMPLE VERDICT: False", spec_ids_to_results[1]["output"])
+        # there are no events for the third spec id
+        self.assertIsNone(spec_ids_to_results[2])
+
+    def test_check_many_traces(self):
+        # write the events for the second specification to their own trace
+        second_trace_path = os.path.join(self.directory, "trace-1.jsonl.gz")
+        with gzip.open(second_trace_path, "wt") as h:
+            for event in SpecificationTrace(TraceFile(self.trace_path), 1):
+                h.write(json.dumps(event) + "\n")
+        checks = [(self.trace_path, None), (second_trace_path, None)]
+        results = list(check_traces(os.path.join(self.directory, "compiled_spec.py"), checks, processes=2))
+        # the spec id of each trace is given by its first event
+        self.assertEqual([r["spec_id"] for r in results], [0, 1])
+        self.assertEqual([r["verdict"] for r in results], [True, False])
+        self.assertEqual([r["trace_path"] for r in results], [self.trace_path, second_trace_path])
+
+
+class TestCheckTraceInShards(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.compiled_spec_path = os.path.join(self.directory, "compiled_spec.py")
+        with open(self.compiled_spec_path, "w") as h:
+            h.write("from SCSL.Specifications.builder import *\n"
+                    "from SCSL.Specifications.constraints import *\n"
+                    "from SCSL.Specifications.predicates import *\n"
+                    "specifications = [\n"
+                    "    forall(id=0, binding={}, predicate=changes('x').during('p')).check(\n"
+                    "        lambda binding: timeBetween(binding[0], binding[0].next(changes('y').during('p'))) < 0.2),\n"
+                    "]\n")
+        # every other binding violates the specification
+        self.trace_path = os.path.join(self.directory, "trace.jsonl")
+        time = 0.0
+        with open(self.trace_path, "w") as h:
+            for i in range(7):
+                time += 1.0
+                h.write(json.dumps({"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": time,
+                                    "line_number": i}) + "\n")
+                h.write(json.dumps({"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0,
+                                    "value": time, "time": time, "line_number": i, "module_name": "m"}) + "\n")
+                time += 0.1 if i % 2 == 0 else 0.3
+                h.write(json.dumps({"type": "function", "spec_id": 0, "atom_index": 0, "value": time, "time": time,
+                                    "line_number": 2, "module_name": "m", "function_name": "f"}) + "\n")
+                time += 0.01
+                h.write(json.dumps({"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 1,
+                                    "value": time, "time": time, "line_number": 3, "module_name": "m"}) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_binding_shard_trace(self):
+        shards = [BindingShardTrace(TraceFile(self.trace_path), 0, shard_index, 3) for shard_index in range(3)]
+        # triggers are dealt out in turn
+        self.assertEqual([[event["line_number"] for event in shard if event["type"] == "trigger"] for shard in shards],
+                         [[0, 3, 6], [1, 4], [2, 5]])
+        # measurements before the first trigger of a shard are dropped
+        self.assertEqual([list(shard)[0]["type"] for shard in shards], ["trigger"] * 3)
+        self.assertEqual([shard.get_number_of_events_read() for shard in shards], [28, 28, 28])
+
+    def test_shards_agree_with_single_check(self):
+        specification = load_specifications(self.compiled_spec_path)[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = check_trace(specification, TraceFile(self.trace_path), include_measurements=True)
+        results = check_trace_in_shards(self.compiled_spec_path, self.trace_path, number_of_shards=3, processes=2)
+        self.assertEqual(results["number_of_shards"], 3)
+        self.assertFalse(results["verdict"])
+        self.assertEqual(results["verdict"], expected["verdict"])
+        self.assertEqual(results["number_of_events"], 28)
+        self.assertEqual(results["measurements"], expected["measurements"])
+        # the same violations are diagnosed, in the same order
+        self.assertEqual(len(results["diagnosis"]), 3)
+        self.assertEqual([entry[1] for entry in results["diagnosis"]],
+                         [entry[1] for entry in expected["diagnosis"]])
+
+
+class TestDiagnosis(TestCase):
+
+    def setUp(self):
+        self.spec = forall(id=0, binding={}, predicate=changes("x").during("p")).check(
+            lambda binding: timeBetween(binding[0], binding[0].next(changes("y").during("p"))) < 0.2
+        )
+        # the first and third bindings violate the specification
+        self.trace = []
+        for start, calls in [(1.0, [1.05, 1.15, 1.25]), (2.0, [2.05]), (3.0, [3.1, 3.3])]:
+            self.trace += [
+                {"type": "trigger", "spec_id": 0, "quantifier_id": 0, "time": start, "line_number": 1},
+                {"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 0, "value": start,
+                 "time": start, "line_number": 1, "module_name": "m"},
+            ]
+            self.trace += [{"type": "function", "spec_id": 0, "atom_index": 0, "value": time, "time": time,
+                            "line_number": 10 + index, "module_name": "m", "function_name": f"f{index}"}
+                           for index, time in enumerate(calls)]
+            end = calls[-1] + 0.01
+            self.trace.append({"type": "measurement", "spec_id": 0, "atom_index": 0, "subatom_index": 1,
+                               "value": end, "time": end, "line_number": 2, "module_name": "m"})
+
+    def test_function_call_index(self):
+        history = FunctionCallIndex(self.trace).get_history(0)
+        calls, point_of_no_return_index = history.find_calls_in_window(1.0, 1.26, False, 1.2, False)
+        self.assertEqual([call["time"] for call in calls], [1.05, 1.15, 1.25])
+        self.assertEqual(point_of_no_return_index, 2)
+        # the end of the window is only included if asked for
+        calls, _ = history.find_calls_in_window(1.0, 1.25, False, 1.2, False)
+        self.assertEqual(len(calls), 2)
+        calls, _ = history.find_calls_in_window(1.0, 1.25, True, 1.2, False)
+        self.assertEqual(len(calls), 3)
+        # no call was made after the deadline
+        calls, point_of_no_return_index = history.find_calls_in_window(2.0, 2.06, False, 2.2, False)
+        self.assertEqual(point_of_no_return_index, len(calls))
+        self.assertEqual(FunctionCallIndex(self.trace).get_history(1).find_calls_in_window(0.0, 4.0, True, 0.0, True),
+                         ([], 0))
+
+    def test_bound_inclusivity_comes_from_the_comparison_of_the_atom(self):
+        atom = self.spec.compile().get_atoms()[0]
+        history = FunctionCallIndex(self.trace).get_history(0)
+        # a window ending at the time of the last call of the first binding excludes that call, since the atom
+        # compares with <
+        diagnosis = diagnose_false_atom(atom, {0: 1.0}, [1.0, 1.25], history)
+        self.assertEqual(len(diagnosis.get_calls()), 2)
+        with mock.patch.dict(ATOM_COMPARISONS, {type(atom): (operator.le, "<=")}):
+            diagnosis = diagnose_false_atom(atom, {0: 1.0}, [1.0, 1.25], history)
+        self.assertEqual(len(diagnosis.get_calls()), 3)
+
+    def test_each_violation_is_diagnosed_from_its_own_window(self):
+        for online_diagnosis in [False, True]:
+            monitor = Monitor(self.spec, online_diagnosis=online_diagnosis)
+            monitor.process_events(self.trace)
+            monitor.wrap_up()
+            with contextlib.redirect_stdout(io.StringIO()):
+                diagnosis, _ = get_diagnosis(self.spec, [] if online_diagnosis else self.trace, monitor)
+            self.assertEqual([(entry[1], entry[2], entry[3], entry[4]) for entry in diagnosis],
+                             [({0: 1.0}, 3, "f2", 12), ({0: 3.0}, 2, "f1", 11)])
+
+    def test_parallel_diagnosis(self):
+        monitor = Monitor(self.spec)
+        monitor.process_events(self.trace)
+        monitor.wrap_up()
+        falsifying_atoms = get_false_atoms_per_false_bindings(monitor)
+        entries = [violation_diagnosis.to_entry()
+                   for violation_diagnosis in diagnose_false_atoms(self.spec, self.trace, falsifying_atoms)]
+        # the diagnoses made by the worker processes are put back in the same order
+        self.assertEqual([violation_diagnosis.to_entry() for violation_diagnosis in
+                          diagnose_false_atoms(self.spec, self.trace, falsifying_atoms, processes=2)], entries)
+        self.assertEqual([entry[1:5] for entry in entries], [({0: 1.0}, 3, "f2", 12), ({0: 3.0}, 2, "f1", 11)])
+        # the windows were 1.26 - 1.0 and 3.31 - 3.0 long, with 0.2 allowed
+        self.assertAlmostEqual(entries[0][5], 0.06)
+        self.assertAlmostEqual(entries[1][5], 0.11)
+
+    def test_online_diagnosis(self):
+        monitor = Monitor(self.spec, online_diagnosis=True)
+        # the first violation is diagnosed as soon as its atom is False
+        monitor.process_events(self.trace[:6])
+        self.assertEqual([diagnosis.to_entry()[1:5] for diagnosis in monitor.get_violation_diagnoses()],
+                         [({0: 1.0}, 3, "f2", 12)])
+        monitor.process_events(self.trace[6:])
+        self.assertEqual(len(monitor.get_violation_diagnoses()), 2)
+        # the calls made during windows that have ended are not kept (apart from the most recent call)
+        self.assertEqual(len(monitor._function_call_histories[0]), 1)
+
+    def test_false_bindings_are_tracked(self):
+        for tree_evaluation_strategy in ["up", "down"]:
+            monitor = Monitor(self.spec, tree_evaluation_strategy=tree_evaluation_strategy)
+            monitor.process_events(self.trace)
+            monitor.wrap_up()
+            self.assertEqual([node.get_binding() for node in monitor.get_false_binding_nodes()],
+                             [{0: 1.0}, {0: 3.0}])
+            self.assertEqual([false_atom[1] for false_atom in get_false_atoms_per_false_bindings(monitor)],
+                             [{0: 1.0}, {0: 3.0}])
+        # bindings whose subtrees are retired are no longer held by the monitor
+        monitor = Monitor(self.spec, prune=True)
+        monitor.process_events(self.trace)
+        monitor.wrap_up()
+        self.assertEqual(monitor.get_false_binding_nodes(), [])
+        self.assertEqual([false_atom[1] for false_atom in get_false_atoms_per_false_bindings(monitor)],
+                         [{0: 1.0}, {0: 3.0}])
+
+
+class TestDiagnosisAggregation(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        runs = [
+            [["a < 0.2", {"0": 1.0}, 3, "f", 10, 0.05], ["a < 0.2", {"0": 2.0}, 1, "g", 20, 0.5]],
+            # written before overruns were recorded
+            [["a < 0.2", {"0": 1.0}, 2, "f", 11]],
+        ]
+        for run_index, diagnosis in enumerate(runs):
+            path = os.path.join(self.directory, f"diagnosis-{run_index}.json")
+            with open(path, "w") as out_file:
+                json.dump(diagnosis, out_file)
+            self.paths.append(path)
+        self.trace_path = os.path.join(self.directory, "trace.jsonl")
+        with open(self.trace_path, "w") as out_file:
+            for function_name in ["f", "f", "f", "f", "g"]:
+                out_file.write(json.dumps({"type": "function", "function_name": function_name}) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rankings(self):
+        summary = aggregate_diagnoses(self.paths, [self.trace_path], processes=1)
+        self.assertEqual(summary.get_number_of_violations(), 3)
+        self.assertEqual([(function["function_name"], function["pnr_count"], function["pnr_rate"])
+                          for function in summary.get_function_ranking()],
+                         [("f", 2, 0.5), ("g", 1, 1.0)])
+        # only one of the violations at f has an overrun
+        self.assertEqual(summary.get_function_ranking()[0]["overrun"]["count"], 1)
+        self.assertEqual(summary.get_overruns().get_max(), 0.5)
+        self.assertEqual([(hotspot["function_name"], hotspot["line_number"], hotspot["pnr_count"])
+                          for hotspot in summary.get_line_hotspots()],
+                         [("f", 10, 1), ("f", 11, 1), ("g", 20, 1)])
+        # the files are read by worker processes in the same way
+        self.assertEqual(aggregate_diagnoses(self.paths, [self.trace_path], processes=2).to_dict(), summary.to_dict())
+
+    def test_incremental_update(self):
+        summary = aggregate_diagnoses(self.paths[:1], processes=1)
+        # the summary is written as JSON between runs
+        summary = DiagnosisSummary.from_dict(json.loads(json.dumps(summary.to_dict())))
+        summary = aggregate_diagnoses(self.paths, summary=summary, processes=1)
+        self.assertEqual(summary.to_dict(), aggregate_diagnoses(self.paths, processes=1).to_dict())
+        # files that are already covered are not read again, unless they have been written since
+        self.assertEqual(aggregate_diagnoses(self.paths, summary=summary, processes=1).get_number_of_violations(), 3)
+
+    def test_rewritten_files_replace_their_old_entries(self):
+        summary = aggregate_diagnoses(self.paths, processes=1)
+        # the next run writes the same file again, with two violations at h instead of one at f
+        with open(self.paths[1], "w") as out_file:
+            json.dump([["a < 0.2", {"0": 5.0}, 2, "h", 30, 0.1], ["a < 0.2", {"0": 6.0}, 2, "h", 30, 0.7]], out_file)
+        summary = DiagnosisSummary.from_dict(json.loads(json.dumps(summary.to_dict())))
+        summary = aggregate_diagnoses(self.paths, summary=summary, processes=1)
+        self.assertEqual(summary.get_number_of_violations(), 4)
+        self.assertEqual([(function["function_name"], function["pnr_count"])
+                          for function in summary.get_function_ranking()],
+                         [("h", 2), ("f", 1), ("g", 1)])
+        self.assertEqual([hotspot["line_number"] for hotspot in summary.get_line_hotspots()], [30, 10, 20])
+        self.assertEqual(summary.get_overruns().get_max(), 0.7)
+        self.assertEqual(summary.to_dict(), aggregate_diagnoses(self.paths, processes=1).to_dict())
+
+
+class TestCommandLineHelpers(TestCase):
+
+    def test_split_paths(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.assertEqual(split_paths(["a.json", "b.json", directory]),
+                             (["a.json", "b.json"], pathlib.Path(directory)))
+            self.assertEqual(split_paths([directory]), ([directory], pathlib.Path('.')))
+            self.assertEqual(split_paths(["a.json"]), (["a.json"], pathlib.Path('.')))
+        finally:
+            os.rmdir(directory)
+
+    def test_expand_trace_patterns(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ["trace-1.jsonl", "trace-0.jsonl", "other.json"]:
+                open(os.path.join(directory, name), "w").close()
+            other_path = os.path.join(directory, "other.json")
+            pattern = os.path.join(directory, "trace-*.jsonl")
+            self.assertEqual(expand_trace_patterns([other_path, pattern, other_path]),
+                             [other_path, os.path.join(directory, "trace-0.jsonl"),
+                              os.path.join(directory, "trace-1.jsonl")])
+        finally:
+            shutil.rmtree(directory)
 
+    def test_get_output_suffix(self):
+        self.assertEqual(get_output_suffix("traces/trace-3.jsonl.gz", None, False), "trace-3")
+        self.assertEqual(get_output_suffix("traces/trace-3.json", 2, False), "trace-3-2")
+        self.assertEqual(get_output_suffix("traces/trace-3.json", 2, True), "2")